@@ -2,11 +2,16 @@
 :copyright: 2010-2015 by Ronny Pfannschmidt
 :license: MIT
 """
+import asyncio
 import os
 import warnings
 
+from ._cache import VersionCache
 from ._entrypoints import _call_entrypoint_fn
+from ._entrypoints import _call_entrypoint_fn_async
 from ._entrypoints import _version_from_entrypoints
+from ._entrypoints import _version_from_entrypoints_async
+from ._instrument import instrument
 from ._overrides import _read_pretended_version_for
 from ._overrides import PRETEND_KEY
 from ._overrides import PRETEND_KEY_NAMED
@@ -18,8 +23,11 @@ from .config import DEFAULT_LOCAL_SCHEME
 from .config import DEFAULT_TAG_REGEX
 from .config import DEFAULT_VERSION_SCHEME
 from .discover import iter_matching_entrypoints
+from .git import iter_history
+from .git import parse_batch
 from .utils import function_has_arg
 from .utils import trace
+from .version import _resolve_schemes
 from .version import format_version
 from .version import meta
 
@@ -71,6 +79,13 @@ def _do_parse(config):
     if pretended is not None:
         return pretended
 
+    cache = VersionCache.from_config(config)
+    if cache is not None:
+        state = cache.fingerprint()
+        version = cache.load(state)
+        if version is not None:
+            return version
+
     if config.parse:
         parse_result = _call_entrypoint_fn(config.absolute_root, config, config.parse)
         if isinstance(parse_result, str):
@@ -85,8 +100,52 @@ def _do_parse(config):
         )
 
     if version:
+        if cache is not None:
+            cache.store(state, version)
         return version
 
+    _raise_version_not_found(config)
+
+
+async def _do_parse_async(config):
+    pretended = _read_pretended_version_for(config)
+    if pretended is not None:
+        return pretended
+
+    cache = VersionCache.from_config(config)
+    if cache is not None:
+        state = cache.fingerprint()
+        loop = asyncio.get_event_loop()
+        version = await loop.run_in_executor(None, cache.load, state)
+        if version is not None:
+            return version
+
+    if config.parse:
+        parse_result = await _call_entrypoint_fn_async(
+            config.absolute_root, config, config.parse
+        )
+        if isinstance(parse_result, str):
+            raise TypeError(
+                "version parse result was a string\nplease return a parsed version"
+            )
+        version = parse_result or await _version_from_entrypoints_async(
+            config, fallback=True
+        )
+    else:
+        # include fallbacks after dropping them from the main entrypoint
+        version = await _version_from_entrypoints_async(
+            config
+        ) or await _version_from_entrypoints_async(config, fallback=True)
+
+    if version:
+        if cache is not None:
+            cache.store(state, version)
+        return version
+
+    _raise_version_not_found(config)
+
+
+def _raise_version_not_found(config):
     raise LookupError(
         "setuptools-scm was unable to detect version for %r.\n\n"
         "Make sure you're either building from a fully intact git repository "
@@ -116,6 +175,12 @@ def get_version(
     version_cls=None,
     normalize=True,
     search_parent_directories=False,
+    git_backend="cli",
+    parallel_queries=False,
+    dirty_strategy="status",
+    version_cache=False,
+    describe_engine="cli",
+    rev=None,
 ):
     """
     If supplied, relative_to should be a file from which root may
@@ -128,15 +193,174 @@ def get_version(
     return _get_version(config)
 
 
-def _get_version(config):
-    parsed_version = _do_parse(config)
+async def get_version_async(
+    root=".",
+    version_scheme=DEFAULT_VERSION_SCHEME,
+    local_scheme=DEFAULT_LOCAL_SCHEME,
+    write_to=None,
+    write_to_template=None,
+    relative_to=None,
+    tag_regex=DEFAULT_TAG_REGEX,
+    parentdir_prefix_version=None,
+    fallback_version=None,
+    fallback_root=".",
+    parse=None,
+    git_describe_command=None,
+    dist_name=None,
+    version_cls=None,
+    normalize=True,
+    search_parent_directories=False,
+    git_backend="cli",
+    parallel_queries=False,
+    dirty_strategy="status",
+    version_cache=False,
+    describe_engine="cli",
+    rev=None,
+):
+    """
+    asyncio variant of ``get_version``
+
+    scm queries run as asyncio subprocesses, independent ones concurrently
+    """
+
+    config = Configuration(**locals())
+    return await _get_version_async(config)
+
+
+def get_versions(configs):
+    """
+    compute the versions of several distributions, keyed on their ``dist_name``
+
+    ``configs`` are ``Configuration`` instances or mappings of ``get_version``
+    arguments, those of the same git checkout share one snapshot of it,
+    see ``git.parse_batch``, anything else is computed like ``get_version`` does
+    """
+    configs = [_as_configuration(config) for config in configs]
+    names = [config.dist_name for config in configs]
+    if None in names:
+        raise ValueError("get_versions needs a dist_name for every configuration")
+    if len(set(names)) != len(names):
+        raise ValueError(f"duplicate dist_name in {names}")
+
+    pending = [config for config in configs if not _read_pretended_version_for(config)]
+    parsed = dict(zip(map(id, pending), parse_batch(pending)))
+    # the scheme entrypoints are looked up once instead of per configuration
+    schemes = {}
+    versions = {}
+    for config in configs:
+        version = parsed.get(id(config)) or _do_parse(config)
+        version_string = _format(config, version, schemes)
+        _dump(config, version_string)
+        versions[config.dist_name] = version_string
+    return versions
+
+
+def iter_versions(config):
+    """
+    yield ``(sha, version)`` for every commit of the git checkout of ``config``
+    reachable from ``config.rev`` (HEAD by default), parents before their children
+
+    ``config`` is a ``Configuration`` or a mapping of ``get_version`` arguments,
+    the history is walked once, see ``git.iter_history``
+    """
+    config = _as_configuration(config)
+    schemes = {}
+    for sha, version in iter_history(config, config.rev or "HEAD"):
+        yield sha, _format(config, version, schemes)
+
+
+def _as_configuration(config):
+    return config if isinstance(config, Configuration) else Configuration(**config)
+
+
+# formatted versions computed by the setuptools hooks and the cli
+_version_memo = {}
+# environment variables that change the computed version
+_MEMO_ENV_KEYS = (PRETEND_KEY, "SOURCE_DATE_EPOCH", "SETUPTOOLS_SCM_IGNORE_VCS_ROOTS")
 
-    if parsed_version:
-        version_string = format_version(
-            parsed_version,
-            version_scheme=config.version_scheme,
-            local_scheme=config.local_scheme,
+
+def clear_cache():
+    """forget the versions memoized by the setuptools hooks and the cli"""
+    _version_memo.clear()
+
+
+def _memo_key(config):
+    values = [
+        config.absolute_root,
+        config.fallback_root,
+        config.version_scheme,
+        config.local_scheme,
+        config.tag_regex.pattern,
+        config.tag_regex.flags,
+        config.parentdir_prefix_version,
+        config.fallback_version,
+        config.parse,
+        config.git_describe_command,
+        config.dist_name,
+        config.version_cls,
+        config.search_parent_directories,
+        config.git_backend,
+        config.dirty_strategy,
+        config.describe_engine,
+        config.rev,
+    ]
+    env_keys = list(_MEMO_ENV_KEYS)
+    if config.dist_name is not None:
+        env_keys.append(PRETEND_KEY_NAMED.format(name=config.dist_name.upper()))
+    values.extend(os.environ.get(key) for key in env_keys)
+    return tuple(tuple(v) if isinstance(v, list) else v for v in values)
+
+
+def _get_version(config, memoize=False):
+    """
+    compute the formatted version for ``config``
+
+    with ``memoize`` the result is kept for the lifetime of the process
+    and reused for equivalent configurations until ``clear_cache`` is called
+    """
+    if not memoize:
+        return _format_and_dump(config, _do_parse(config))
+    key = _memo_key(config)
+    try:
+        version_string = _version_memo[key]
+    except TypeError:
+        trace("unhashable configuration, not memoized")
+        return _format_and_dump(config, _do_parse(config))
+    except KeyError:
+        version_string = _version_memo[key] = _format(config, _do_parse(config))
+    else:
+        trace("memoized version", version_string)
+    _dump(config, version_string)
+    return version_string
+
+
+async def _get_version_async(config):
+    return _format_and_dump(config, await _do_parse_async(config))
+
+
+def _format(config, parsed_version, schemes=None):
+    """
+    format ``parsed_version``, ``schemes`` keeps the resolved
+    scheme entrypoints when formatting many versions
+    """
+    if not parsed_version:
+        return None
+    version_scheme = config.version_scheme
+    local_scheme = config.local_scheme
+    if schemes is not None:
+        version_scheme = _resolve_schemes(
+            schemes, "setuptools_scm.version_scheme", version_scheme
         )
+        local_scheme = _resolve_schemes(
+            schemes, "setuptools_scm.local_scheme", local_scheme
+        )
+    return format_version(
+        parsed_version, version_scheme=version_scheme, local_scheme=local_scheme
+    )
+
+
+def _dump(config, version_string):
+    if version_string:
         dump_version(
             root=config.root,
             version=version_string,
@@ -144,12 +368,21 @@ def _get_version(config):
             template=config.write_to_template,
         )
 
-        return version_string
+
+def _format_and_dump(config, parsed_version):
+    version_string = _format(config, parsed_version)
+    _dump(config, version_string)
+    return version_string
 
 
 # Public API
 __all__ = [
     "get_version",
+    "get_version_async",
+    "get_versions",
+    "iter_versions",
+    "instrument",
+    "clear_cache",
     "dump_version",
     "version_from_scm",
     "Configuration",
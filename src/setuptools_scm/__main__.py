@@ -3,6 +3,7 @@ import os
 import warnings
 
 from setuptools_scm import _get_version
+from setuptools_scm import iter_versions
 from setuptools_scm.config import Configuration
 from setuptools_scm.discover import walk_potential_roots
 from setuptools_scm.integration import find_files
@@ -21,8 +22,15 @@ def main() -> None:
         # no pyproject.toml OR no [tool.setuptools_scm]
         warnings.warn(f"{ex}. Using default configuration.")
         config = Configuration(root)
+    if opts.rev is not None:
+        config.rev = opts.rev
 
-    print(_get_version(config))
+    if opts.command == "history":
+        for sha, version in iter_versions(config):
+            print(sha, version)
+        return
+
+    print(_get_version(config, memoize=True))
 
     if opts.command == "ls":
         for fname in find_files(config.root):
@@ -48,10 +56,18 @@ def _get_cli_opts():
         help="path to 'pyproject.toml' with setuptools_scm config, "
         "default: looked up in the current or parent directories",
     )
+    parser.add_argument(
+        "--rev",
+        default=None,
+        help="compute the version of this revision instead of the checkout,"
+        " without checking it out",
+    )
     sub = parser.add_subparsers(title="extra commands", dest="command", metavar="")
     # We avoid `metavar` to prevent printing repetitive information
     desc = "List files managed by the SCM"
     sub.add_parser("ls", help=desc[0].lower() + desc[1:], description=desc)
+    desc = "List the version of every commit, parents before their children"
+    sub.add_parser("history", help=desc[0].lower() + desc[1:], description=desc)
     return parser.parse_args()
 
 
@@ -0,0 +1,300 @@
+"""
+persistent version cache stored in the git dir
+
+a build runs the version computation in several processes (egg_info, sdist,
+wheel), the cache lets all but the first skip the git queries
+as long as the repository state they depend on is unchanged
+
+if only HEAD moved forward the cached version is advanced
+by the commits in between instead of running ``git describe`` again
+"""
+import hashlib
+import json
+import os
+import tempfile
+from datetime import datetime
+
+from ._git_repo import GitRepository
+from ._git_repo import READ_ERRORS
+from .utils import trace
+from .version import ScmVersion
+
+# bump when the stored fields or their meaning change
+CACHE_FORMAT = 1
+CACHE_DIR = "setuptools_scm"
+CACHE_FILE = "version-cache.json"
+# abbreviated sha, committer date, parents and tags of the commits between two heads
+ADVANCE_LOG = [
+    "git",
+    "log",
+    "--decorate=short",
+    "--decorate-refs=refs/tags/",
+    "--format=%h%x00%cI%x00%P%x00%D",
+]
+
+
+def write_json(path, data):
+    """write ``data`` to ``path``, creating its directory if needed"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # concurrent builds each write a complete file and rename it into place
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path), dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fp:
+            # dumps uses the c encoder, dump writes piecewise
+            fp.write(json.dumps(data))
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def _tag_dirs_key(refs_dir):
+    """mtimes of all tag directories, they change whenever a loose tag is written"""
+    top = os.path.join(refs_dir, "tags")
+    return sorted(
+        [os.path.relpath(dirpath, top), os.stat(dirpath).st_mtime_ns]
+        for dirpath, _, _ in os.walk(top)
+    )
+
+
+def config_key(config):
+    """hash of the configuration values a parsed version depends on"""
+    values = [
+        CACHE_FORMAT,
+        config.absolute_root,
+        config.tag_regex.pattern,
+        config.tag_regex.flags,
+        config.git_describe_command,
+        config.git_backend,
+        config.dirty_strategy,
+        config.describe_engine,
+        f"{config.version_cls.__module__}.{config.version_cls.__qualname__}",
+    ]
+    return hashlib.sha1(json.dumps(values).encode("utf-8")).hexdigest()
+
+
+def _dump_version(version):
+    return {
+        "tag": str(version.tag),
+        "preformatted": version.preformatted,
+        # an exact tag with local changes has distance 0, dirty is checked again
+        "distance": version.distance or None,
+        "node": version.node,
+        "branch": version.branch,
+        "node_date": version.node_date and version.node_date.isoformat(),
+    }
+
+
+def _branch_of(ref):
+    """the branch git parsing reports for a HEAD pointing at ``ref``"""
+    if ref is None:
+        return "HEAD"
+    if ref.startswith("refs/heads/"):
+        return ref[len("refs/heads/") :]
+    return None
+
+
+def _load_version(data, config, dirty):
+    tag = data["tag"]
+    if not data["preformatted"]:
+        tag = config.version_cls(tag)
+    node_date = data["node_date"]
+    if node_date is not None:
+        node_date = datetime.strptime(node_date, "%Y-%m-%d").date()
+    return ScmVersion(
+        tag,
+        distance=data["distance"],
+        node=data["node"],
+        dirty=dirty,
+        preformatted=data["preformatted"],
+        branch=data["branch"],
+        config=config,
+        node_date=node_date,
+    )
+
+
+def _scan_advance(root, start, end):
+    """
+    ``(count, node, node_date)`` of the commits from ``start`` to ``end``,
+    None if one of them is tagged or ``start`` isn't an ancestor of ``end``
+    """
+    from .git import _parse_head_date
+    from .git import GitWorkdir
+
+    wd = GitWorkdir(root)
+    count, node, node_date = 0, None, None
+    # the old HEAD is an ancestor if it is the parent of a commit in between
+    ancestor = False
+    # newest first, HEAD comes first
+    for line in wd.iter_lines(ADVANCE_LOG + [f"{start}..{end}", "--"]):
+        abbrev, committed, parents, tags = line.split("\0")
+        if tags:
+            trace("version cache can't advance over", tags)
+            return None
+        if node is None:
+            node, node_date = "g" + abbrev, _parse_head_date(committed)
+        ancestor = ancestor or start in parents.split()
+        count += 1
+    if not ancestor:
+        return None
+    return count, node, node_date
+
+
+class VersionCache:
+    """the cache entry of one configuration in one git checkout"""
+
+    def __init__(self, config, repo):
+        self.config = config
+        self.repo = repo
+        self.path = os.path.join(repo.git_dir, CACHE_DIR, CACHE_FILE)
+        self.key = config_key(config)
+
+    @classmethod
+    def from_config(cls, config):
+        """return the cache for ``config``, or None if it can't be used"""
+        if not config.version_cache or config.parse is not None:
+            return None
+        if config.rev is not None:
+            # the fingerprint only covers HEAD
+            return None
+        try:
+            repo = GitRepository.from_worktree(config.absolute_root)
+        except READ_ERRORS as e:
+            trace("version cache unavailable", e)
+            return None
+        if repo is None:
+            return None
+        return cls(config, repo)
+
+    def fingerprint(self):
+        """
+        a cheap summary of the repository state, None if there is no HEAD commit
+
+        the dirty state isn't part of it, it is always checked again
+        """
+        try:
+            ref, sha = self.repo.head()
+            if sha is None:
+                return None
+            refs_dir = os.path.join(self.repo.common_dir, "refs")
+            return {
+                "head": [ref, sha],
+                "packed-refs": _stat_key(
+                    os.path.join(self.repo.common_dir, "packed-refs")
+                ),
+                "tags": _tag_dirs_key(refs_dir),
+                "shallow": _stat_key(os.path.join(self.repo.common_dir, "shallow")),
+                "index": _stat_key(os.path.join(self.repo.git_dir, "index")),
+            }
+        except READ_ERRORS as e:
+            trace("version cache fingerprint failed", e)
+            return None
+
+    def _read(self):
+        try:
+            with open(self.path, encoding="utf-8") as fp:
+                entries = json.load(fp)
+        except (OSError, ValueError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def is_dirty(self):
+        from .git import GitWorkdir
+
+        wd = GitWorkdir(self.config.absolute_root)
+        return wd.is_dirty(self.config.dirty_strategy)
+
+    def _advance(self, entry, fingerprint):
+        """
+        the cached version data moved to the HEAD of ``fingerprint``,
+        None unless HEAD only moved forward to commits without tags
+
+        the tags are unchanged, so the cached tag is still the nearest one
+        and the distance grows by the number of commits HEAD moved
+        """
+        from .git import _describe_filter
+
+        old = entry.get("fingerprint")
+        data = entry.get("version")
+        if not isinstance(old, dict) or not isinstance(data, dict):
+            return None
+        if dict(old, head=None, index=None) != dict(fingerprint, head=None, index=None):
+            return None
+        if _describe_filter(self.config.git_describe_command) is None:
+            # only describe options that don't change the distance are understood
+            return None
+        try:
+            start, end = old["head"][1], fingerprint["head"][1]
+            branch = _branch_of(fingerprint["head"][0])
+        except (KeyError, TypeError, IndexError):
+            return None
+        if start == end:
+            return dict(data, branch=branch)
+
+        scanned = _scan_advance(self.config.absolute_root, start, end)
+        if scanned is None:
+            return None
+        count, node, node_date = scanned
+        return dict(
+            data,
+            distance=(data.get("distance") or 0) + count,
+            node=node,
+            branch=branch,
+            node_date=node_date and node_date.isoformat(),
+        )
+
+    def load(self, fingerprint):
+        """
+        return the cached version if it matches ``fingerprint``,
+        or if it can be advanced to it
+        """
+        entry = self._read().get(self.key)
+        if fingerprint is None or not isinstance(entry, dict):
+            return None
+        data = entry.get("version")
+        if entry.get("fingerprint") != fingerprint:
+            data = self._advance(entry, fingerprint)
+            if data is None:
+                return None
+            self._store_data(fingerprint, data)
+        try:
+            version = _load_version(data, self.config, self.is_dirty())
+        except (KeyError, TypeError, ValueError, OSError) as e:
+            trace("unusable version cache entry", e)
+            return None
+        trace("version cache hit", version)
+        return version
+
+    def store(self, before, version):
+        """
+        store ``version`` which was computed with the repository state ``before``
+
+        the index may have been refreshed while parsing,
+        anything else changing means the version may already be outdated
+        """
+        if before is None or not isinstance(version, ScmVersion):
+            return
+        if not (version.node or "").startswith("g"):
+            # only git parsed versions are keyed on the git state
+            return
+        self._store_data(before, _dump_version(version))
+
+    def _store_data(self, before, data):
+        after = self.fingerprint()
+        if after is None or dict(before, index=None) != dict(after, index=None):
+            return
+        entries = self._read()
+        entries[self.key] = {"fingerprint": after, "version": data}
+        try:
+            write_json(self.path, entries)
+        except OSError as e:
+            trace("unable to write version cache", e)
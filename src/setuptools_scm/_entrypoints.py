@@ -1,3 +1,7 @@
+import asyncio
+import functools
+import inspect
+import sys
 import warnings
 from typing import Optional
 
@@ -36,6 +40,48 @@ def _version_from_entrypoints(config: Configuration, fallback=False):
             return version
 
 
+def _async_variant(fn):
+    """find the ``<name>_async`` coroutine function next to a parse function"""
+    module = sys.modules.get(getattr(fn, "__module__", None))
+    variant = getattr(module, getattr(fn, "__name__", "") + "_async", None)
+    if inspect.iscoroutinefunction(variant):
+        return variant
+    return None
+
+
+async def _call_entrypoint_fn_async(root, config, fn):
+    """
+    call a parse function without blocking the event loop
+
+    coroutine functions and functions with an ``_async`` variant are awaited,
+    anything else runs in the default executor
+    """
+    if not inspect.iscoroutinefunction(fn):
+        variant = _async_variant(fn)
+        if variant is None:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(
+                None, functools.partial(_call_entrypoint_fn, root, config, fn)
+            )
+        fn = variant
+    return await fn(root, config=config)
+
+
+async def _version_from_entrypoints_async(config: Configuration, fallback=False):
+    if fallback:
+        entrypoint = "setuptools_scm.parse_scm_fallback"
+        root = config.fallback_root
+    else:
+        entrypoint = "setuptools_scm.parse_scm"
+        root = config.absolute_root
+
+    for ep in iter_matching_entrypoints(root, entrypoint, config):
+        version = await _call_entrypoint_fn_async(root, config, ep.load())
+        trace(ep, version)
+        if version:
+            return version
+
+
 try:
     from importlib.metadata import entry_points  # type: ignore
 except ImportError:
@@ -0,0 +1,72 @@
+"""
+persistent cache of the file finder listings stored in the scm metadata dir
+
+``egg_info``, ``sdist`` and ``build_py`` each list the scm files, often in
+separate processes, the cache lets all but the first reuse the listing
+as long as the state it was keyed on is unchanged
+"""
+import json
+import os
+
+from ._cache import CACHE_DIR
+from ._cache import write_json
+from .utils import trace
+
+FILE_LIST_CACHE_KEY = "SETUPTOOLS_SCM_FILE_LIST_CACHE"
+# bump when the stored fields or their meaning change
+FILE_LIST_FORMAT = 1
+FILE_LIST_FILE = "file-list.json"
+
+
+class FileListCache:
+    """
+    the listing of one checkout
+
+    files and directories are stored relative to the toplevel,
+    the key and any extra data are up to the file finder
+    """
+
+    def __init__(self, meta_dir, toplevel):
+        self.path = os.path.join(meta_dir, CACHE_DIR, FILE_LIST_FILE)
+        self.toplevel = toplevel
+        self.prefix = toplevel + os.path.sep
+
+    @classmethod
+    def from_env(cls, meta_dir, toplevel):
+        """return the cache if it is enabled, else None"""
+        if not os.environ.get(FILE_LIST_CACHE_KEY):
+            return None
+        return cls(meta_dir, toplevel)
+
+    def load(self):
+        """the stored entry, None if there is none that can be used"""
+        try:
+            with open(self.path, encoding="utf-8") as fp:
+                entry = json.load(fp)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or entry.get("format") != FILE_LIST_FORMAT:
+            return None
+        return entry
+
+    def listing(self, entry):
+        """``(files, dirs)`` of a loaded entry"""
+        prefix = self.prefix
+        files = {prefix + name for name in entry["files"]}
+        dirs = {prefix + name for name in entry["dirs"]}
+        dirs.add(self.toplevel)
+        return files, dirs
+
+    def store(self, key, files, dirs, **extra):
+        start = len(self.prefix)
+        entry = dict(
+            extra,
+            format=FILE_LIST_FORMAT,
+            key=key,
+            files=[name[start:] for name in files],
+            dirs=[name[start:] for name in dirs if name != self.toplevel],
+        )
+        try:
+            write_json(self.path, entry)
+        except OSError as e:
+            trace("unable to write file list cache", e)
@@ -0,0 +1,722 @@
+"""
+read-only access to git metadata without running git
+
+only plain checkouts on a normal filesystem are supported,
+anything else raises ``UnsupportedRepository`` so callers can use the git cli
+"""
+import mmap
+import os
+import struct
+import zlib
+
+from .utils import trace
+
+_SHA_LEN = 40
+_OBJECT_TYPES = {1: "commit", 2: "tree", 3: "blob", 4: "tag"}
+_OFS_DELTA = 6
+_REF_DELTA = 7
+# extensions that don't change how refs and objects are stored
+_KNOWN_EXTENSIONS = {"noop", "noop-v1", "preciousobjects", "partialclone"}
+_PER_WORKTREE_REFS = ("HEAD", "refs/bisect/", "refs/worktree/", "refs/rewritten/")
+_GRAPH_NO_PARENT = 0x70000000
+_GRAPH_LAST_EDGE = 0x80000000
+_INDEX_EXTENDED = 0x4000
+_INDEX_NAME_MASK = 0xFFF
+# in the extended flags of version 3 and 4 index entries
+_INDEX_SKIP_WORKTREE = 0x4000
+_MODE_TREE = 0o040000
+_MODE_GITLINK = 0o160000
+# index extensions that move entries out of the entry list
+_INDEX_SPLIT_EXTENSIONS = (b"link", b"sdir")
+
+
+class UnsupportedRepository(Exception):
+    """the repository uses a layout or feature the reader does not implement"""
+
+
+# everything that indicates the cli should be asked instead
+READ_ERRORS = (UnsupportedRepository, OSError, ValueError, zlib.error)
+
+
+def find_git_dir(worktree):
+    """
+    return the git dir of ``worktree`` if it is the toplevel of a checkout
+
+    both ``.git`` directories and ``.git`` files (worktrees, submodules)
+    are supported, None is returned if there is neither
+    """
+    dotgit = os.path.join(worktree, ".git")
+    if os.path.isdir(dotgit):
+        return dotgit
+    if os.path.isfile(dotgit):
+        with open(dotgit, encoding="utf-8") as fp:
+            content = fp.read().strip()
+        if content.startswith("gitdir: "):
+            return os.path.join(worktree, content[len("gitdir: ") :])
+    return None
+
+
+def _read_text(path):
+    try:
+        with open(path, encoding="utf-8") as fp:
+            return fp.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def _check_sha(value):
+    if len(value) != _SHA_LEN:
+        raise UnsupportedRepository(f"unexpected object name {value!r}")
+    int(value, 16)
+    return value
+
+
+def _read_config_extensions(path):
+    """return the ``[extensions]`` entries of a git config file"""
+    extensions = {}
+    section = None
+    with open(path, encoding="utf-8") as fp:
+        for line in fp:
+            line = line.strip()
+            if line.startswith("["):
+                section = line[1:].split("]")[0].strip().lower()
+            elif section == "extensions" and "=" in line:
+                key, value = line.split("=", 1)
+                extensions[key.strip().lower()] = value.strip().lower()
+    return extensions
+
+
+def _parse_size(data, pos):
+    """parse a little endian base 128 size as used by delta headers"""
+    size = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        size |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return size, pos
+
+
+def _apply_delta(base, delta):
+    src_size, pos = _parse_size(delta, 0)
+    if src_size != len(base):
+        raise UnsupportedRepository("delta base size mismatch")
+    dst_size, pos = _parse_size(delta, pos)
+    result = bytearray()
+    while pos < len(delta):
+        opcode = delta[pos]
+        pos += 1
+        if opcode & 0x80:
+            offset = size = 0
+            for i in range(4):
+                if opcode & (1 << i):
+                    offset |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if opcode & (0x10 << i):
+                    size |= delta[pos] << (8 * i)
+                    pos += 1
+            result += base[offset : offset + (size or 0x10000)]
+        elif opcode:
+            result += delta[pos : pos + opcode]
+            pos += opcode
+        else:
+            raise UnsupportedRepository("invalid delta opcode")
+    if len(result) != dst_size:
+        raise UnsupportedRepository("delta result size mismatch")
+    return bytes(result)
+
+
+def _parse_commit(content):
+    """return ``(parents, committer timestamp)`` of a raw commit object"""
+    parents = []
+    timestamp = 0
+    for line in content.split(b"\n\n", 1)[0].split(b"\n"):
+        if line.startswith(b"parent "):
+            parents.append(_check_sha(line[len(b"parent ") :].decode("ascii")))
+        elif line.startswith(b"committer "):
+            timestamp = int(line.rsplit(b" ", 2)[1])
+    return parents, timestamp
+
+
+def _parse_tagger_timestamp(content):
+    for line in content.split(b"\n\n", 1)[0].split(b"\n"):
+        if line.startswith(b"tagger "):
+            return int(line.rsplit(b" ", 2)[1])
+    return 0
+
+
+def _packed_refs_peeled(path):
+    """whether packed-refs records the peeled object of every annotated tag"""
+    with open(path, encoding="utf-8") as fp:
+        header = fp.readline().split()
+    return header[:3] == ["#", "pack-refs", "with:"] and bool(
+        {"peeled", "fully-peeled"}.intersection(header[3:])
+    )
+
+
+def _bisect_names(data, fanout, names, binsha):
+    """return the position of ``binsha`` in a sorted table of object names or None"""
+    first = binsha[0]
+    lo = fanout[first - 1] if first else 0
+    hi = fanout[first]
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start = names + mid * 20
+        current = data[start : start + 20]
+        if current < binsha:
+            lo = mid + 1
+        elif current > binsha:
+            hi = mid
+        else:
+            return mid
+    return None
+
+
+def _map_file(path):
+    with open(path, "rb") as fp:
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class _Pack:
+    """a packfile together with its version 2 index"""
+
+    def __init__(self, idx_path):
+        self.idx_path = idx_path
+        self._idx = idx = _map_file(idx_path)
+        if idx[:4] != b"\377tOc" or struct.unpack_from(">I", idx, 4)[0] != 2:
+            idx.close()
+            raise UnsupportedRepository(f"unsupported pack index {idx_path}")
+        self._fanout = struct.unpack_from(">256I", idx, 8)
+        self._count = self._fanout[-1]
+        self._names = 8 + 256 * 4
+        self._offsets = self._names + self._count * (20 + 4)
+        self._large_offsets = self._offsets + self._count * 4
+        self._pack_path = idx_path[: -len(".idx")] + ".pack"
+        self._data = None
+
+    def close(self):
+        """unmap the index and the pack"""
+        self._idx.close()
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+
+    def find(self, binsha):
+        """return the pack offset of ``binsha`` or None"""
+        idx = self._idx
+        pos = _bisect_names(idx, self._fanout, self._names, binsha)
+        if pos is None:
+            return None
+        offset = struct.unpack_from(">I", idx, self._offsets + pos * 4)[0]
+        if offset & 0x80000000:
+            large = self._large_offsets + (offset & 0x7FFFFFFF) * 8
+            offset = struct.unpack_from(">Q", idx, large)[0]
+        return offset
+
+    def _pack_data(self):
+        if self._data is None:
+            data = _map_file(self._pack_path)
+            version = struct.unpack_from(">I", data, 4)[0]
+            if data[:4] != b"PACK" or version not in (2, 3):
+                data.close()
+                raise UnsupportedRepository(f"unsupported pack {self._pack_path}")
+            self._data = data
+        return self._data
+
+    def _inflate(self, pos):
+        data = self._pack_data()
+        decompressor = zlib.decompressobj()
+        chunks = []
+        while not decompressor.eof:
+            chunk = data[pos : pos + 8192]
+            if not chunk:
+                raise UnsupportedRepository("truncated pack")
+            pos += len(chunk)
+            chunks.append(decompressor.decompress(chunk))
+        return b"".join(chunks)
+
+    def read_at(self, offset, repo):
+        """return ``(type, content)`` of the object stored at ``offset``"""
+        data = self._pack_data()
+        byte = data[offset]
+        kind = (byte >> 4) & 7
+        pos = offset + 1
+        # the inflated size is validated by zlib, skip it
+        while byte & 0x80:
+            byte = data[pos]
+            pos += 1
+        if kind == _OFS_DELTA:
+            byte = data[pos]
+            pos += 1
+            distance = byte & 0x7F
+            while byte & 0x80:
+                byte = data[pos]
+                pos += 1
+                distance = ((distance + 1) << 7) | (byte & 0x7F)
+            base_kind, base = self.read_at(offset - distance, repo)
+            return base_kind, _apply_delta(base, self._inflate(pos))
+        elif kind == _REF_DELTA:
+            base_kind, base = repo.read_object(data[pos : pos + 20].hex())
+            return base_kind, _apply_delta(base, self._inflate(pos + 20))
+        elif kind in _OBJECT_TYPES:
+            return _OBJECT_TYPES[kind], self._inflate(pos)
+        raise UnsupportedRepository(f"unknown pack object type {kind}")
+
+
+class _CommitGraph:
+    """a single ``objects/info/commit-graph`` file, split graph chains are not read"""
+
+    def __init__(self, path):
+        self._data = _map_file(path)
+        try:
+            self._read_chunks(path)
+        except BaseException:
+            self._data.close()
+            raise
+
+    def _read_chunks(self, path):
+        data = self._data
+        if data[:4] != b"CGPH" or data[4] != 1 or data[5] != 1:
+            raise UnsupportedRepository(f"unsupported commit-graph {path}")
+        if data[7]:
+            raise UnsupportedRepository("commit-graph with base graphs")
+        chunks = {}
+        for i in range(data[6]):
+            chunk_id, offset = struct.unpack_from(">4sQ", data, 8 + i * 12)
+            chunks[chunk_id] = offset
+        try:
+            self._fanout = struct.unpack_from(">256I", data, chunks[b"OIDF"])
+            self._names = chunks[b"OIDL"]
+            self._commits = chunks[b"CDAT"]
+        except KeyError as e:
+            raise UnsupportedRepository(f"commit-graph without {e} chunk")
+        self._edges = chunks.get(b"EDGE")
+
+    def close(self):
+        self._data.close()
+
+    def position(self, binsha):
+        """return the position of the commit ``binsha`` in the graph or None"""
+        return _bisect_names(self._data, self._fanout, self._names, binsha)
+
+    def sha(self, pos):
+        start = self._names + pos * 20
+        return self._data[start : start + 20].hex()
+
+    def commit(self, pos):
+        """return ``(parent positions, generation, committer timestamp)``"""
+        data = self._data
+        first, second, high, low = struct.unpack_from(
+            ">IIII", data, self._commits + pos * 36 + 20
+        )
+        parents = [] if first == _GRAPH_NO_PARENT else [first]
+        if second & _GRAPH_LAST_EDGE:
+            # octopus merges list the second and later parents in the edge chunk
+            edge = self._edges + (second & 0x7FFFFFFF) * 4
+            while True:
+                value = struct.unpack_from(">I", data, edge)[0]
+                parents.append(value & 0x7FFFFFFF)
+                if value & _GRAPH_LAST_EDGE:
+                    break
+                edge += 4
+        elif second != _GRAPH_NO_PARENT:
+            parents.append(second)
+        return parents, high >> 2, ((high & 3) << 32) | low
+
+
+def _parse_offset(data, pos):
+    """parse a big endian base 128 offset as used by version 4 index entries"""
+    byte = data[pos]
+    pos += 1
+    value = byte & 0x7F
+    while byte & 0x80:
+        byte = data[pos]
+        pos += 1
+        value = ((value + 1) << 7) | (byte & 0x7F)
+    return value, pos
+
+
+def _index_v4_path(data, start, previous):
+    """the path of a version 4 index entry and the position of the next entry"""
+    # the path replaces the end of the previous one
+    strip, start = _parse_offset(data, start)
+    end = data.find(b"\0", start)
+    return previous[: len(previous) - strip] + data[start:end], end + 1
+
+
+def _index_path(data, start, pos, flags):
+    """the path of a version 2 or 3 index entry at ``pos`` and the next position"""
+    length = flags & _INDEX_NAME_MASK
+    if length == _INDEX_NAME_MASK:
+        end = data.find(b"\0", start)
+    else:
+        end = start + length
+    # entries are padded with NULs to a multiple of 8 bytes
+    return data[start:end], pos + ((end - pos + 8) & ~7)
+
+
+def _check_index_extensions(data, pos):
+    """raise for the extensions of split indexes, they start at ``pos``"""
+    end = len(data) - 20
+    while pos + 8 <= end:
+        signature, size = struct.unpack_from(">4sI", data, pos)
+        if signature in _INDEX_SPLIT_EXTENSIONS:
+            raise UnsupportedRepository(f"index extension {signature!r}")
+        pos += 8 + size
+
+
+class _Index:
+    """
+    the paths of a version 2, 3 or 4 ``index`` file present in the worktree,
+    split and sparse indexes are not read
+
+    the paths are kept NUL separated in a single bytes object
+    instead of one object per entry
+    """
+
+    def __init__(self, path):
+        data = _map_file(path)
+        try:
+            self.paths, self.submodules = self._parse(data)
+        except (struct.error, IndexError) as e:
+            raise UnsupportedRepository(f"truncated index {path}") from e
+        finally:
+            data.close()
+
+    @staticmethod
+    def _parse(data):
+        if data[:4] != b"DIRC":
+            raise UnsupportedRepository("not an index file")
+        version, count = struct.unpack_from(">II", data, 4)
+        if version not in (2, 3, 4):
+            raise UnsupportedRepository(f"index version {version}")
+        unpack_from = struct.unpack_from
+        paths = bytearray()
+        submodules = []
+        previous = last = b""
+        pos = 12
+        for _ in range(count):
+            # ctime, mtime, dev, ino come before the mode, the sha before the flags
+            mode = unpack_from(">I", data, pos + 24)[0]
+            flags = unpack_from(">H", data, pos + 60)[0]
+            start = pos + 62
+            extended = 0
+            if flags & _INDEX_EXTENDED:
+                extended = unpack_from(">H", data, start)[0]
+                start += 2
+            if version == 4:
+                path, pos = _index_v4_path(data, start, previous)
+            else:
+                path, pos = _index_path(data, start, pos, flags)
+            previous = path
+            if mode & 0o170000 == _MODE_TREE:
+                raise UnsupportedRepository("sparse index")
+            if extended & _INDEX_SKIP_WORKTREE or path == last:
+                # not checked out, or another stage of a conflict
+                continue
+            last = path
+            if mode & 0o170000 == _MODE_GITLINK:
+                submodules.append(path)
+            else:
+                paths += path + b"\0"
+        _check_index_extensions(data, pos)
+        return bytes(paths[:-1]), submodules
+
+    def iter_paths(self):
+        """the paths of the files, decoded like git's own output"""
+        if self.paths:
+            for path in self.paths.split(b"\0"):
+                yield path.decode("utf-8", "surrogateescape")
+
+
+class GitRepository:
+    """experimental, may change at any time"""
+
+    def __init__(self, git_dir):
+        self.git_dir = git_dir
+        common_dir = _read_text(os.path.join(git_dir, "commondir"))
+        if common_dir is None:
+            self.common_dir = git_dir
+        else:
+            self.common_dir = os.path.join(git_dir, common_dir)
+        self._check_supported()
+        self._packed_refs = None
+        self._packs = None
+        self._commit_graph = None
+
+    @classmethod
+    def from_worktree(cls, worktree):
+        git_dir = find_git_dir(worktree)
+        if git_dir is None:
+            return None
+        return cls(git_dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        unmap the packs and the commit-graph, which windows keeps locked otherwise
+
+        they are mapped again when the repository is used after closing it
+        """
+        packs, self._packs = self._packs or [], None
+        for pack in packs:
+            pack.close()
+        graph, self._commit_graph = self._commit_graph, None
+        if graph:
+            graph.close()
+
+    def _check_supported(self):
+        for key, value in _read_config_extensions(
+            os.path.join(self.common_dir, "config")
+        ).items():
+            if key not in _KNOWN_EXTENSIONS:
+                raise UnsupportedRepository(f"extensions.{key}={value}")
+        for unsupported in (
+            "objects/info/alternates",
+            "info/grafts",
+            "refs/replace",
+            "reftable",
+        ):
+            if os.path.exists(os.path.join(self.common_dir, unsupported)):
+                raise UnsupportedRepository(unsupported)
+
+    def _read_loose_ref(self, name):
+        if name.startswith(_PER_WORKTREE_REFS):
+            base = self.git_dir
+        else:
+            base = self.common_dir
+        path = os.path.join(base, *name.split("/"))
+        if os.path.isdir(path):
+            return None
+        return _read_text(path)
+
+    def packed_refs(self):
+        """return the mapping of ref names to ``(sha, peeled sha)`` from packed-refs"""
+        path = os.path.join(self.common_dir, "packed-refs")
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return {}
+        key = st.st_mtime_ns, st.st_size, st.st_ino
+        if self._packed_refs is None or self._packed_refs[0] != key:
+            self._packed_refs = key, self._read_packed_refs(path)
+        return self._packed_refs[1]
+
+    @staticmethod
+    def _read_packed_refs(path):
+        refs = {}
+        name = None
+        with open(path, encoding="utf-8") as fp:
+            lines = fp.read().splitlines()
+        # this runs once per ref, repositories may have hundreds of thousands
+        for line in lines:
+            first = line[:1]
+            if first == "^":
+                if name is None:
+                    raise UnsupportedRepository("malformed packed-refs")
+                refs[name] = (refs[name][0], _check_sha(line[1:]))
+            elif first and first != "#":
+                sha, name = line.split(" ", 1)
+                if name.startswith("refs/replace/"):
+                    raise UnsupportedRepository("replace refs")
+                refs[name] = (_check_sha(sha), None)
+        return refs
+
+    def resolve(self, name):
+        """return the sha ``name`` points to, None if it doesn't exist (yet)"""
+        for _ in range(5):
+            content = self._read_loose_ref(name)
+            if content is None:
+                packed = self.packed_refs().get(name)
+                return packed and packed[0]
+            if not content.startswith("ref: "):
+                return _check_sha(content)
+            name = content[len("ref: ") :]
+        raise UnsupportedRepository(f"symbolic ref {name} nests too deep")
+
+    def head(self):
+        """
+        return ``(ref, sha)`` of HEAD
+
+        ``ref`` is None for a detached HEAD, ``sha`` is None on an unborn branch
+        """
+        content = self._read_loose_ref("HEAD")
+        if content is None:
+            raise UnsupportedRepository("HEAD is missing")
+        if content.startswith("ref: "):
+            ref = content[len("ref: ") :]
+            return ref, self.resolve(ref)
+        return None, _check_sha(content)
+
+    def _iter_loose_refs(self, prefix):
+        top = os.path.join(self.common_dir, *prefix.rstrip("/").split("/"))
+        for dirpath, _, filenames in os.walk(top):
+            relative = os.path.relpath(dirpath, top).replace(os.sep, "/")
+            for filename in filenames:
+                if relative == ".":
+                    name = prefix + filename
+                else:
+                    name = prefix + relative + "/" + filename
+                content = _read_text(os.path.join(dirpath, filename))
+                if content and not content.startswith("ref: "):
+                    yield name, _check_sha(content)
+
+    def tags(self):
+        """return a mapping of tag names to the commits they point to"""
+        refs = {
+            name: peeled or sha
+            for name, (sha, peeled) in self.packed_refs().items()
+            if name.startswith("refs/tags/")
+        }
+        for name, sha in self._iter_loose_refs("refs/tags/"):
+            refs[name] = sha
+        tags = {}
+        for name, sha in refs.items():
+            commit = self.peel(sha)
+            if commit is not None:
+                tags[name[len("refs/tags/") :]] = commit
+        return tags
+
+    def tag_index(self):
+        """
+        return a mapping of commits to ``(name, tag object)`` of the tags on them
+
+        the tag object is None for lightweight tags,
+        unlike ``tags`` packed tags are not read if packed-refs records
+        what they peel to, so tags of other objects are included as well
+        """
+        entries = {}
+        path = os.path.join(self.common_dir, "packed-refs")
+        packed = self.packed_refs()
+        peeled_known = bool(packed) and _packed_refs_peeled(path)
+        for name, (sha, peeled) in packed.items():
+            if name.startswith("refs/tags/"):
+                if peeled is not None:
+                    entries[name[len("refs/tags/") :]] = peeled, sha
+                elif peeled_known:
+                    entries[name[len("refs/tags/") :]] = sha, None
+                else:
+                    entries[name[len("refs/tags/") :]] = self._peel_tag(sha)
+        for name, sha in self._iter_loose_refs("refs/tags/"):
+            entries[name[len("refs/tags/") :]] = self._peel_tag(sha)
+        index = {}
+        for name in sorted(entries):
+            target, tag_object = entries[name]
+            tags = index.get(target)
+            if tags is None:
+                index[target] = [(name, tag_object)]
+            else:
+                tags.append((name, tag_object))
+        index.pop(None, None)
+        return index
+
+    def _peel_tag(self, sha):
+        """return ``(commit, tag object)`` for a tag ref pointing at ``sha``"""
+        commit = self.peel(sha)
+        return commit, None if commit == sha else sha
+
+    def tagger_timestamp(self, sha):
+        kind, content = self.read_object(sha)
+        if kind != "tag":
+            raise UnsupportedRepository(f"{sha} is not a tag")
+        return _parse_tagger_timestamp(content)
+
+    def shallow_commits(self):
+        """the commits whose parents are missing from a shallow clone"""
+        content = _read_text(os.path.join(self.common_dir, "shallow"))
+        return set(content.split()) if content else set()
+
+    def commit_graph(self):
+        """
+        the commit-graph of the repository,
+        None if there is none or git wouldn't use it either
+        """
+        if self._commit_graph is None:
+            path = os.path.join(self.common_dir, "objects", "info", "commit-graph")
+            if os.path.isfile(path) and not self.shallow_commits():
+                self._commit_graph = _CommitGraph(path)
+            else:
+                self._commit_graph = False
+        return self._commit_graph or None
+
+    def index(self):
+        """the files of the ``index``, see ``_Index``"""
+        return _Index(os.path.join(self.git_dir, "index"))
+
+    def tree(self, sha):
+        """the id of the tree of the commit ``sha``"""
+        kind, content = self.read_object(sha)
+        if kind != "commit" or not content.startswith(b"tree "):
+            raise UnsupportedRepository(f"{sha} is not a commit")
+        tree = content[len(b"tree ") : len(b"tree ") + _SHA_LEN]
+        return _check_sha(tree.decode("ascii"))
+
+    def commit(self, sha):
+        """return ``(parents, committer timestamp)`` of the commit ``sha``"""
+        kind, content = self.read_object(sha)
+        if kind != "commit":
+            raise UnsupportedRepository(f"{sha} is not a commit")
+        return _parse_commit(content)
+
+    def peel(self, sha):
+        """follow tag objects, return the commit or None for other objects"""
+        for _ in range(10):
+            kind, content = self.read_object(sha)
+            if kind == "commit":
+                return sha
+            if kind != "tag":
+                return None
+            header = content.split(b"\n", 1)[0]
+            if not header.startswith(b"object "):
+                raise UnsupportedRepository(f"malformed tag {sha}")
+            sha = _check_sha(header[len(b"object ") :].decode("ascii"))
+        raise UnsupportedRepository(f"tag {sha} nests too deep")
+
+    def _get_packs(self, refresh=False):
+        if self._packs is None or refresh:
+            pack_dir = os.path.join(self.common_dir, "objects", "pack")
+            try:
+                names = sorted(os.listdir(pack_dir))
+            except FileNotFoundError:
+                names = []
+            # packs which are still there stay mapped, the others are released
+            known = {pack.idx_path: pack for pack in self._packs or []}
+            packs = []
+            for name in names:
+                if name.endswith(".idx"):
+                    path = os.path.join(pack_dir, name)
+                    pack = known.pop(path, None)
+                    packs.append(_Pack(path) if pack is None else pack)
+            for pack in known.values():
+                pack.close()
+            self._packs = packs
+        return self._packs
+
+    def read_object(self, sha):
+        """return ``(type, content)`` of the object ``sha``"""
+        loose = os.path.join(self.common_dir, "objects", sha[:2], sha[2:])
+        try:
+            with open(loose, "rb") as fp:
+                raw = zlib.decompress(fp.read())
+        except FileNotFoundError:
+            pass
+        else:
+            header, _, content = raw.partition(b"\0")
+            kind, _ = header.split()
+            return kind.decode("ascii"), content
+        binsha = bytes.fromhex(sha)
+        # a repack may have replaced the packs known so far
+        for refresh in (False, True):
+            for pack in self._get_packs(refresh):
+                offset = pack.find(binsha)
+                if offset is not None:
+                    return pack.read_at(offset, self)
+        trace("object not found", sha)
+        raise UnsupportedRepository(f"object {sha} not found")
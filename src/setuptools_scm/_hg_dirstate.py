@@ -0,0 +1,132 @@
+"""
+read-only access to the mercurial dirstate without running hg
+
+the v1 format and the node tree of dirstate-v2 are read,
+anything else raises ``UnsupportedRepository`` so callers can use the hg cli
+"""
+import os
+import struct
+
+from ._git_repo import UnsupportedRepository
+
+_V2_REQUIREMENT = b"dirstate-v2"
+_V2_MARKER = b"dirstate-v2\n"
+# marker, parents, tree metadata, data size and the length of the uuid after it
+_V2_DOCKET = struct.Struct(">12s32s32s44sLB")
+# root nodes start and count come first
+_V2_TREE_METADATA = struct.Struct(">LL")
+# full path start and length, base name start, copy source start and length,
+# children start and count, descendant counts, flags, size, mtime seconds and ns
+_V2_NODE = struct.Struct(">LHHLHLLLLHlll")
+_V2_WDIR_TRACKED = 1 << 0
+# parents, then state, mode, size, mtime and name length before every name
+_V1_HEADER_SIZE = 40
+_V1_ENTRY = struct.Struct(">cllll")
+# normal, added and merged, removed entries are ``r``
+_V1_TRACKED = (b"n", b"a", b"m")
+
+
+def _requirements(hg_dir):
+    try:
+        with open(os.path.join(hg_dir, "requires"), "rb") as fp:
+            return set(fp.read().split())
+    except FileNotFoundError:
+        return set()
+
+
+def _parse_v1(data):
+    paths = []
+    unpack_from = _V1_ENTRY.unpack_from
+    pos = _V1_HEADER_SIZE
+    end = len(data)
+    while pos < end:
+        state, _, _, _, length = unpack_from(data, pos)
+        pos += _V1_ENTRY.size
+        if state in _V1_TRACKED:
+            # a copy source follows the name after a NUL
+            paths.append(data[pos : pos + length].partition(b"\0")[0])
+        pos += length
+    return paths
+
+
+def _parse_v2(hg_dir, docket):
+    if not docket:
+        # nothing was tracked yet
+        return []
+    marker, _, _, metadata, size, uuid_size = _V2_DOCKET.unpack_from(docket)
+    if marker != _V2_MARKER:
+        raise UnsupportedRepository("not a dirstate-v2 docket")
+    uuid = docket[_V2_DOCKET.size : _V2_DOCKET.size + uuid_size]
+    with open(os.path.join(hg_dir, "dirstate." + uuid.decode("ascii")), "rb") as fp:
+        # hg appends to the data file, only ``size`` bytes belong to the docket
+        data = fp.read(size)
+    if len(data) != size:
+        raise UnsupportedRepository("truncated dirstate data file")
+    paths = []
+    unpack_from = _V2_NODE.unpack_from
+    # a corrupt file must not make the walk loop
+    budget = size // _V2_NODE.size
+    pending = [_V2_TREE_METADATA.unpack_from(metadata)]
+    while pending:
+        start, count = pending.pop()
+        budget -= count
+        if budget < 0:
+            raise UnsupportedRepository("dirstate nodes don't form a tree")
+        for pos in range(start, start + count * _V2_NODE.size, _V2_NODE.size):
+            (
+                path_start,
+                path_len,
+                _,
+                _,
+                _,
+                children_start,
+                children_count,
+                _,
+                _,
+                flags,
+                _,
+                _,
+                _,
+            ) = unpack_from(data, pos)
+            if children_count:
+                pending.append((children_start, children_count))
+            if flags & _V2_WDIR_TRACKED:
+                paths.append(data[path_start : path_start + path_len])
+    return paths
+
+
+def state_key(hg_dir):
+    """
+    a cheap summary of the dirstate which changes with the tracked files
+    and the parents, None if there is no dirstate
+    """
+    path = os.path.join(hg_dir, "dirstate")
+    try:
+        st = os.stat(path)
+        with open(path, "rb") as fp:
+            # the docket is followed by a uuid of at most 255 bytes
+            header = fp.read(_V2_DOCKET.size + 255)
+    except FileNotFoundError:
+        return None
+    if header.startswith(_V2_MARKER):
+        # the parents, the size of the data file and its name
+        summary = header
+    else:
+        summary = header[:_V1_HEADER_SIZE]
+    return [summary.hex(), st.st_mtime_ns, st.st_size]
+
+
+def tracked_paths(hg_dir):
+    """
+    the ``/`` separated bytes paths tracked in the working directory of ``hg_dir``,
+    which are the files ``hg files`` lists
+    """
+    path = os.path.join(hg_dir, "dirstate")
+    with open(path, "rb") as fp:
+        data = fp.read()
+    try:
+        if _V2_REQUIREMENT in _requirements(hg_dir):
+            return _parse_v2(hg_dir, data)
+        return _parse_v1(data)
+    except (struct.error, UnicodeDecodeError) as e:
+        raise UnsupportedRepository(f"unreadable dirstate {path}") from e
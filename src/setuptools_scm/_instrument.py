@@ -0,0 +1,126 @@
+"""
+accounting of the scm commands setuptools_scm runs
+
+every finished command is handed to the active collectors,
+which are either opened with ``instrument()`` or,
+if ``SETUPTOOLS_SCM_PROFILE`` names a file, a process wide one
+that is written there as json at exit
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import NamedTuple
+from typing import Tuple
+
+PROFILE_KEY = "SETUPTOOLS_SCM_PROFILE"
+
+_collectors = []
+_lock = threading.Lock()
+
+
+class CommandRecord(NamedTuple):
+    argv: Tuple[str, ...]
+    cwd: str
+    #: wall time in seconds
+    duration: float
+    returncode: "int | None"
+    #: bytes read from stdout and stderr
+    output_size: int
+
+
+class CommandStats:
+    """the commands recorded while a collector was active"""
+
+    def __init__(self):
+        self.records = []
+
+    def __repr__(self):
+        return "<CommandStats {} commands in {:.3f}s>".format(
+            len(self.records), self.total_time
+        )
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    @property
+    def total_time(self):
+        return sum(record.duration for record in self.records)
+
+    def summary(self):
+        """count and total time per command, keyed on e.g. ``"git describe"``"""
+        result = {}
+        for record in self.records:
+            entry = result.setdefault(" ".join(record.argv[:2]), [0, 0.0])
+            entry[0] += 1
+            entry[1] += record.duration
+        return {
+            name: {"count": count, "time": duration}
+            for name, (count, duration) in result.items()
+        }
+
+    def as_dict(self):
+        return {
+            "commands": [record._asdict() for record in self.records],
+            "summary": self.summary(),
+            "total_time": self.total_time,
+        }
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as fp:
+            json.dump(self.as_dict(), fp, indent=2)
+
+
+def record(argv, cwd, started, returncode, output_size):
+    """
+    record a finished command, ``started`` is its ``time.perf_counter()`` start
+    """
+    if not _collectors:
+        return
+    if isinstance(argv, str):
+        argv = (argv,)
+    entry = CommandRecord(
+        tuple(str(arg) for arg in argv),
+        os.fspath(cwd),
+        time.perf_counter() - started,
+        returncode,
+        output_size,
+    )
+    with _lock:
+        for stats in _collectors:
+            stats.records.append(entry)
+
+
+@contextmanager
+def instrument():
+    """
+    collect a ``CommandStats`` of all scm commands run inside the block
+
+    >>> with instrument() as stats:  # doctest: +SKIP
+    ...     get_version()
+    """
+    stats = CommandStats()
+    with _lock:
+        _collectors.append(stats)
+    try:
+        yield stats
+    finally:
+        with _lock:
+            _collectors.remove(stats)
+
+
+def _profile_from_env():
+    path = os.environ.get(PROFILE_KEY)
+    if not path:
+        return
+    stats = CommandStats()
+    _collectors.append(stats)
+    atexit.register(stats.dump, os.path.abspath(path))
+
+
+_profile_from_env()
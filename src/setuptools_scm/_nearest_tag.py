@@ -0,0 +1,172 @@
+"""
+describe engine for repositories with very many tags
+
+``git describe`` weighs every candidate tag it meets, instead the history
+is walked from HEAD newest first and the first commit carrying a matching tag
+wins, commit-graph generation numbers keep the walk in topological order
+"""
+import heapq
+
+# generation of commits that are not in the commit-graph
+_INFINITY = 0xFFFFFFFF
+# extra steps once every queued commit is reachable from the tag,
+# like git this absorbs clock skew when there are no generation numbers
+_SLOP = 5
+_HEAD = 1
+_BASE = 2
+
+
+class _History:
+    """parents and walk order of commits, taken from the commit-graph where possible"""
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.graph = repo.commit_graph()
+        self.shallow = repo.shallow_commits()
+        self._commits = {}
+
+    def __getitem__(self, sha):
+        """return ``(heap key, parents)`` of ``sha``"""
+        try:
+            return self._commits[sha]
+        except KeyError:
+            pass
+        pos = None if self.graph is None else self.graph.position(bytes.fromhex(sha))
+        if pos is None:
+            parents, timestamp = self.repo.commit(sha)
+            generation = _INFINITY
+        else:
+            positions, generation, timestamp = self.graph.commit(pos)
+            parents = [self.graph.sha(parent) for parent in positions]
+        if sha in self.shallow:
+            parents = []
+        # heapq pops the smallest key first, the newest commit has to come first,
+        # like git commits with the same date are walked in the order they were seen
+        key = (-generation, -timestamp, len(self._commits), sha)
+        entry = self._commits[sha] = key, parents
+        return entry
+
+    def key(self, sha):
+        return self[sha][0]
+
+    def parents(self, sha):
+        return self[sha][1]
+
+
+def _first_tagged(history, head, index, accept):
+    """return the newest commit with an accepted tag and those tags"""
+    seen = {head}
+    queue = [history.key(head)]
+    while queue:
+        sha = heapq.heappop(queue)[-1]
+        # only the tags on walked commits are checked, there may be very many
+        tags = [tag for tag in index.get(sha, ()) if accept(tag)]
+        if tags:
+            return sha, tags
+        for parent in history.parents(sha):
+            if parent not in seen:
+                seen.add(parent)
+                heapq.heappush(queue, history.key(parent))
+    return None
+
+
+def _count_unique(history, head, base):
+    """number of commits reachable from ``head`` but not from ``base``"""
+    if head == base:
+        return 0
+    flags = {head: _HEAD, base: _BASE}
+    queue = [history.key(head), history.key(base)]
+    heapq.heapify(queue)
+    queued = {head, base}
+    # queued commits only reachable from head
+    interesting = 1
+    counted = set()
+    slop = _SLOP
+    while queue:
+        if not interesting:
+            if not slop:
+                break
+            slop -= 1
+        sha = heapq.heappop(queue)[-1]
+        queued.discard(sha)
+        if flags[sha] == _HEAD:
+            interesting -= 1
+            counted.add(sha)
+        else:
+            # a commit walked too early because of clock skew
+            counted.discard(sha)
+        interesting += _mark_parents(history, sha, flags, queue, queued)
+    return len(counted)
+
+
+def _mark_parents(history, sha, flags, queue, queued):
+    """
+    pass the flags of ``sha`` on to its parents and queue the new ones,
+    returns the change in queued commits only reachable from head
+    """
+    flag = flags[sha]
+    change = 0
+    for parent in history.parents(sha):
+        old = flags.get(parent, 0)
+        new = old | flag
+        if new == old:
+            continue
+        flags[parent] = new
+        if parent in queued:
+            if old == _HEAD:
+                change -= 1
+        else:
+            heapq.heappush(queue, history.key(parent))
+            queued.add(parent)
+            if new == _HEAD:
+                change += 1
+    return change
+
+
+def _pick_name(repo, tags):
+    """like git describe prefer the newest annotated tag, then the first name"""
+    annotated = [(name, sha) for name, sha in tags if sha is not None]
+    if not annotated:
+        return tags[0][0]
+    return max(annotated, key=lambda tag: repo.tagger_timestamp(tag[1]))[0]
+
+
+class NearestTagSearch:
+    """
+    finds nearest tags in one repository
+
+    the tag index and the commits read are shared between searches,
+    so searching with several tag filters costs little more than one search
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.index = repo.tag_index()
+        self.history = _History(repo)
+
+    def __call__(self, head, match, annotated_only=False):
+        """
+        return ``(tag, distance)`` of the nearest tag reachable from ``head``
+        whose name is accepted by ``match``, None if there is none
+
+        like ``git describe`` the distance counts the commits
+        reachable from ``head`` but not from the tag
+        """
+        if not self.index:
+            return None
+
+        def accept(tag):
+            name, tag_object = tag
+            return (tag_object is not None or not annotated_only) and match(name)
+
+        found = _first_tagged(self.history, head, self.index, accept)
+        if found is None:
+            return None
+        commit, tags = found
+        distance = _count_unique(self.history, head, commit)
+        return _pick_name(self.repo, tags), distance
+
+
+def nearest_tag(repo, head, match):
+    """``NearestTagSearch`` for a single search"""
+    return NearestTagSearch(repo)(head, match)
@@ -76,6 +76,12 @@ class Configuration:
         version_cls=None,
         normalize=True,
         search_parent_directories=False,
+        git_backend="cli",
+        parallel_queries=False,
+        dirty_strategy="status",
+        version_cache=False,
+        describe_engine="cli",
+        rev=None,
     ):
         # TODO:
         self._relative_to = relative_to
@@ -94,6 +100,12 @@ class Configuration:
         self.git_describe_command = git_describe_command
         self.dist_name = dist_name
         self.search_parent_directories = search_parent_directories
+        self.git_backend = git_backend
+        self.parallel_queries = parallel_queries
+        self.dirty_strategy = dirty_strategy
+        self.version_cache = version_cache
+        self.describe_engine = describe_engine
+        self.rev = rev
         self.parent = None
 
         if not normalize:
@@ -23,6 +23,71 @@ def walk_potential_roots(root, search_parents=True):
         root, tail = os.path.split(root)
 
 
+def _ceiling_directories():
+    value = os.environ.get("GIT_CEILING_DIRECTORIES", "")
+    return {os.path.normcase(path) for path in value.split(os.pathsep) if path}
+
+
+def _device(path):
+    return os.stat(path).st_dev
+
+
+def walk_repository_roots(root):
+    """
+    Iterate through a path and its parents like git does when looking for a repository.
+
+    The walk doesn't go up into a ``GIT_CEILING_DIRECTORIES`` entry,
+    nor across a filesystem boundary unless ``GIT_DISCOVERY_ACROSS_FILESYSTEM``
+    is set to a true value.
+    :param root: File path.
+    """
+    ceilings = _ceiling_directories()
+    across_filesystems = os.environ.get(
+        "GIT_DISCOVERY_ACROSS_FILESYSTEM", ""
+    ).lower() in ("1", "true", "yes", "on")
+    root = os.path.abspath(root)
+    try:
+        device = _device(root)
+    except OSError:
+        device = None
+
+    while True:
+        yield root
+        parent = os.path.dirname(root)
+        if parent == root or os.path.normcase(parent) in ceilings:
+            return
+        if not across_filesystems:
+            try:
+                if _device(parent) != device:
+                    trace("stopping at filesystem boundary", root)
+                    return
+            except OSError:
+                return
+        root = parent
+
+
+def _is_gitfile(path):
+    try:
+        with open(path, "rb") as fp:
+            return fp.read(8) == b"gitdir: "
+    except OSError:
+        return False
+
+
+def iter_git_roots(root):
+    """
+    Find the directories above ``root`` which contain a ``.git`` directory or gitfile.
+
+    Only the filesystem is consulted, within the limits of ``walk_repository_roots``.
+    :param root: File path.
+    :return: The directories from the innermost outwards.
+    """
+    for directory in walk_repository_roots(root):
+        path = os.path.join(directory, ".git")
+        if os.path.isdir(path) or _is_gitfile(path):
+            yield directory
+
+
 def match_entrypoint(root, name):
     """
     Consider a ``root`` as entry-point.
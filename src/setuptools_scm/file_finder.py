@@ -2,6 +2,97 @@ import os
 
 from .utils import trace
 
+# list the working tree from the scm metadata instead of running the scm
+WORKTREE_LISTING_KEY = "SETUPTOOLS_SCM_WORKTREE_LISTING"
+
+
+class FileListing:
+    """
+    collects ``/`` separated paths relative to ``toplevel``
+    as the ``scm_files`` and ``scm_dirs`` of ``scm_find_files``
+
+    the parent directories of a path are only walked up to the first one seen
+    """
+
+    def __init__(self, toplevel):
+        self.prefix = toplevel + os.path.sep
+        self.files = set()
+        self.dirs = {toplevel}
+        # relative directories seen so far, parents are added before their children
+        self._seen = {""}
+
+    def _abspath(self, path):
+        return os.path.normcase(self.prefix + path.replace("/", os.path.sep))
+
+    def _add_parents(self, path):
+        parent = path.rpartition("/")[0]
+        while parent not in self._seen:
+            self._seen.add(parent)
+            self.dirs.add(self._abspath(parent))
+            parent = parent.rpartition("/")[0]
+
+    def add_file(self, path):
+        self._add_parents(path)
+        self.files.add(self._abspath(path))
+
+    def add_dir(self, path):
+        self._add_parents(path)
+        if path not in self._seen:
+            self._seen.add(path)
+            self.dirs.add(self._abspath(path))
+
+
+def _scandir(dirpath):
+    """the entries of ``dirpath``, None if it can't be listed"""
+    try:
+        with os.scandir(dirpath) as it:
+            return list(it)
+    except OSError:
+        # os.walk skips directories it can't list
+        return None
+
+
+def _classify(entry, realdirpath, scm_files, resolve):
+    """
+    ``(is dir, is link, realpath)`` of a directory entry,
+    None for a symlink not in scm
+    """
+    try:
+        is_dir = entry.is_dir()
+    except OSError:
+        is_dir = False
+    try:
+        is_link = entry.is_symlink()
+    except OSError:
+        is_link = False
+    realentry = os.path.join(realdirpath, os.path.normcase(entry.name))
+    if is_link:
+        if realentry not in scm_files:
+            return None
+        realentry = resolve(entry.path)
+    return is_dir, is_link, realentry
+
+
+def _walk_entries(entries, reldirpath, realdirpath, scm_files, resolve):
+    """
+    the scm controlled files of a directory relative to the walked path,
+    and its subdirectories to walk in the order of ``scm_find_files``
+    """
+    files = []
+    subdirs = []
+    for entry in entries:
+        classified = _classify(entry, realdirpath, scm_files, resolve)
+        if classified is None:
+            # a symlink not in scm
+            continue
+        is_dir, is_link, realentry = classified
+        relentry = os.path.join(reldirpath, entry.name)
+        if is_dir:
+            subdirs.append((entry.path, relentry, realentry, is_link))
+        elif realentry in scm_files:
+            files.append(relentry)
+    return files, subdirs
+
 
 def scm_find_files(path, scm_files, scm_dirs):
     """ setuptools compatible file finder that follows symlinks
@@ -19,41 +110,44 @@ def scm_find_files(path, scm_files, scm_dirs):
         adding-support-for-revision-control-systems
     """
     realpath = os.path.normcase(os.path.realpath(path))
-    seen = set()
-    res = []
-    for dirpath, dirnames, filenames in os.walk(realpath, followlinks=True):
-        # dirpath with symlinks resolved
-        realdirpath = os.path.normcase(os.path.realpath(dirpath))
+    # only the directories in scm_dirs are listed, and only symlinks are resolved,
+    # everything else has the realpath of its directory joined with its name
+    realpaths = {}
 
-        def _link_not_in_scm(n):
-            fn = os.path.join(realdirpath, os.path.normcase(n))
-            return os.path.islink(fn) and fn not in scm_files
+    def _resolve(fn):
+        try:
+            return realpaths[fn]
+        except KeyError:
+            resolved = realpaths[fn] = os.path.normcase(os.path.realpath(fn))
+            return resolved
 
+    seen = set()
+    res = []
+    # walked like os.walk(realpath, followlinks=True) does:
+    # (dirpath, dirpath relative to realpath, dirpath with symlinks resolved, is link)
+    stack = [(realpath, "", _resolve(realpath), False)]
+    while stack:
+        dirpath, reldirpath, realdirpath, is_link = stack.pop()
         if realdirpath not in scm_dirs:
             # directory not in scm, don't walk it's content
-            dirnames[:] = []
             continue
-        if os.path.islink(dirpath) and not os.path.relpath(
-            realdirpath, realpath
-        ).startswith(os.pardir):
+        entries = _scandir(dirpath)
+        if entries is None:
+            continue
+        if is_link and not os.path.relpath(realdirpath, realpath).startswith(os.pardir):
             # a symlink to a directory not outside path:
             # we keep it in the result and don't walk its content
             res.append(os.path.join(path, os.path.relpath(dirpath, path)))
-            dirnames[:] = []
             continue
         if realdirpath in seen:
             # symlink loop protection
-            dirnames[:] = []
             continue
-        dirnames[:] = [dn for dn in dirnames if not _link_not_in_scm(dn)]
-        for filename in filenames:
-            if _link_not_in_scm(filename):
-                continue
-            # dirpath + filename with symlinks preserved
-            fullfilename = os.path.join(dirpath, filename)
-            if os.path.normcase(os.path.realpath(fullfilename)) in scm_files:
-                res.append(os.path.join(path, os.path.relpath(fullfilename, realpath)))
+        files, subdirs = _walk_entries(
+            entries, reldirpath, realdirpath, scm_files, _resolve
+        )
+        res.extend(os.path.join(path, relentry) for relentry in files)
         seen.add(realdirpath)
+        stack.extend(reversed(subdirs))
     return res
 
 
@@ -1,20 +1,66 @@
+import io
 import logging
 import os
 import subprocess
 import tarfile
+import time
+from bisect import bisect_left
 
+from . import _instrument
+from ._cache import _stat_key
+from ._files_cache import FileListCache
+from ._git_repo import GitRepository
+from ._git_repo import READ_ERRORS
+from ._git_repo import UnsupportedRepository
+from .file_finder import FileListing
 from .file_finder import is_toplevel_acceptable
 from .file_finder import scm_find_files
+from .file_finder import WORKTREE_LISTING_KEY
+from .utils import _popen_pipes
 from .utils import do_ex
+from .utils import get_runner
+from .utils import has_command
+from .utils import iter_split
+from .utils import PopenRunner
 from .utils import trace
 
 log = logging.getLogger(__name__)
 
+# every blob, tree and submodule of HEAD, trees before their contents
+LS_TREE = ["git", "ls-tree", "-r", "-t", "-z", "--full-tree"]
+# changes between two trees, trees come before their contents
+DIFF_TREE = ["git", "diff-tree", "-r", "-t", "-z", "--no-renames"]
+# the blobs and submodules below the paths given after it
+LS_TREE_CONTENTS = ["git", "--literal-pathspecs", "ls-tree", "-r", "-z", "--name-only"]
+# the .gitattributes files of the index, in plain pathspecs ``*`` matches ``/``
+STAGED_ATTRIBUTES = [
+    "git",
+    "ls-files",
+    "-s",
+    "-z",
+    "--",
+    ".gitattributes",
+    "*/.gitattributes",
+]
+# trees and submodules are listed as directories
+_TREE_MODES = ("040000", "160000")
+# export-ignore of the paths on stdin, the attributes are taken from the index
+CHECK_EXPORT_IGNORE = [
+    "git",
+    "check-attr",
+    "--stdin",
+    "-z",
+    "--cached",
+    "export-ignore",
+]
 
-def _git_toplevel(path):
+
+def _git_toplevel(path, runner=None):
+    if not has_command("git", warn=False, runner=runner):
+        return None
     try:
         cwd = os.path.abspath(path or ".")
-        out, err, ret = do_ex(["git", "rev-parse", "HEAD"], cwd=cwd)
+        out, err, ret = do_ex(["git", "rev-parse", "HEAD"], cwd=cwd, runner=runner)
         if ret != 0:
             # BAIL if there is no commit
             log.error("listing git files failed - pretending there aren't any")
@@ -22,6 +68,7 @@ def _git_toplevel(path):
         out, err, ret = do_ex(
             ["git", "rev-parse", "--show-prefix"],
             cwd=cwd,
+            runner=runner,
         )
         if ret != 0:
             return None
@@ -61,33 +108,450 @@ def _git_interpret_archive(fd, toplevel):
         return git_files, git_dirs
 
 
-def _git_ls_files_and_dirs(toplevel):
-    # use git archive instead of git ls-file to honor
-    # export-ignore git attribute
-
+def _git_archive_files_and_dirs(toplevel, runner):
+    # git archive honors the export-ignore git attribute
     cmd = ["git", "archive", "--prefix", toplevel + os.path.sep, "HEAD"]
-    proc = subprocess.Popen(
-        cmd, stdout=subprocess.PIPE, cwd=toplevel, stderr=subprocess.DEVNULL
+    started = time.perf_counter()
+    out, _, ret = runner.run(cmd, toplevel)
+    _instrument.record(cmd, toplevel, started, ret, len(out))
+    if ret:
+        log.error("listing git files failed - pretending there aren't any")
+        return (), ()
+    return _git_interpret_archive(io.BytesIO(out), toplevel)
+
+
+def _git_export_ignored(toplevel, paths):
+    """
+    the ``paths`` git archive leaves out, checked with one ``git check-attr``
+
+    directories are passed with a trailing ``/`` like git archive checks them,
+    so ``dir/`` patterns match, the returned paths have no trailing ``/``
+    """
+    if not paths:
+        return set()
+    started = time.perf_counter()
+    proc = _popen_pipes(
+        CHECK_EXPORT_IGNORE, toplevel, stdin=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    out, _ = proc.communicate(b"\0".join(paths) + b"\0")
+    _instrument.record(
+        CHECK_EXPORT_IGNORE, toplevel, started, proc.returncode, len(out)
+    )
+    if proc.returncode:
+        raise OSError(f"git check-attr failed with {proc.returncode}")
+    # <path> NUL <attribute> NUL <value> NUL for every path
+    fields = out.split(b"\0")
+    return {
+        path.rstrip(b"/")
+        for path, value in zip(fields[0::3], fields[2::3])
+        # like git archive only export-ignore that is set counts
+        if value == b"set"
+    }
+
+
+def _git_tree_name(prefix, path):
+    return os.path.normcase(
+        prefix + path.decode("utf-8", "surrogateescape").replace("/", os.path.sep)
     )
+
+
+def _git_interpret_tree(out, ignored, toplevel):
+    git_files = set()
+    git_dirs = {toplevel}
+    excluded = set()
+    written = set()
+    prefix = toplevel + os.path.sep
+    for entry in out.split(b"\0"):
+        if not entry:
+            continue
+        info, _, path = entry.partition(b"\t")
+        parent = path.rpartition(b"/")[0]
+        if parent in excluded:
+            # the contents of export-ignored trees are left out as well
+            excluded.add(path)
+            continue
+        kind = info.split(b" ")[1]
+        if kind == b"tree":
+            if path in ignored:
+                excluded.add(path)
+            # git archive only writes a tree once it reaches an entry inside it
+            continue
+        # which happens before the entry itself is checked for export-ignore
+        while parent and parent not in written:
+            written.add(parent)
+            git_dirs.add(_git_tree_name(prefix, parent))
+            parent = parent.rpartition(b"/")[0]
+        if path in ignored:
+            continue
+        # submodules are archived as empty directories
+        if kind == b"commit":
+            git_dirs.add(_git_tree_name(prefix, path))
+        else:
+            git_files.add(_git_tree_name(prefix, path))
+    return git_files, git_dirs
+
+
+def _git_index_files_and_dirs(toplevel):
+    """
+    the files of the index and the directories they imply,
+    read from ``.git/index`` without running git
+
+    unlike the HEAD listing it includes staged files and ignores export-ignore
+    """
+    repo = GitRepository.from_worktree(toplevel)
+    if repo is None:
+        raise UnsupportedRepository(f"no git dir in {toplevel}")
+    index = repo.index()
+    listing = FileListing(toplevel)
+    for path in index.iter_paths():
+        listing.add_file(path)
+    for path in index.submodules:
+        listing.add_dir(path.decode("utf-8", "surrogateescape"))
+    return listing.files, listing.dirs
+
+
+def _git_tree_attributes(info, path):
+    """the ``STAGED_ATTRIBUTES`` entry of a ``.gitattributes`` ls-tree entry, or None"""
+    if path != b".gitattributes" and not path.endswith(b"/.gitattributes"):
+        return None
+    mode, _, sha = info.decode("ascii").split(" ")
+    return f"{mode} {sha} 0\t{path.decode('utf-8', 'surrogateescape')}"
+
+
+def _git_list_tree(toplevel, runner, tree="HEAD", attributes=None):
+    """
+    ``(files, dirs, export-ignored paths)`` of ``tree``, None if git failed
+    or if the ``.gitattributes`` of the index differ from those of ``tree``
+
+    ``attributes`` are the ``_git_staged_attributes`` if they are known
+    """
+    # git archive would read and pipe every blob just to list their names,
+    # instead the names come from the tree and export-ignore from check-attr
+    cmd = LS_TREE + [tree]
+    started = time.perf_counter()
+    out, _, ret = runner.run(cmd, toplevel)
+    _instrument.record(cmd, toplevel, started, ret, len(out))
+    if ret:
+        return None
+    paths = []
+    tree_attributes = []
+    for entry in out.split(b"\0"):
+        if entry:
+            info, _, path = entry.partition(b"\t")
+            if info.split(b" ")[1] in (b"tree", b"commit"):
+                path += b"/"
+            else:
+                attribute = _git_tree_attributes(info, path)
+                if attribute is not None:
+                    tree_attributes.append(attribute)
+            paths.append(path)
+    if attributes is None:
+        attributes = _git_staged_attributes(toplevel, runner)
+    # check-attr reads the index, git archive the attributes of the tree
+    if attributes is None or sorted(attributes) != sorted(tree_attributes):
+        trace("staged .gitattributes differ from", tree)
+        return None
     try:
+        ignored = _git_export_ignored(toplevel, paths)
+    except OSError as e:
+        trace("export-ignore check failed", e)
+        return None
+    git_files, git_dirs = _git_interpret_tree(out, ignored, toplevel)
+    return git_files, git_dirs, ignored
+
+
+def _git_listing_key(repo):
+    """the state of ``repo`` the HEAD listing depends on, None without HEAD commit"""
+    sha = repo.head()[1]
+    if sha is None:
+        return None
+    return {
+        "tree": repo.tree(sha),
+        "index": _stat_key(os.path.join(repo.git_dir, "index")),
+        "info/attributes": _stat_key(
+            os.path.join(repo.common_dir, "info", "attributes")
+        ),
+    }
+
+
+def _git_staged_attributes(toplevel, runner):
+    """mode, blob and path of every ``.gitattributes`` in the index"""
+    out, _, ret = do_ex(STAGED_ATTRIBUTES, cwd=toplevel, runner=runner)
+    if ret:
+        return None
+    return [entry for entry in out.split("\0") if entry]
+
+
+def _git_is_excluded(path, ignored):
+    """whether ``path`` or one of its parents is export-ignored"""
+    while path:
+        if path in ignored:
+            return True
+        path = path.rpartition("/")[0]
+    return False
+
+
+def _git_split(cmd, toplevel, runner):
+    """the ``-z`` separated records of ``cmd`` and its returncode"""
+    records = iter_split(cmd, toplevel, runner)
+    fields = []
+    while True:
         try:
-            return _git_interpret_archive(proc.stdout, toplevel)
-        finally:
-            # ensure we avoid resource warnings by cleaning up the process
-            proc.stdout.close()
-            proc.terminate()
-    except Exception:
-        if proc.wait() != 0:
-            log.error("listing git files failed - pretending there aren't any")
-        return (), ()
+            fields.append(next(records))
+        except StopIteration as stop:
+            return fields, stop.value
+
+
+def _git_read_tree_diff(toplevel, runner, old, new):
+    """
+    ``(path, mode, status)`` of the changes from the tree ``old`` to ``new``,
+    None if git failed or a ``.gitattributes`` changed
+    """
+    fields, returncode = _git_split(DIFF_TREE + [old, new], toplevel, runner)
+    if returncode:
+        return None
+    changes = []
+    # :<old mode> <new mode> <old blob> <new blob> <status> NUL <path> NUL
+    for info, path in zip(fields[0::2], fields[1::2]):
+        _, mode, _, _, status = info.split(" ")
+        if path.rpartition("/")[2] == ".gitattributes":
+            # git archive reads the attributes of the tree, check-attr the index
+            trace("file list cache: .gitattributes changed in", new)
+            return None
+        changes.append((path, mode, status))
+    return changes
+
+
+def _git_changed_ignored(toplevel, changed):
+    """the export-ignored paths of the ``(path, mode)`` changes, None on failure"""
+    try:
+        ignored = _git_export_ignored(
+            toplevel,
+            [
+                # directories are checked like the full listing checks them
+                (path + "/" if mode in _TREE_MODES else path).encode(
+                    "utf-8", "surrogateescape"
+                )
+                for path, mode in changed
+            ],
+        )
+    except OSError as e:
+        trace("export-ignore check failed", e)
+        return None
+    return {path.decode("utf-8", "surrogateescape") for path in ignored}
+
+
+def _git_apply_tree_diff(toplevel, runner, listing, ignored, old, new):
+    """
+    change ``listing`` and the ``ignored`` paths of the tree ``old``
+    into those of ``new``, False if git failed
+    """
+    changes = _git_read_tree_diff(toplevel, runner, old, new)
+    if changes is None:
+        return False
+    git_files, git_dirs = listing
+    prefix = toplevel + os.path.sep
+    changed = []
+    trees = []
+    for path, mode, status in changes:
+        if status == "M":
+            # same path and type, the same attributes apply
+            if mode == "040000":
+                # but a tree may have gained or lost what git archive writes it for
+                trees.append(path)
+            continue
+        name = os.path.normcase(prefix + path.replace("/", os.path.sep))
+        git_files.discard(name)
+        git_dirs.discard(name)
+        ignored.discard(path)
+        if status != "D":
+            changed.append((path, mode))
+    added_ignored = _git_changed_ignored(toplevel, changed)
+    if added_ignored is None:
+        return False
+    ignored.update(added_ignored)
+    for path, mode in changed:
+        if mode == "040000":
+            trees.append(path)
+        elif not _git_is_excluded(path, ignored):
+            name = os.path.normcase(prefix + path.replace("/", os.path.sep))
+            # submodules are archived as empty directories
+            (git_dirs if mode == "160000" else git_files).add(name)
+    return _git_apply_written_trees(toplevel, runner, listing, ignored, new, trees)
+
+
+def _git_trees_with_contents(toplevel, runner, ignored, tree, paths):
+    """
+    the ancestors of the blobs and submodules below the ``paths`` of ``tree``
+    which aren't in an ignored tree, None if git failed
+    """
+    cmd = LS_TREE_CONTENTS + [tree, "--"] + sorted(paths)
+    contents, returncode = _git_split(cmd, toplevel, runner)
+    if returncode:
+        return None
+    trees = set()
+    for path in contents:
+        parent = path.rpartition("/")[0]
+        if not _git_is_excluded(parent, ignored):
+            while parent:
+                trees.add(parent)
+                parent = parent.rpartition("/")[0]
+    return trees
+
+
+def _git_apply_written_trees(toplevel, runner, listing, ignored, tree, paths):
+    """
+    list the trees ``paths`` of ``tree`` that git archive writes,
+    those with a blob or submodule inside them which isn't in an ignored tree,
+    False if git failed
+    """
+    git_files, git_dirs = listing
+    prefix = toplevel + os.path.sep
+    names = sorted(git_files | git_dirs)
+    written = set()
+    unknown = set()
+    for path in paths:
+        if _git_is_excluded(path, ignored):
+            continue
+        start = os.path.normcase(prefix + path.replace("/", os.path.sep) + os.path.sep)
+        index = bisect_left(names, start)
+        if index < len(names) and names[index].startswith(start):
+            written.add(path)
+        else:
+            unknown.add(path)
+    if unknown:
+        # nothing listed inside them, only export-ignored blobs can still count
+        found = _git_trees_with_contents(toplevel, runner, ignored, tree, unknown)
+        if found is None:
+            return False
+        written.update(found)
+    for path in paths:
+        name = os.path.normcase(prefix + path.replace("/", os.path.sep))
+        if path in written:
+            git_dirs.add(name)
+        else:
+            git_dirs.discard(name)
+    return True
+
+
+def _git_cache_hit(cache, entry, key):
+    """the cached listing if ``entry`` was stored for ``key``, else None"""
+    try:
+        if entry is not None and entry.get("key") == key:
+            trace("file list cache hit", key["tree"])
+            return cache.listing(entry)
+    except (KeyError, TypeError, ValueError) as e:
+        trace("unusable file list cache entry", e)
+    return None
+
+
+def _git_updated_listing(cache, entry, key, attributes, toplevel, runner):
+    """
+    ``(listing, ignored)`` of the cached ``entry`` updated to the tree of ``key``
+    with ``git diff-tree``, None if the export-ignore attributes changed
+    """
+    try:
+        if (
+            entry is None
+            or entry["attributes"] != attributes
+            or entry["key"]["info/attributes"] != key["info/attributes"]
+        ):
+            return None
+        listing = cache.listing(entry)
+        ignored = set(entry["ignored"])
+        old = entry["key"]["tree"]
+    except (KeyError, TypeError, ValueError) as e:
+        trace("unusable file list cache entry", e)
+        return None
+    if old != key["tree"]:
+        trace("file list cache update", old, key["tree"])
+        if not _git_apply_tree_diff(
+            toplevel, runner, listing, ignored, old, key["tree"]
+        ):
+            return None
+    return listing, ignored
+
+
+def _git_cached_files_and_dirs(cache, repo, toplevel, runner):
+    """
+    the HEAD listing, reused from ``cache`` while the HEAD tree
+    and the export-ignore attributes are unchanged
+
+    if only the tree changed the cached listing is updated
+    with ``git diff-tree`` instead of listing the whole tree again
+    """
+    key = _git_listing_key(repo)
+    if key is None:
+        return None
+    entry = cache.load()
+    listing = _git_cache_hit(cache, entry, key)
+    if listing is not None:
+        return listing
+    # the index changes often, the export-ignore attributes in it rarely
+    attributes = _git_staged_attributes(toplevel, runner)
+    if attributes is None:
+        return None
+    updated = _git_updated_listing(cache, entry, key, attributes, toplevel, runner)
+    if updated is not None:
+        listing, ignored = updated
+    else:
+        listed = _git_list_tree(toplevel, runner, key["tree"], attributes)
+        if listed is None:
+            # listing again without the cache would fail the same way
+            return _git_archive_files_and_dirs(toplevel, runner)
+        git_files, git_dirs, ignored = listed
+        listing = git_files, git_dirs
+        ignored = {path.decode("utf-8", "surrogateescape") for path in ignored}
+    if _git_listing_key(repo) == key:
+        # nothing changed while listing
+        cache.store(key, *listing, attributes=attributes, ignored=sorted(ignored))
+    return listing
+
+
+def _git_cached_listing(toplevel, runner):
+    """the HEAD listing through the file list cache, None without the cache"""
+    try:
+        repo = GitRepository.from_worktree(toplevel)
+    except READ_ERRORS as e:
+        trace("file list cache unavailable", e)
+        return None
+    cache = FileListCache.from_env(repo.git_dir, toplevel)
+    if cache is None:
+        return None
+    try:
+        with repo:
+            return _git_cached_files_and_dirs(cache, repo, toplevel, runner)
+    except READ_ERRORS as e:
+        trace("file list cache unavailable", e)
+        return None
+
+
+def _git_ls_files_and_dirs(toplevel, runner=None):
+    if os.environ.get(WORKTREE_LISTING_KEY):
+        try:
+            return _git_index_files_and_dirs(toplevel)
+        except READ_ERRORS as e:
+            trace("unable to read the git index, listing HEAD", e)
+    runner = get_runner(runner)
+    if not isinstance(runner, PopenRunner):
+        # check-attr reads the paths from stdin, other runners can't provide it
+        return _git_archive_files_and_dirs(toplevel, runner)
+    listed = _git_cached_listing(toplevel, runner)
+    if listed is not None:
+        return listed
+    listed = _git_list_tree(toplevel, runner)
+    if listed is None:
+        # git archive logs if it fails as well
+        return _git_archive_files_and_dirs(toplevel, runner)
+    return listed[:2]
 
 
-def git_find_files(path=""):
-    toplevel = _git_toplevel(path)
+def git_find_files(path="", runner=None):
+    toplevel = _git_toplevel(path, runner)
     if not is_toplevel_acceptable(toplevel):
         return []
     fullpath = os.path.abspath(os.path.normpath(path))
     if not fullpath.startswith(toplevel):
         trace("toplevel mismatch", toplevel, fullpath)
-    git_files, git_dirs = _git_ls_files_and_dirs(toplevel)
+    git_files, git_dirs = _git_ls_files_and_dirs(toplevel, runner)
     return scm_find_files(path, git_files, git_dirs)
@@ -1,49 +1,105 @@
 import os
-import subprocess
 
+from ._files_cache import FileListCache
+from ._git_repo import READ_ERRORS
+from ._hg_dirstate import state_key
+from ._hg_dirstate import tracked_paths
+from .file_finder import FileListing
 from .file_finder import is_toplevel_acceptable
 from .file_finder import scm_find_files
+from .file_finder import WORKTREE_LISTING_KEY
 from .utils import do_ex
+from .utils import get_runner
+from .utils import has_command
+from .utils import iter_split
+from .utils import PopenRunner
+from .utils import trace
 
+# NUL separated, so names are streamed and never confused with line breaks
+HG_FILES = ["hg", "files", "-0"]
 
-def _hg_toplevel(path):
+
+def _hg_toplevel(path, runner=None):
+    if not has_command("hg", warn=False, runner=runner):
+        return None
     try:
-        with open(os.devnull, "wb") as devnull:
-            out = subprocess.check_output(
-                ["hg", "root"],
-                cwd=(path or "."),
-                universal_newlines=True,
-                stderr=devnull,
-            )
+        out, err, ret = do_ex(["hg", "root"], cwd=(path or "."), runner=runner)
+        if ret:
+            # hg returned error, we are not in a mercurial repo
+            return None
         return os.path.normcase(os.path.realpath(out.strip()))
-    except subprocess.CalledProcessError:
-        # hg returned error, we are not in a mercurial repo
-        return None
     except OSError:
         # hg command not found, probably
         return None
 
 
-def _hg_ls_files_and_dirs(toplevel):
-    hg_files = set()
-    hg_dirs = {toplevel}
-    out, err, ret = do_ex(["hg", "files"], cwd=toplevel)
-    if ret:
-        (), ()
-    for name in out.splitlines():
-        name = os.path.normcase(name).replace("/", os.path.sep)
-        fullname = os.path.join(toplevel, name)
-        hg_files.add(fullname)
-        dirname = os.path.dirname(fullname)
-        while len(dirname) > len(toplevel) and dirname not in hg_dirs:
-            hg_dirs.add(dirname)
-            dirname = os.path.dirname(dirname)
-    return hg_files, hg_dirs
-
-
-def hg_find_files(path=""):
-    toplevel = _hg_toplevel(path)
+def _hg_dirstate_files_and_dirs(toplevel):
+    """
+    the tracked files and the directories they imply,
+    read from ``.hg/dirstate`` without running hg
+    """
+    listing = FileListing(toplevel)
+    for path in tracked_paths(os.path.join(toplevel, ".hg")):
+        listing.add_file(path.decode("utf-8", "surrogateescape"))
+    return listing.files, listing.dirs
+
+
+def _hg_list_files(toplevel, runner):
+    """the tracked files and directories from ``hg files``, None if hg failed"""
+    listing = FileListing(toplevel)
+    names = iter_split(HG_FILES, toplevel, runner)
+    while True:
+        try:
+            name = next(names)
+        except StopIteration as stop:
+            returncode = stop.value
+            break
+        # on windows hg prints native separators
+        listing.add_file(name.replace(os.path.sep, "/"))
+    if returncode:
+        # also the case when nothing is tracked yet
+        return None
+    return listing.files, listing.dirs
+
+
+def _hg_list_tracked(toplevel, runner):
+    if os.environ.get(WORKTREE_LISTING_KEY):
+        try:
+            return _hg_dirstate_files_and_dirs(toplevel)
+        except READ_ERRORS as e:
+            trace("unable to read the hg dirstate, running hg files", e)
+    return _hg_list_files(toplevel, runner)
+
+
+def _hg_ls_files_and_dirs(toplevel, runner=None):
+    hg_dir = os.path.join(toplevel, ".hg")
+    cache = None
+    if isinstance(get_runner(runner), PopenRunner):
+        # other runners have to see the commands
+        cache = FileListCache.from_env(hg_dir, toplevel)
+    if cache is None:
+        return _hg_list_tracked(toplevel, runner) or ((), ())
+
+    # the dirstate holds the tracked files and the parent whose manifest they are from
+    key = state_key(hg_dir)
+    entry = cache.load()
+    if key is not None and entry is not None and entry.get("key") == key:
+        try:
+            return cache.listing(entry)
+        except (KeyError, TypeError) as e:
+            trace("unusable file list cache entry", e)
+    listing = _hg_list_tracked(toplevel, runner)
+    if listing is None:
+        return (), ()
+    if key is not None and state_key(hg_dir) == key:
+        # nothing changed while listing
+        cache.store(key, *listing)
+    return listing
+
+
+def hg_find_files(path="", runner=None):
+    toplevel = _hg_toplevel(path, runner)
     if not is_toplevel_acceptable(toplevel):
         return []
-    hg_files, hg_dirs = _hg_ls_files_and_dirs(toplevel)
+    hg_files, hg_dirs = _hg_ls_files_and_dirs(toplevel, runner)
     return scm_find_files(path, hg_files, hg_dirs)
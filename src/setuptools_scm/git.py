@@ -1,51 +1,491 @@
+import asyncio
 import os
+import re
+import shlex
+import subprocess
+import time
 import warnings
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from fnmatch import fnmatchcase
 from os.path import isfile
 from os.path import join
 from os.path import samefile
+from typing import NamedTuple
+from typing import Optional
 
+from . import _instrument
+from ._git_repo import GitRepository
+from ._git_repo import READ_ERRORS
+from ._nearest_tag import nearest_tag
+from ._nearest_tag import NearestTagSearch
+from .config import _check_tag_regex
 from .config import Configuration
+from .discover import iter_git_roots
+from .discover import walk_potential_roots
 from .scm_workdir import Workdir
+from .utils import _popen_pipes
 from .utils import do_ex
+from .utils import do_ex_async
+from .utils import get_runner
+from .utils import PopenRunner
 from .utils import require_command
 from .utils import trace
 from .version import meta
+from .version import tag_to_version
 
 DEFAULT_DESCRIBE = "git describe --dirty --tags --long --match *[0-9]*"
+# used when the dirty state comes from a ``dirty_strategy`` instead
+CLEAN_DESCRIBE = "git describe --tags --long --match *[0-9]*"
+# the --match glob of the describe commands above
+DESCRIBE_MATCH = "*[0-9]*"
+_REGEX_SPECIAL = set(".^$*+?{}[]|()\\")
+_REGEX_REPEAT = set("*+?{")
+# first step and total cap of ``deepen_on_shallow``
+DEEPEN_START = 32
+DEEPEN_LIMIT = 16384
+DEFAULT_DIRTY_STRATEGY = "status"
+DIRTY_STRATEGIES = {
+    # what ``git describe --dirty`` (or status for untagged checkouts) reports
+    "status": ["git", "status", "--porcelain", "--untracked-files=no"],
+    # no index refresh, a tracked file whose stat data changed counts as dirty
+    "diff-index": ["git", "diff-index", "--quiet", "HEAD", "--"],
+    # no index refresh written back, the fsmonitor and untracked cache
+    # of the repository configuration are used where they are enabled
+    "fsmonitor": [
+        "git",
+        "--no-optional-locks",
+        "status",
+        "--porcelain",
+        "--untracked-files=no",
+    ],
+    # changes inside submodules and moved submodule commits are not dirty
+    "ignore-submodules": [
+        "git",
+        "status",
+        "--porcelain",
+        "--untracked-files=no",
+        "--ignore-submodules=all",
+    ],
+}
+DEFAULT_DESCRIBE_ENGINE = "cli"
+# the node length of the nearest-tag engine, independent of the object count
+NEAREST_TAG_ABBREV = 7
+# "nearest-tag" walks the history itself, see ``GitWorkdir.describe_nearest_tag``
+DESCRIBE_ENGINES = (DEFAULT_DESCRIBE_ENGINE, "nearest-tag")
+# every commit with its parents, parents are listed before their children
+HISTORY_LOG = ["git", "log", "--topo-order", "--reverse", "--format=%H %cI %P"]
+HISTORY_TAGS = [
+    "git",
+    "for-each-ref",
+    "--format=%(refname) %(objecttype) %(objectname)"
+    " %(*objecttype) %(*objectname) %(taggerdate:raw)",
+    "refs/tags/",
+]
+PARALLEL_QUERIES_KEY = "SETUPTOOLS_SCM_PARALLEL_QUERIES"
+# sha, committer date and the branch decoration of HEAD in one go
+HEAD_INFO = [
+    "git",
+    "log",
+    "-n",
+    "1",
+    "--decorate=short",
+    "--decorate-refs=HEAD",
+    "--decorate-refs=refs/heads/",
+    "--format=%H%n%cI%n%D",
+    "HEAD",
+]
+# sha, committer date and the local branches pointing at a revision
+REV_INFO = [
+    "git",
+    "log",
+    "-n",
+    "1",
+    "--decorate=short",
+    "--decorate-refs=refs/heads/",
+    "--format=%H%n%cI%n%D",
+]
+# describe options that only make sense for the worktree
+_WORKTREE_DESCRIBE_OPTIONS = ("--dirty", "--broken")
+
+
+class GitSnapshot(NamedTuple):
+    """immutable summary of the repository state a version is built from"""
+
+    sha: Optional[str]
+    branch: Optional[str]
+    node_date: Optional[date]
+    tag: str
+    distance: Optional[int]
+    node: Optional[str]
+    dirty: bool
+
+
+def _parse_commit_date(commit):
+    """
+    extract the committer date of a raw commit object
+
+    the date is taken in the committers timezone, matching ``git log --format=%cI``
+    """
+    for line in commit.split(b"\n"):
+        if not line:
+            # end of the commit headers
+            break
+        if line.startswith(b"committer "):
+            timestamp, offset = line.rsplit(b" ", 2)[1:]
+            sign = -1 if offset.startswith(b"-") else 1
+            tz = timezone(
+                sign * timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5]))
+            )
+            return datetime.fromtimestamp(int(timestamp), tz).date()
+    return None
+
+
+class _CatFileBatch:
+    """
+    a long running ``git cat-file --batch`` process
+
+    object names are written to its stdin and the objects are read back
+    from its stdout, so any number of lookups costs a single git process
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._started = time.perf_counter()
+        self._read = 0
+        self._proc = _popen_pipes(
+            ["git", "cat-file", "--batch"],
+            path,
+            stdin=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def lookup(self, name):
+        """
+        return ``(sha, type, content)`` of the object ``name`` resolves to
+
+        returns None if the name does not resolve
+        """
+        trace("cat-file", name)
+        self._proc.stdin.write(name.encode("utf-8") + b"\n")
+        self._proc.stdin.flush()
+        header = self._proc.stdout.readline()
+        self._read += len(header)
+        if not header:
+            raise OSError("git cat-file --batch exited unexpectedly")
+        parts = header.split()
+        if len(parts) != 3:
+            # "<name> missing" or "<name> ambiguous"
+            trace("cat-file miss", header)
+            return None
+        sha, kind, size = parts
+        content = self._proc.stdout.read(int(size))
+        self._proc.stdout.read(1)  # trailing newline
+        self._read += len(content) + 1
+        return sha.decode("ascii"), kind.decode("ascii"), content
+
+    def close(self):
+        self._proc.stdin.close()
+        returncode = self._proc.wait()
+        self._proc.stdout.close()
+        # the whole session counts as one command
+        _instrument.record(
+            self._proc.args, self._path, self._started, returncode, self._read
+        )
+
+
+def _toplevel_from_prefix(wd, real_wd, ret):
+    """turn the output of ``git rev-parse --show-prefix`` into the toplevel"""
+    real_wd = real_wd[:-1]  # remove the trailing pathsep
+    if ret:
+        return
+    if not real_wd:
+        real_wd = wd
+    else:
+        assert wd.replace("\\", "/").endswith(real_wd)
+        # In windows wd contains ``\`` which should be replaced by ``/``
+        # for this assertion to work.  Length of string isn't changed by replace
+        # ``\\`` is just and escape for `\`
+        real_wd = wd[: -len(real_wd)]
+    trace("real root", real_wd)
+    if not samefile(real_wd, wd):
+        return
+    return real_wd
+
+
+def _parse_head_date(timestamp):
+    # TODO, when dropping python3.6 use fromiso
+    date_part = timestamp.split("T")[0]
+    if "%c" in date_part:
+        trace("git too old -> timestamp is ", timestamp)
+        return None
+    return datetime.strptime(date_part, r"%Y-%m-%d").date()
+
+
+def _parse_count(out, err, ret):
+    """parse ``git rev-list --count``, 0 if it failed, e.g. on missing objects"""
+    if ret or not out.isdigit():
+        trace("count err", out, err, ret)
+        return 0
+    return int(out)
+
+
+def _parse_head_info(out):
+    """parse the output of ``HEAD_INFO``, None if it's not usable"""
+    lines = out.split("\n")
+    if len(lines) != 3:
+        return None
+    sha, timestamp, decorations = lines
+    head = decorations.split(", ")[0]
+    if head.startswith("HEAD -> "):
+        branch = head[len("HEAD -> ") :]
+    else:
+        # detached, matches ``git rev-parse --abbrev-ref HEAD``
+        branch = "HEAD"
+    return sha, branch, _parse_head_date(timestamp)
+
+
+def _parse_rev_info(out, rev):
+    """parse ``REV_INFO`` output, the branch is only known if ``rev`` names one"""
+    # the output is stripped, the decorations line is gone if there are none
+    lines = out.split("\n")
+    if len(lines) not in (2, 3):
+        return None
+    sha, timestamp, decorations = lines + [""] * (3 - len(lines))
+    if rev.startswith("refs/heads/"):
+        rev = rev[len("refs/heads/") :]
+    branch = rev if rev in decorations.split(", ") else None
+    return sha, branch, _parse_head_date(timestamp)
+
+
+def _clean_describe_command(describe_command, match):
+    """the describe command without the options which look at the worktree"""
+    if describe_command is None:
+        return _describe_args(match, dirty=False)
+    if isinstance(describe_command, str):
+        describe_command = shlex.split(describe_command)
+    return [
+        arg
+        for arg in describe_command
+        if arg.partition("=")[0] not in _WORKTREE_DESCRIBE_OPTIONS
+    ]
+
+
+def _rev_describe_command(describe_command, match, sha):
+    """the describe command for the commit ``sha`` instead of the worktree"""
+    return _clean_describe_command(describe_command, match) + [sha]
+
+
+def _call_now(fn, *args):
+    """run ``fn`` right away, wrapping the outcome like ``Executor.submit``"""
+    future = Future()
+    try:
+        future.set_result(fn(*args))
+    except BaseException as e:
+        future.set_exception(e)
+    return future
+
+
+def _dirty_command(strategy):
+    try:
+        return DIRTY_STRATEGIES[strategy]
+    except KeyError:
+        raise ValueError(
+            f"unknown dirty_strategy {strategy!r},"
+            f" expected one of {', '.join(DIRTY_STRATEGIES)}"
+        ) from None
+
+
+def _has_top_level_alternation(pattern):
+    depth = 0
+    pos = 0
+    in_class = False
+    while pos < len(pattern):
+        char = pattern[pos]
+        if char == "\\":
+            pos += 1
+        elif in_class:
+            in_class = char != "]"
+        elif char == "[":
+            in_class = True
+            # a ] right after [ or [^ is part of the class
+            if pattern[pos + 1 : pos + 2] == "^":
+                pos += 1
+            if pattern[pos + 1 : pos + 2] == "]":
+                pos += 1
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and not depth:
+            return True
+        pos += 1
+    return False
+
+
+def _literal_prefix(tag_regex):
+    """the literal text every tag matched by ``tag_regex`` starts with"""
+    pattern = tag_regex.pattern
+    if (
+        not isinstance(pattern, str)
+        or tag_regex.flags & (re.IGNORECASE | re.VERBOSE)
+        or _has_top_level_alternation(pattern)
+    ):
+        return ""
+    # tags are matched with ``re.match``, the start is anchored anyway
+    pos = 1 if pattern.startswith("^") else 0
+    prefix = []
+    while pos < len(pattern):
+        char = pattern[pos]
+        if char == "\\":
+            literal = pattern[pos + 1 : pos + 2]
+            # \d, \w, backreferences and the like aren't literals
+            if not literal or literal.isalnum() or literal in "*?[]\\":
+                break
+            size = 2
+        elif char in _REGEX_SPECIAL:
+            break
+        else:
+            literal = char
+            size = 1
+        if pattern[pos + size : pos + size + 1] in _REGEX_REPEAT:
+            # the character may be repeated or left out
+            break
+        prefix.append(literal)
+        pos += size
+    return "".join(prefix)
+
+
+def describe_match(tag_regex):
+    """
+    the ``git describe --match`` glob for ``tag_regex``
+
+    narrowed to the literal prefix of the regex where there is one,
+    so describe only considers tags ``tag_regex`` can match
+    """
+    prefix = "" if tag_regex is None else _literal_prefix(tag_regex)
+    if not prefix:
+        return DESCRIBE_MATCH
+    if any(char.isdigit() for char in prefix):
+        return prefix + "*"
+    return prefix + DESCRIBE_MATCH
+
+
+def _describe_args(match, dirty):
+    dirty_args = ["--dirty"] if dirty else []
+    return ["git", "describe", *dirty_args, "--tags", "--long", "--match", match]
+
+
+def _check_describe_engine(engine):
+    if engine not in DESCRIBE_ENGINES:
+        raise ValueError(
+            f"unknown describe_engine {engine!r}, expected one of {DESCRIBE_ENGINES}"
+        )
+
+
+def _dirty_from_result(strategy, out, ret):
+    """
+    interpret the output of a dirty check
+
+    returns None if the check can't tell, e.g. diff-index without a HEAD
+    """
+    if strategy == "diff-index":
+        return bool(ret) if ret in (0, 1) else None
+    return bool(out)
+
+
+def _described_snapshot(describe_output, sha, branch, node_date, dirty=None):
+    tag, distance, node, described_dirty = _git_parse_describe(describe_output)
+    if dirty is None:
+        dirty = described_dirty
+    if distance == 0 and not dirty:
+        distance = None
+    return GitSnapshot(sha, branch, node_date, tag, distance, node, dirty)
+
+
+def _untagged_snapshot(sha, branch, node_date, distance, dirty):
+    node = None if sha is None else "g" + sha[:7]
+    return GitSnapshot(sha, branch, node_date, "0.0", distance, node, dirty)
 
 
 class GitWorkdir(Workdir):
     """experimental, may change at any time"""
 
     COMMAND = "git"
+    _batch = None
+    # the describe the shallow checks run, set by ``parse`` from its configuration
+    describe_check = None
 
     @classmethod
-    def from_potential_worktree(cls, wd):
-        require_command(cls.COMMAND)
+    def from_potential_worktree(cls, wd, runner=None):
+        require_command(cls.COMMAND, runner)
         wd = os.path.abspath(wd)
-        real_wd, _, ret = do_ex("git rev-parse --show-prefix", wd)
-        real_wd = real_wd[:-1]  # remove the trailing pathsep
-        if ret:
-            return
-        if not real_wd:
-            real_wd = wd
-        else:
-            assert wd.replace("\\", "/").endswith(real_wd)
-            # In windows wd contains ``\`` which should be replaced by ``/``
-            # for this assertion to work.  Length of string isn't changed by replace
-            # ``\\`` is just and escape for `\`
-            real_wd = wd[: -len(real_wd)]
-        trace("real root", real_wd)
-        if not samefile(real_wd, wd):
-            return
+        real_wd, _, ret = do_ex("git rev-parse --show-prefix", wd, runner)
+        real_wd = _toplevel_from_prefix(wd, real_wd, ret)
+        if real_wd is not None:
+            return cls(real_wd, runner)
+
+    @classmethod
+    async def from_potential_worktree_async(cls, wd, runner=None):
+        require_command(cls.COMMAND, runner)
+        wd = os.path.abspath(wd)
+        real_wd, _, ret = await do_ex_async("git rev-parse --show-prefix", wd, runner)
+        real_wd = _toplevel_from_prefix(wd, real_wd, ret)
+        if real_wd is not None:
+            return cls(real_wd, runner)
 
-        return cls(real_wd)
+    def __enter__(self):
+        """
+        keep a ``git cat-file --batch`` process open for object lookups
 
-    def is_dirty(self):
-        out, _, _ = self.do_ex("git status --porcelain --untracked-files=no")
-        return bool(out)
+        queries the batch protocol cannot answer still use ``do_ex``,
+        as do all queries when a runner other than a ``PopenRunner`` is used
+        """
+        if not isinstance(get_runner(self.runner), PopenRunner):
+            return self
+        try:
+            self._batch = _CatFileBatch(self.path)
+        except OSError:
+            trace("unable to start cat-file session", self.path)
+        return self
+
+    def close(self):
+        batch, self._batch = self._batch, None
+        if batch is not None:
+            batch.close()
+
+    def _lookup_object(self, name):
+        """
+        resolve ``name`` through the session
+
+        returns False when no session can answer the lookup
+        """
+        if self._batch is None:
+            return False
+        try:
+            return self._batch.lookup(name)
+        except OSError:
+            trace("cat-file session failed, falling back", self.path)
+            self.close()
+            return False
+
+    def is_dirty(self, strategy=DEFAULT_DIRTY_STRATEGY):
+        out, _, ret = self.do_ex(_dirty_command(strategy))
+        dirty = _dirty_from_result(strategy, out, ret)
+        if dirty is None:
+            return self.is_dirty()
+        return dirty
+
+    async def is_dirty_async(self, strategy=DEFAULT_DIRTY_STRATEGY):
+        out, _, ret = await self.do_ex_async(_dirty_command(strategy))
+        dirty = _dirty_from_result(strategy, out, ret)
+        if dirty is None:
+            return await self.is_dirty_async()
+        return dirty
 
     def get_branch(self):
         branch, err, ret = self.do_ex("git rev-parse --abbrev-ref HEAD")
@@ -57,17 +497,34 @@ class GitWorkdir(Workdir):
                 branch = None
         return branch
 
+    async def get_branch_async(self):
+        branch, err, ret = await self.do_ex_async("git rev-parse --abbrev-ref HEAD")
+        if ret:
+            trace("branch err", branch, err, ret)
+            branch, err, ret = await self.do_ex_async("git symbolic-ref --short HEAD")
+            if ret:
+                trace("branch err (symbolic-ref)", branch, err, ret)
+                branch = None
+        return branch
+
     def get_head_date(self):
+        found = self._lookup_object("HEAD")
+        if found is None:
+            return None
+        elif found:
+            return _parse_commit_date(found[2])
         timestamp, err, ret = self.do_ex("git log -n 1 HEAD --format=%cI")
         if ret:
             trace("timestamp err", timestamp, err, ret)
             return
-        # TODO, when dropping python3.6 use fromiso
-        date_part = timestamp.split("T")[0]
-        if "%c" in date_part:
-            trace("git too old -> timestamp is ", timestamp)
-            return None
-        return datetime.strptime(date_part, r"%Y-%m-%d").date()
+        return _parse_head_date(timestamp)
+
+    async def get_head_date_async(self):
+        timestamp, err, ret = await self.do_ex_async("git log -n 1 HEAD --format=%cI")
+        if ret:
+            trace("timestamp err", timestamp, err, ret)
+            return
+        return _parse_head_date(timestamp)
 
     def is_shallow(self):
         return isfile(join(self.path, ".git/shallow"))
@@ -76,21 +533,437 @@ class GitWorkdir(Workdir):
         self.do_ex("git fetch --unshallow")
 
     def node(self):
+        found = self._lookup_object("HEAD")
+        if found is None:
+            return None
+        elif found:
+            return found[0][:7]
         node, _, ret = self.do_ex("git rev-parse --verify --quiet HEAD")
         if not ret:
             return node[:7]
 
-    def count_all_nodes(self):
-        revs, _, _ = self.do_ex("git rev-list HEAD")
-        return revs.count("\n") + 1
+    def count_all_nodes(self, rev="HEAD"):
+        return _parse_count(*self.do_ex(["git", "rev-list", "--count", rev]))
+
+    async def count_all_nodes_async(self, rev="HEAD"):
+        return _parse_count(
+            *await self.do_ex_async(["git", "rev-list", "--count", rev])
+        )
 
     def default_describe(self):
         return self.do_ex(DEFAULT_DESCRIBE)
 
+    def _git_repository(self):
+        return GitRepository.from_worktree(self.path)
+
+    def _release_repository(self, repo):
+        """done with a reader returned by ``_git_repository``"""
+        repo.close()
+
+    def describe_nearest_tag(self, tag_regex=None, head=None):
+        """
+        ``git describe --tags --long`` output for the nearest tag matching ``tag_regex``
+        reachable from the commit ``head``, HEAD by default
+
+        the history is walked in the git directory instead of running describe,
+        which is much faster if there are very many tags,
+        ``git describe`` with the ``--match`` glob of ``tag_regex``
+        is still used if the repository can't be read
+
+        the commit is always abbreviated to 7 characters like untagged versions,
+        ``git describe`` uses more in repositories with very many objects
+        """
+        tag_regex = _check_tag_regex(tag_regex)
+        try:
+            repo = self._git_repository()
+            if repo is not None:
+                try:
+                    if head is None:
+                        head = repo.head()[1]
+                    found = head and nearest_tag(repo, head, tag_regex.match)
+                finally:
+                    self._release_repository(repo)
+        except READ_ERRORS as e:
+            trace("nearest tag search failed", e)
+            repo = None
+        if repo is None:
+            # abbreviated like the search does
+            command = _describe_args(describe_match(tag_regex), dirty=False)
+            command.insert(2, f"--abbrev={NEAREST_TAG_ABBREV}")
+            return self.do_ex(command if head is None else command + [head])
+        if not found:
+            return "", "no matching tag found", 128
+        tag, distance = found
+        return f"{tag}-{distance}-g{head[:NEAREST_TAG_ABBREV]}", "", 0
+
+    def get_tags(self):
+        """return a mapping of tag names to the commits they point to"""
+        out, err, ret = self.do_ex(
+            [
+                "git",
+                "for-each-ref",
+                "--format=%(refname) %(objecttype) %(objectname)"
+                " %(*objecttype) %(*objectname)",
+                "refs/tags/",
+            ]
+        )
+        if ret:
+            trace("tag listing err", out, err, ret)
+            return {}
+        tags = {}
+        for line in out.splitlines():
+            refname, *objects = line.split()
+            # the peeled object of annotated tags comes last
+            kind, sha = objects[-2:]
+            if kind == "commit":
+                tags[refname[len("refs/tags/") :]] = sha
+        return tags
+
+    def _head_branch(self):
+        """the branch of the symbolic HEAD in the git dir, ``get_branch`` elsewhere"""
+        try:
+            repo = self._git_repository()
+            if repo is not None:
+                ref = repo.head()[0]
+                self._release_repository(repo)
+        except READ_ERRORS as e:
+            trace("unable to read HEAD", e)
+            repo = None
+        if repo is not None:
+            if ref is None:
+                # detached, matches ``git rev-parse --abbrev-ref HEAD``
+                return "HEAD"
+            if ref.startswith("refs/heads/"):
+                return ref[len("refs/heads/") :]
+        return self.get_branch()
+
+    def get_head_info(self):
+        """
+        return ``(sha, branch, date)`` of HEAD using a single ``git log``
+
+        in a session the commit is looked up through the cat-file process
+        and the branch is read from the symbolic HEAD instead,
+        otherwise this falls back to the individual queries for unborn branches
+        and git versions that lack the needed ``git log`` options
+        """
+        found = self._lookup_object("HEAD")
+        if found is None:
+            return None, self._head_branch(), None
+        elif found:
+            return found[0], self._head_branch(), _parse_commit_date(found[2])
+        out, err, ret = self.do_ex(HEAD_INFO)
+        info = None if ret else _parse_head_info(out)
+        if info is None:
+            trace("head info err", out, err, ret)
+            sha, _, ret = self.do_ex("git rev-parse --verify --quiet HEAD")
+            if ret:
+                return None, self.get_branch(), None
+            return sha, self.get_branch(), self.get_head_date()
+        return info
+
+    def _rev_info_command(self, rev):
+        if rev.startswith("-"):
+            raise ValueError(f"{rev!r} is not a revision")
+        return REV_INFO + [rev, "--"]
+
+    def _check_rev_info(self, rev, out, err, ret):
+        info = None if ret else _parse_rev_info(out, rev)
+        if info is None:
+            trace("rev info err", out, err, ret)
+            raise ValueError(f"{rev!r} is not a commit of {self.path}: {err}")
+        return info
+
+    def get_rev_info(self, rev):
+        """return ``(sha, branch, date)`` of the commit ``rev``"""
+        out, err, ret = self.do_ex(self._rev_info_command(rev))
+        return self._check_rev_info(rev, out, err, ret)
+
+    async def get_rev_info_async(self, rev):
+        out, err, ret = await self.do_ex_async(self._rev_info_command(rev))
+        return self._check_rev_info(rev, out, err, ret)
+
+    async def get_head_info_async(self):
+        out, err, ret = await self.do_ex_async(HEAD_INFO)
+        info = None if ret else _parse_head_info(out)
+        if info is None:
+            trace("head info err", out, err, ret)
+            (sha, _, ret), branch, node_date = await asyncio.gather(
+                self.do_ex_async("git rev-parse --verify --quiet HEAD"),
+                self.get_branch_async(),
+                self.get_head_date_async(),
+            )
+            if ret:
+                return None, branch, None
+            return sha, branch, node_date
+        return info
+
+    def _describe(
+        self,
+        describe_command=None,
+        dirty_strategy=DEFAULT_DIRTY_STRATEGY,
+        describe_engine=DEFAULT_DESCRIBE_ENGINE,
+        tag_regex=None,
+    ):
+        if describe_command is not None:
+            return self.do_ex(describe_command)
+        if describe_engine != DEFAULT_DESCRIBE_ENGINE:
+            return self.describe_nearest_tag(tag_regex)
+        match = describe_match(tag_regex)
+        if match == DESCRIBE_MATCH and dirty_strategy == DEFAULT_DIRTY_STRATEGY:
+            return self.default_describe()
+        return self.do_ex(
+            _describe_args(match, dirty=dirty_strategy == DEFAULT_DIRTY_STRATEGY)
+        )
+
+    def snapshot(
+        self,
+        describe_command=None,
+        executor=None,
+        dirty_strategy=DEFAULT_DIRTY_STRATEGY,
+        describe_engine=DEFAULT_DESCRIBE_ENGINE,
+        tag_regex=None,
+    ):
+        """
+        collect everything a version is built from with as few git calls as possible
+
+        the dirty state is taken from ``git describe --dirty``
+        unless describe fails and there is no tag to go from,
+        any other ``dirty_strategy`` or ``describe_engine`` always runs its own check
+
+        independent queries are submitted to ``executor`` if one is given
+        """
+        _check_describe_engine(describe_engine)
+        if describe_command is not None:
+            describe_engine = DEFAULT_DESCRIBE_ENGINE
+        submit = _call_now if executor is None else executor.submit
+        described = submit(
+            self._describe, describe_command, dirty_strategy, describe_engine, tag_regex
+        )
+        head_info = submit(self.get_head_info)
+        dirty = None
+        if (
+            dirty_strategy != DEFAULT_DIRTY_STRATEGY
+            or describe_engine != DEFAULT_DESCRIBE_ENGINE
+        ):
+            dirty = submit(self.is_dirty, dirty_strategy)
+        out, _, ret = described.result()
+        sha, branch, node_date = head_info.result()
+
+        if ret == 0:
+            return _described_snapshot(
+                out, sha, branch, node_date, None if dirty is None else dirty.result()
+            )
+        # If 'git git_describe_command' failed, try to get the information otherwise.
+        counted = None if sha is None else submit(self.count_all_nodes)
+        if dirty is None:
+            dirty = submit(self.is_dirty)
+        distance = 0 if counted is None else counted.result()
+        return _untagged_snapshot(sha, branch, node_date, distance, dirty.result())
+
+    async def snapshot_async(
+        self,
+        describe_command=None,
+        dirty_strategy=DEFAULT_DIRTY_STRATEGY,
+        describe_engine=DEFAULT_DESCRIBE_ENGINE,
+        tag_regex=None,
+    ):
+        """like ``snapshot``, but independent queries run concurrently"""
+        _check_describe_engine(describe_engine)
+        if describe_command is not None:
+            described = self.do_ex_async(describe_command)
+        elif describe_engine != DEFAULT_DESCRIBE_ENGINE:
+            # the history walk only reads files, keep it off the event loop
+            described = asyncio.get_event_loop().run_in_executor(
+                None, self.describe_nearest_tag, tag_regex
+            )
+        else:
+            described = self.do_ex_async(
+                _describe_args(
+                    describe_match(tag_regex),
+                    dirty=dirty_strategy == DEFAULT_DIRTY_STRATEGY,
+                )
+            )
+        dirty = None
+        if dirty_strategy != DEFAULT_DIRTY_STRATEGY or (
+            describe_command is None and describe_engine != DEFAULT_DESCRIBE_ENGINE
+        ):
+            dirty = asyncio.ensure_future(self.is_dirty_async(dirty_strategy))
+        (out, _, ret), (sha, branch, node_date) = await asyncio.gather(
+            described,
+            self.get_head_info_async(),
+        )
+
+        if ret == 0:
+            if dirty is not None:
+                dirty = await dirty
+            return _described_snapshot(out, sha, branch, node_date, dirty)
+        if dirty is None:
+            dirty = self.is_dirty_async()
+        if sha is None:
+            distance, dirty = 0, await dirty
+        else:
+            distance, dirty = await asyncio.gather(self.count_all_nodes_async(), dirty)
+        return _untagged_snapshot(sha, branch, node_date, distance, dirty)
+
+    def _describe_rev(self, sha, describe_command, describe_engine, tag_regex):
+        """the describe output for the commit ``sha``"""
+        if describe_command is None and describe_engine != DEFAULT_DESCRIBE_ENGINE:
+            return self.describe_nearest_tag(tag_regex, sha)
+        return self.do_ex(
+            _rev_describe_command(describe_command, describe_match(tag_regex), sha)
+        )
+
+    def snapshot_rev(
+        self,
+        rev,
+        describe_command=None,
+        describe_engine=DEFAULT_DESCRIBE_ENGINE,
+        tag_regex=None,
+    ):
+        """
+        like ``snapshot``, but for the commit ``rev`` instead of the checkout
+
+        the worktree isn't looked at, so the snapshot is never dirty
+        """
+        _check_describe_engine(describe_engine)
+        sha, branch, node_date = self.get_rev_info(rev)
+        out, _, ret = self._describe_rev(
+            sha, describe_command, describe_engine, tag_regex
+        )
+        if ret == 0:
+            return _described_snapshot(out, sha, branch, node_date, False)
+        distance = self.count_all_nodes(sha)
+        return _untagged_snapshot(sha, branch, node_date, distance, False)
+
+    async def snapshot_rev_async(
+        self,
+        rev,
+        describe_command=None,
+        describe_engine=DEFAULT_DESCRIBE_ENGINE,
+        tag_regex=None,
+    ):
+        """asyncio variant of ``snapshot_rev``"""
+        _check_describe_engine(describe_engine)
+        sha, branch, node_date = await self.get_rev_info_async(rev)
+        if describe_command is None and describe_engine != DEFAULT_DESCRIBE_ENGINE:
+            out, _, ret = await asyncio.get_event_loop().run_in_executor(
+                None, self.describe_nearest_tag, tag_regex, sha
+            )
+        else:
+            out, _, ret = await self.do_ex_async(
+                _rev_describe_command(describe_command, describe_match(tag_regex), sha)
+            )
+        if ret == 0:
+            return _described_snapshot(out, sha, branch, node_date, False)
+        distance = await self.count_all_nodes_async(sha)
+        return _untagged_snapshot(sha, branch, node_date, distance, False)
+
+
+class NativeGitWorkdir(GitWorkdir):
+    """
+    answers HEAD and tag queries by reading the git directory directly
+
+    anything the reader can't handle is delegated to the git cli
+
+    experimental, may change at any time
+    """
+
+    @classmethod
+    def from_potential_worktree(cls, wd, runner=None):
+        require_command(cls.COMMAND, runner)
+        wd = os.path.abspath(wd)
+        self = cls(wd, runner)
+        if self.repo is None:
+            return super().from_potential_worktree(wd, runner)
+        return self
+
+    @classmethod
+    async def from_potential_worktree_async(cls, wd, runner=None):
+        require_command(cls.COMMAND, runner)
+        wd = os.path.abspath(wd)
+        self = cls(wd, runner)
+        if self.repo is None:
+            return await super().from_potential_worktree_async(wd, runner)
+        return self
+
+    def __init__(self, path, runner=None):
+        super().__init__(path, runner)
+        try:
+            self.repo = GitRepository.from_worktree(path)
+        except READ_ERRORS as e:
+            trace("git reader unavailable", path, e)
+            self.repo = None
+
+    def _read_head(self):
+        if self.repo is None:
+            raise LookupError("no git reader")
+        ref, sha = self.repo.head()
+        if ref is None:
+            branch = "HEAD"
+        elif ref.startswith("refs/heads/"):
+            branch = ref[len("refs/heads/") :]
+        else:
+            raise LookupError(f"HEAD points to {ref}")
+        node_date = sha and _parse_commit_date(self.repo.read_object(sha)[1])
+        return sha, branch, node_date
+
+    def get_head_info(self):
+        try:
+            return self._read_head()
+        except (LookupError,) + READ_ERRORS as e:
+            trace("git reader failed", e)
+            return super().get_head_info()
+
+    async def get_head_info_async(self):
+        try:
+            return self._read_head()
+        except (LookupError,) + READ_ERRORS as e:
+            trace("git reader failed", e)
+            return await super().get_head_info_async()
+
+    def get_branch(self):
+        return self.get_head_info()[1]
+
+    def get_head_date(self):
+        return self.get_head_info()[2]
+
+    def node(self):
+        sha = self.get_head_info()[0]
+        return sha and sha[:7]
+
+    def _git_repository(self):
+        return self.repo
+
+    def _release_repository(self, repo):
+        # kept until the workdir is closed
+        pass
+
+    def close(self):
+        super().close()
+        if self.repo is not None:
+            self.repo.close()
+
+    def get_tags(self):
+        if self.repo is not None:
+            try:
+                return self.repo.tags()
+            except READ_ERRORS as e:
+                trace("git reader failed", e)
+        return super().get_tags()
+
+
+GIT_BACKENDS = {"cli": GitWorkdir, "native": NativeGitWorkdir}
+
+
+def _describe_would_succeed(wd):
+    """check whether ``git describe`` finds a matching tag in the available history"""
+    _, _, ret = wd.do_ex(wd.describe_check or CLEAN_DESCRIBE)
+    return ret == 0
+
 
 def warn_on_shallow(wd):
     """experimental, may change at any time"""
-    if wd.is_shallow():
+    if wd.is_shallow() and not _describe_would_succeed(wd):
         warnings.warn(f'"{wd.path}" is shallow and may cause errors')
 
 
@@ -101,26 +974,83 @@ def fetch_on_shallow(wd):
         wd.fetch_shallow()
 
 
+def deepen_on_shallow(wd, start=DEEPEN_START, limit=DEEPEN_LIMIT):
+    """
+    deepen a shallow clone by ``start`` commits, doubling the step each time,
+    until ``git describe`` finds a tag or ``limit`` commits were fetched
+
+    use ``functools.partial`` to pass other ``start``/``limit`` values
+
+    experimental, may change at any time
+    """
+    if not wd.is_shallow() or _describe_would_succeed(wd):
+        return
+    step, fetched = start, 0
+    while fetched < limit:
+        step = min(step, limit - fetched)
+        trace("deepen", wd.path, step)
+        _, err, ret = wd.do_ex(["git", "fetch", f"--deepen={step}"])
+        if ret:
+            warnings.warn(f'"{wd.path}" is shallow and could not be deepened: {err}')
+            return
+        fetched += step
+        if not wd.is_shallow() or _describe_would_succeed(wd):
+            return
+        step *= 2
+    warnings.warn(
+        f'"{wd.path}" is still shallow after fetching {fetched} more commits'
+        " and may cause errors"
+    )
+
+
 def fail_on_shallow(wd):
     """experimental, may change at any time"""
-    if wd.is_shallow():
+    if wd.is_shallow() and not _describe_would_succeed(wd):
         raise ValueError(
             f'{wd.path} is shallow, please correct with "git fetch --unshallow"'
         )
 
 
+def _get_workdir_cls(config):
+    try:
+        return GIT_BACKENDS[config.git_backend]
+    except KeyError:
+        raise ValueError(
+            f"unknown git_backend {config.git_backend!r},"
+            f" expected one of {sorted(GIT_BACKENDS)}"
+        )
+
+
 def get_working_directory(config):
     """
     Return the working directory (``GitWorkdir``).
     """
 
+    workdir_cls = _get_workdir_cls(config)
+
+    if config.parent:
+        return workdir_cls.from_potential_worktree(config.parent)
+
+    if config.search_parent_directories:
+        return search_parent(config.absolute_root, workdir_cls)
+
+    return workdir_cls.from_potential_worktree(config.absolute_root)
+
+
+async def get_working_directory_async(config):
+    """
+    asyncio variant of ``get_working_directory``
+    """
+
+    workdir_cls = _get_workdir_cls(config)
+
     if config.parent:
-        return GitWorkdir.from_potential_worktree(config.parent)
+        return await workdir_cls.from_potential_worktree_async(config.parent)
 
     if config.search_parent_directories:
-        return search_parent(config.absolute_root)
+        return await search_parent_async(config.absolute_root, workdir_cls)
 
-    return GitWorkdir.from_potential_worktree(config.absolute_root)
+    return await workdir_cls.from_potential_worktree_async(config.absolute_root)
 
 
 def parse(root, describe_command=None, pre_parse=warn_on_shallow, config=None):
@@ -137,43 +1067,373 @@ def parse(root, describe_command=None, pre_parse=warn_on_shallow, config=None):
         )
 
 
-def _git_parse_inner(config, wd, pre_parse=None, describe_command=None):
+async def parse_async(
+    root, describe_command=None, pre_parse=warn_on_shallow, config=None
+):
+    """
+    asyncio variant of ``parse``, the ``pre_parse`` action is still run synchronously
+    """
+    if not config:
+        config = Configuration(root=root)
+
+    wd = await get_working_directory_async(config)
+    if wd:
+        if config.git_describe_command is not None:
+            describe_command = config.git_describe_command
+        wd.describe_check = _clean_describe_command(
+            describe_command, describe_match(config.tag_regex)
+        )
+        if pre_parse:
+            pre_parse(wd)
+        if config.rev is not None:
+            snapshot = await wd.snapshot_rev_async(
+                config.rev, describe_command, config.describe_engine, config.tag_regex
+            )
+            return _meta_from_snapshot(config, snapshot)
+        snapshot = await wd.snapshot_async(
+            describe_command,
+            config.dirty_strategy,
+            config.describe_engine,
+            config.tag_regex,
+        )
+        return _meta_from_snapshot(config, snapshot)
+
+
+class _DescribeFilter(NamedTuple):
+    """the tags a ``git describe`` command considers"""
+
+    patterns: list
+    excludes: list
+    annotated_only: bool
+    dirty: bool
+
+    def match(self, name):
+        if self.patterns and not any(fnmatchcase(name, p) for p in self.patterns):
+            return False
+        return not any(fnmatchcase(name, p) for p in self.excludes)
+
+
+def _describe_filter(describe_command):
+    """
+    return the ``_DescribeFilter`` of a describe command,
+    None if it uses options the tag search can't stand in for
+    """
+    if describe_command is None:
+        describe_command = DEFAULT_DESCRIBE
+    if isinstance(describe_command, str):
+        describe_command = shlex.split(describe_command)
+    if list(describe_command[:2]) != ["git", "describe"]:
+        return None
+    options = set()
+    patterns = {"--match": [], "--exclude": []}
+    args = iter(describe_command[2:])
+    for arg in args:
+        option, has_value, value = arg.partition("=")
+        if option in patterns:
+            if not has_value:
+                value = next(args, None)
+                if value is None:
+                    return None
+            patterns[option].append(value)
+        elif arg in ("--tags", "--long", "--dirty"):
+            options.add(arg)
+        else:
+            return None
+    if "--long" not in options:
+        return None
+    return _DescribeFilter(
+        patterns["--match"],
+        patterns["--exclude"],
+        annotated_only="--tags" not in options,
+        dirty="--dirty" in options,
+    )
+
+
+def _batch_root(config):
+    """the git checkout ``parse`` would be used for, None if it's not git"""
+    if config.parse is not None or config.rev is not None:
+        return None
+    if config.search_parent_directories:
+        # the first directory the parse_scm entrypoints match in
+        for candidate in walk_potential_roots(config.absolute_root):
+            if os.path.exists(os.path.join(candidate, ".git")):
+                return candidate
+            if os.path.exists(os.path.join(candidate, ".hg")):
+                return None
+        return None
+    if os.path.exists(os.path.join(config.absolute_root, ".git")):
+        return config.absolute_root
+    return None
+
+
+def _batch_snapshots(root, configs, filters, pre_parse):
+    wd = NativeGitWorkdir.from_potential_worktree(root)
+    if wd is None or wd.repo is None:
+        return [None] * len(configs)
+    try:
+        return _workdir_snapshots(wd, configs, filters, pre_parse)
+    finally:
+        wd.close()
+
+
+def _batch_pre_parse(wd, configs, pre_parse):
+    """run ``pre_parse`` with the describe checks of every configuration"""
+    checks = []
+    for config in configs:
+        check = _clean_describe_command(
+            config.git_describe_command, describe_match(config.tag_regex)
+        )
+        if check not in checks:
+            checks.append(check)
+            wd.describe_check = check
+            pre_parse(wd)
+
+
+def _workdir_snapshots(wd, configs, filters, pre_parse):
     if pre_parse:
-        pre_parse(wd)
+        _batch_pre_parse(wd, configs, pre_parse)
+    try:
+        sha, branch, node_date = wd.get_head_info()
+        found = _batch_nearest_tags(wd, sha, configs, filters)
+    except READ_ERRORS as e:
+        trace("batch tag search failed", wd.path, e)
+        return [None] * len(configs)
+
+    dirty = {}
+    described = {}
+    distance = None
+    snapshots = []
+    for config, describe, tag in zip(configs, filters, found):
+        if sha is not None and config.describe_engine == DEFAULT_DESCRIBE_ENGINE:
+            tag = _batch_describe(wd, sha, config, described)
+        strategy = config.dirty_strategy
+        if strategy not in dirty:
+            dirty[strategy] = wd.is_dirty(strategy)
+        if tag:
+            # only describe --dirty reports the dirty state of a tagged checkout
+            reported = dirty[strategy] and (
+                describe.dirty or strategy != DEFAULT_DIRTY_STRATEGY
+            )
+            snapshots.append(_described_snapshot(tag, sha, branch, node_date, reported))
+        else:
+            if distance is None:
+                distance = 0 if sha is None else wd.count_all_nodes()
+            snapshots.append(
+                _untagged_snapshot(sha, branch, node_date, distance, dirty[strategy])
+            )
+    return snapshots
+
+
+def _batch_nearest_tags(wd, sha, configs, filters):
+    """
+    describe output of the configurations using ``describe_engine="nearest-tag"``,
+    from one search of the tags, None for the others and where there is no tag
+    """
+    search = None
+    found = []
+    for config, describe in zip(configs, filters):
+        if sha is None or config.describe_engine == DEFAULT_DESCRIBE_ENGINE:
+            found.append(None)
+            continue
+        if search is None:
+            search = NearestTagSearch(wd.repo)
+        tag = search(
+            sha,
+            lambda name: config.tag_regex.match(name) and describe.match(name),
+            describe.annotated_only,
+        )
+        found.append(tag and f"{tag[0]}-{tag[1]}-g{sha[:NEAREST_TAG_ABBREV]}")
+    return found
+
+
+def _batch_describe(wd, sha, config, described):
+    """
+    ``git describe`` output for ``sha`` like ``parse`` gets it, None if it failed
+
+    the results are kept in ``described``, identical commands only run once
+    """
+    command = tuple(
+        _rev_describe_command(
+            config.git_describe_command, describe_match(config.tag_regex), sha
+        )
+    )
+    if command not in described:
+        out, _, ret = wd.do_ex(list(command))
+        described[command] = None if ret else out
+    return described[command]
+
+
+def parse_batch(configs, pre_parse=warn_on_shallow):
+    """
+    parse the configurations of git checkouts with one snapshot per checkout
+
+    HEAD and the dirty state are read once, every configuration then runs its
+    ``git describe`` for HEAD, identical commands only once, while those with
+    ``describe_engine="nearest-tag"`` search one shared listing of the tags,
+    ``git_describe_command`` may only use ``--tags``, ``--long``, ``--dirty``,
+    ``--match`` and ``--exclude``
+
+    returns the parsed version of each configuration,
+    None for configurations that have to be parsed on their own
+    """
+    results = [None] * len(configs)
+    groups = {}
+    for i, config in enumerate(configs):
+        describe = _describe_filter(config.git_describe_command)
+        root = describe and _batch_root(config)
+        if root is not None:
+            groups.setdefault(root, []).append((i, describe))
+    for root, entries in groups.items():
+        indices = [i for i, _ in entries]
+        snapshots = _batch_snapshots(
+            root,
+            [configs[i] for i in indices],
+            [describe for _, describe in entries],
+            pre_parse,
+        )
+        for i, snapshot in zip(indices, snapshots):
+            if snapshot is not None:
+                results[i] = _meta_from_snapshot(configs[i], snapshot)
+    return results
+
+
+def _history_tags(wd, config):
+    """
+    map commits to the version of the tag ``git describe`` would pick there
+
+    only tags matching both the ``--match`` glob and ``tag_regex`` are used,
+    annotated tags win over lightweight ones, then newer ones, then ref order
+    """
+    out, err, ret = wd.do_ex(HISTORY_TAGS)
+    if ret:
+        trace("tag listing err", out, err, ret)
+        return {}
+    match = describe_match(config.tag_regex)
+    chosen = {}
+    for line in out.splitlines():
+        refname, kind, sha, *peeled = line.split()
+        name = refname[len("refs/tags/") :]
+        if not fnmatchcase(name, match) or not config.tag_regex.match(name):
+            continue
+        if kind == "commit":
+            commit, priority = sha, (0, 0)
+        elif kind == "tag" and peeled[:1] == ["commit"] and len(peeled) >= 3:
+            commit, priority = peeled[1], (1, int(peeled[2]))
+        else:
+            continue
+        if commit not in chosen or chosen[commit][0] < priority:
+            chosen[commit] = priority, name
+    tags = {}
+    for commit, (_, name) in chosen.items():
+        version = tag_to_version(name, config)
+        if version is not None:
+            tags[commit] = version
+    return tags
 
+
+def _describe_merge(wd, config, sha):
+    """
+    ``(tag, distance)`` of the merge ``sha`` from the configured describe,
+    which weighs the tags of all parents like ``get_version(rev=sha)`` does
+    """
+    out, _, ret = wd._describe_rev(
+        sha, config.git_describe_command, config.describe_engine, config.tag_regex
+    )
+    if ret:
+        return None, wd.count_all_nodes(sha)
+    tag, distance, _, _ = _git_parse_describe(out)
+    return tag, distance
+
+
+def iter_history(config, rev="HEAD"):
+    """
+    yield ``(sha, ScmVersion)`` for every commit reachable from ``rev``,
+    parents before their children
+
+    history and tags are read with one ``git log`` and one tag listing,
+    each commit takes the nearest tag and distance of its parent,
+    only merges run the configured describe, which picks between the tags
+    of the parents and counts the commits in between,
+    only one small entry per commit is kept while the versions are streamed
+    """
+    wd = get_working_directory(config)
+    if wd is None:
+        return
+    tags = _history_tags(wd, config)
+    untagged = config.version_cls("0.0")
+    # the nearest tag and the distance of each commit seen so far
+    state = {}
+    for line in wd.iter_lines(HISTORY_LOG + [rev]):
+        sha, committed, *parents = line.split()
+        tag = tags.get(sha)
+        if tag is not None:
+            distance = 0
+        elif not parents:
+            distance = 1
+        elif len(parents) == 1 and parents[0] in state:
+            # the parent's ancestors and the commit itself
+            tag, distance = state[parents[0]]
+            distance += 1
+        else:
+            # merges and commits whose parents are outside of a shallow history
+            tag, distance = _describe_merge(wd, config, sha)
+        state[sha] = tag, distance
+        snapshot = GitSnapshot(
+            sha,
+            None,
+            _parse_head_date(committed),
+            untagged if tag is None else tag,
+            distance or None,
+            "g" + sha[:7],
+            False,
+        )
+        yield sha, _meta_from_snapshot(config, snapshot)
+
+
+def _git_parse_inner(config, wd, pre_parse=None, describe_command=None):
     if config.git_describe_command is not None:
         describe_command = config.git_describe_command
+    # the shallow checks must look for the tags the version is taken from
+    wd.describe_check = _clean_describe_command(
+        describe_command, describe_match(config.tag_regex)
+    )
 
-    if describe_command is not None:
-        out, _, ret = wd.do_ex(describe_command)
-    else:
-        out, _, ret = wd.default_describe()
+    if pre_parse:
+        pre_parse(wd)
 
-    if ret == 0:
-        tag, distance, node, dirty = _git_parse_describe(out)
-        if distance == 0 and not dirty:
-            distance = None
-    else:
-        # If 'git git_describe_command' failed, try to get the information otherwise.
-        tag = "0.0"
-        node = wd.node()
-        if node is None:
-            distance = 0
+    if config.rev is not None:
+        snapshot = wd.snapshot_rev(
+            config.rev, describe_command, config.describe_engine, config.tag_regex
+        )
+        return _meta_from_snapshot(config, snapshot)
+
+    options = dict(
+        dirty_strategy=config.dirty_strategy,
+        describe_engine=config.describe_engine,
+        tag_regex=config.tag_regex,
+    )
+    # HEAD is looked up through a cat-file session
+    with wd:
+        if _parallel_queries(config):
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                snapshot = wd.snapshot(describe_command, executor, **options)
         else:
-            distance = wd.count_all_nodes()
-            node = "g" + node
-        dirty = wd.is_dirty()
+            snapshot = wd.snapshot(describe_command, **options)
+    return _meta_from_snapshot(config, snapshot)
+
 
-    branch = wd.get_branch()
-    node_date = wd.get_head_date() or date.today()
+def _parallel_queries(config):
+    return config.parallel_queries or bool(os.environ.get(PARALLEL_QUERIES_KEY))
 
+
+def _meta_from_snapshot(config, snapshot):
     return meta(
-        tag,
-        branch=branch,
-        node=node,
-        node_date=node_date,
-        distance=distance,
-        dirty=dirty,
+        snapshot.tag,
+        branch=snapshot.branch,
+        node=snapshot.node,
+        node_date=snapshot.node_date or date.today(),
+        distance=snapshot.distance,
+        dirty=snapshot.dirty,
         config=config,
     )
 
@@ -193,28 +1453,33 @@ def _git_parse_describe(describe_output):
     return tag, number, node, dirty
 
 
-def search_parent(dirname):
+def search_parent(dirname, workdir_cls=GitWorkdir):
     """
     Walk up the path to find the `.git` directory.
     :param dirname: Directory from which to start searching.
+    :param workdir_cls: The ``GitWorkdir`` implementation to use.
     """
 
-    # Code based on:
-    # https://github.com/gitpython-developers/GitPython/blob/main/git/repo/base.py
-
-    curpath = os.path.abspath(dirname)
-
-    while curpath:
-
+    # only the filesystem is searched, git is asked about candidates only
+    for candidate in iter_git_roots(dirname):
         try:
-            wd = GitWorkdir.from_potential_worktree(curpath)
-        except Exception:
-            wd = None
-
+            wd = workdir_cls.from_potential_worktree(candidate)
+        except OSError as e:
+            trace("no git worktree", candidate, e)
+            return None
         if wd is not None:
             return wd
+    return None
 
-        curpath, tail = os.path.split(curpath)
 
-        if not tail:
+async def search_parent_async(dirname, workdir_cls=GitWorkdir):
+    """asyncio variant of ``search_parent``"""
+    for candidate in iter_git_roots(dirname):
+        try:
+            wd = await workdir_cls.from_potential_worktree_async(candidate)
+        except OSError as e:
+            trace("no git worktree", candidate, e)
             return None
+        if wd is not None:
+            return wd
+    return None
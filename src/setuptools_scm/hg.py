@@ -1,55 +1,159 @@
+import asyncio
+import functools
 import os
 from pathlib import Path
+from typing import NamedTuple
 
 from .config import Configuration
 from .scm_workdir import Workdir
 from .utils import data_from_mime
 from .utils import do_ex
+from .utils import do_ex_async
 from .utils import require_command
 from .utils import trace
 from .version import meta
 from .version import tag_to_version
 
 
+_HEAD_TEMPLATE = "{node}\n{tag}\n{bookmark}\n{date|shortdate}"
+_ID_TEMPLATE = "{branch}\n{if(dirty, 1, 0)}\n{date|shortdate}"
+# Gets all tags containing a '.' (see #229) from oldest to newest
+_NORMALIZABLE_TAGS_REVSET = "ancestors({rev}) and tag('re:\\.')"
+_TAGS_TEMPLATE = "{tags}{if(tags, '\n', '')}"
+
+
+class _HgHead(NamedTuple):
+    node: str
+    tags: str
+    branch: str
+    dirty: bool
+    date: str
+
+
+def _parse_head(log_output, id_output):
+    node, tags, bookmark, node_date = log_output.split("\n")
+
+    # TODO: support bookmarks and topics (but nowadays bookmarks are
+    # mainly used to emulate Git branches, which is already supported with
+    # the dedicated class GitWorkdirHgClient)
+
+    branch, dirty, dirty_date = id_output.split("\n")
+    dirty = bool(int(dirty))
+
+    if dirty:
+        date = dirty_date
+    else:
+        date = node_date
+    return _HgHead(node, tags, branch, dirty, date)
+
+
+def _last_normalizable_tag(log_output):
+    outlines = log_output.split()
+    if not outlines:
+        return "null"
+    tag = outlines[-1].split()[-1]
+    return tag
+
+
+def _count_template(revset):
+    """template printing the number of revisions in ``revset``"""
+    escaped = revset.replace("\\", "\\\\").replace('"', '\\"')
+    return '{revset("%s")|count}' % escaped
+
+
+def _id_command(rev):
+    # the working directory is only looked at without a revision
+    revision = [] if rev is None else ["-r", rev]
+    return ["hg", "id", *revision, "-T", _ID_TEMPLATE]
+
+
+def _changes_since_tag_revset(tag, rev="."):
+    return (
+        f"(branch({rev})"  # look for revisions in this branch only
+        f" and tag({tag!r})::({rev})"  # after the last tag
+        # ignore commits that only modify .hgtags and nothing else:
+        " and (merge() or file('re:^(?!\\.hgtags).*$'))"
+        f" and not tag({tag!r}))"  # ignore the tagged commit itself
+    )
+
+
 class HgWorkdir(Workdir):
 
     COMMAND = "hg"
 
     @classmethod
-    def from_potential_worktree(cls, wd):
-        require_command(cls.COMMAND)
-        root, err, ret = do_ex("hg root", wd)
+    def from_potential_worktree(cls, wd, runner=None):
+        require_command(cls.COMMAND, runner)
+        root, err, ret = do_ex("hg root", wd, runner)
         if ret:
             return
-        return cls(root)
+        return cls(root, runner)
+
+    @classmethod
+    async def from_potential_worktree_async(cls, wd, runner=None):
+        require_command(cls.COMMAND, runner)
+        root, err, ret = await do_ex_async("hg root", wd, runner)
+        if ret:
+            return
+        return cls(root, runner)
 
     def get_meta(self, config):
+        rev = config.rev or "."
+        head = _parse_head(
+            self.hg_log(rev, _HEAD_TEMPLATE), self.do(_id_command(config.rev))
+        )
+        version = self._meta_at_head(head, config)
+        if version is not None:
+            return version
 
-        node, tags, bookmark, node_date = self.hg_log(
-            ".", "{node}\n{tag}\n{bookmark}\n{date|shortdate}"
-        ).split("\n")
+        try:
+            tag = self.get_latest_normalizable_tag(rev)
+            dist = self.get_distance_revs(tag, rev)
+            if tag == "null":
+                tag = "0.0"
+                dist = int(dist) + 1
 
-        # TODO: support bookmarks and topics (but nowadays bookmarks are
-        # mainly used to emulate Git branches, which is already supported with
-        # the dedicated class GitWorkdirHgClient)
+            changes = self.check_changes_since_tag(tag, rev)
+            return self._meta_since_tag(head, config, tag, dist, changes)
 
-        branch, dirty, dirty_date = self.do(
-            ["hg", "id", "-T", "{branch}\n{if(dirty, 1, 0)}\n{date|shortdate}"]
-        ).split("\n")
-        dirty = bool(int(dirty))
+        except ValueError:
+            pass  # unpacking failed, old hg
 
-        if dirty:
-            date = dirty_date
-        else:
-            date = node_date
+    async def get_meta_async(self, config):
+        rev = config.rev or "."
+        log_output, id_output = await asyncio.gather(
+            self.hg_log_async(rev, _HEAD_TEMPLATE),
+            self.do_async(_id_command(config.rev)),
+        )
+        head = _parse_head(log_output, id_output)
+        version = self._meta_at_head(head, config)
+        if version is not None:
+            return version
 
-        if all(c == "0" for c in node):
-            trace("initial node", self.path)
-            return meta("0.0", config=config, dirty=dirty, branch=branch)
+        try:
+            tag = await self.get_latest_normalizable_tag_async(rev)
+            dist, changes = await asyncio.gather(
+                self.get_distance_revs_async(tag, rev),
+                self.check_changes_since_tag_async(
+                    "0.0" if tag == "null" else tag, rev
+                ),
+            )
+            if tag == "null":
+                tag = "0.0"
+                dist = int(dist) + 1
 
-        node = "h" + node[:7]
+            return self._meta_since_tag(head, config, tag, dist, changes)
 
-        tags = tags.split()
+        except ValueError:
+            pass  # unpacking failed, old hg
+
+    def _meta_at_head(self, head, config):
+        """the version if the working directory is at the initial or a tagged node"""
+        if all(c == "0" for c in head.node):
+            trace("initial node", self.path)
+            return meta("0.0", config=config, dirty=head.dirty, branch=head.branch)
+
+        tags = head.tags.split()
         if "tip" in tags:
             # tip is not a real tag
             tags = tags.remove("tip")
@@ -58,65 +162,68 @@ class HgWorkdir(Workdir):
             tag = tags[0]
             tag = tag_to_version(tag)
             if tag:
-                return meta(tag, dirty=dirty, branch=branch, config=config)
-
-        try:
-            tag = self.get_latest_normalizable_tag()
-            dist = self.get_distance_revs(tag)
-            if tag == "null":
-                tag = "0.0"
-                dist = int(dist) + 1
-
-            if self.check_changes_since_tag(tag) or dirty:
-                return meta(
-                    tag,
-                    distance=dist,
-                    node=node,
-                    dirty=dirty,
-                    branch=branch,
-                    config=config,
-                    node_date=date,
-                )
-            else:
-                return meta(tag, config=config)
-
-        except ValueError:
-            pass  # unpacking failed, old hg
+                return meta(tag, dirty=head.dirty, branch=head.branch, config=config)
+
+    def _meta_since_tag(self, head, config, tag, dist, changes):
+        if changes or head.dirty:
+            return meta(
+                tag,
+                distance=dist,
+                node="h" + head.node[:7],
+                dirty=head.dirty,
+                branch=head.branch,
+                config=config,
+                node_date=head.date,
+            )
+        else:
+            return meta(tag, config=config)
 
     def hg_log(self, revset, template):
         cmd = ["hg", "log", "-r", revset, "-T", template]
         return self.do(cmd)
 
-    def get_latest_normalizable_tag(self):
-        # Gets all tags containing a '.' (see #229) from oldest to newest
-        outlines = self.hg_log(
-            revset="ancestors(.) and tag('re:\\.')",
-            template="{tags}{if(tags, '\n', '')}",
-        ).split()
-        if not outlines:
-            return "null"
-        tag = outlines[-1].split()[-1]
-        return tag
+    async def hg_log_async(self, revset, template):
+        cmd = ["hg", "log", "-r", revset, "-T", template]
+        return await self.do_async(cmd)
+
+    def get_latest_normalizable_tag(self, rev="."):
+        # only the last tagged revision matters, don't hold on to all of them
+        revset = _NORMALIZABLE_TAGS_REVSET.format(rev=rev)
+        cmd = ["hg", "log", "-r", revset, "-T", _TAGS_TEMPLATE]
+        last = ""
+        for line in self.iter_lines(cmd):
+            if line.strip():
+                last = line
+        return _last_normalizable_tag(last)
+
+    async def get_latest_normalizable_tag_async(self, rev="."):
+        return _last_normalizable_tag(
+            await self.hg_log_async(
+                _NORMALIZABLE_TAGS_REVSET.format(rev=rev), _TAGS_TEMPLATE
+            )
+        )
 
     def get_distance_revs(self, rev1, rev2="."):
         revset = f"({rev1}::{rev2})"
-        out = self.hg_log(revset, ".")
-        return len(out) - 1
+        return int(self.hg_log(rev2, _count_template(revset))) - 1
+
+    async def get_distance_revs_async(self, rev1, rev2="."):
+        revset = f"({rev1}::{rev2})"
+        return int(await self.hg_log_async(rev2, _count_template(revset))) - 1
 
-    def check_changes_since_tag(self, tag):
+    def check_changes_since_tag(self, tag, rev="."):
 
         if tag == "0.0":
             return True
 
-        revset = (
-            "(branch(.)"  # look for revisions in this branch only
-            f" and tag({tag!r})::."  # after the last tag
-            # ignore commits that only modify .hgtags and nothing else:
-            " and (merge() or file('re:^(?!\\.hgtags).*$'))"
-            f" and not tag({tag!r}))"  # ignore the tagged commit itself
-        )
+        return bool(self.hg_log(_changes_since_tag_revset(tag, rev), "."))
+
+    async def check_changes_since_tag_async(self, tag, rev="."):
 
-        return bool(self.hg_log(revset, "."))
+        if tag == "0.0":
+            return True
+
+        return bool(await self.hg_log_async(_changes_since_tag_revset(tag, rev), "."))
 
 
 def parse(root, config=None):
@@ -145,6 +252,26 @@ def parse(root, config=None):
     return wd.get_meta(config)
 
 
+async def parse_async(root, config=None):
+    """asyncio variant of ``parse``"""
+    if not config:
+        config = Configuration(root=root)
+
+    if os.path.exists(os.path.join(root, ".hg/git")):
+        # hg-git checkouts are rare, keep them off the event loop instead
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            None, functools.partial(parse, root, config=config)
+        )
+
+    wd = await HgWorkdir.from_potential_worktree_async(config.absolute_root)
+
+    if wd is None:
+        return
+
+    return await wd.get_meta_async(config)
+
+
 def archival_to_version(data, config: "Configuration | None" = None):
     trace("data", data)
     node = data.get("node", "")[:12]
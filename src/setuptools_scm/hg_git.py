@@ -2,6 +2,7 @@ import os
 from datetime import datetime
 
 from .git import GitWorkdir
+from .hg import _count_template
 from .hg import HgWorkdir
 from .utils import do_ex
 from .utils import require_command
@@ -12,17 +13,36 @@ class GitWorkdirHgClient(GitWorkdir, HgWorkdir):
     COMMAND = "hg"
 
     @classmethod
-    def from_potential_worktree(cls, wd):
-        require_command(cls.COMMAND)
-        root, err, ret = do_ex("hg root", wd)
+    def from_potential_worktree(cls, wd, runner=None):
+        require_command(cls.COMMAND, runner)
+        root, err, ret = do_ex("hg root", wd, runner)
         if ret:
             return
-        return cls(root)
+        return cls(root, runner)
 
-    def is_dirty(self):
+    def __enter__(self):
+        # the git object database is not available to a cat-file session
+        return self
+
+    def is_dirty(self, strategy=None):
+        # hg has a single notion of dirty, strategies only apply to git
         out, _, _ = self.do_ex("hg id -T '{dirty}'")
         return bool(out)
 
+    def snapshot(
+        self,
+        describe_command=None,
+        executor=None,
+        dirty_strategy=None,
+        describe_engine=None,
+        tag_regex=None,
+    ):
+        # the history lives in hg, the git describe engines don't apply
+        return super().snapshot(describe_command, executor)
+
+    def snapshot_rev(self, rev, *args, **kwargs):
+        raise ValueError(f"rev={rev!r} is not supported for hg-git checkouts")
+
     def get_branch(self):
         branch, err, ret = self.do_ex("hg id -T {bookmarks}")
         if ret:
@@ -37,6 +57,10 @@ class GitWorkdirHgClient(GitWorkdir, HgWorkdir):
             return
         return datetime.strptime(date_part, r"%Y-%m-%d").date()
 
+    def get_head_info(self):
+        node = self.node()
+        return node, self.get_branch(), self.get_head_date()
+
     def is_shallow(self):
         return False
 
@@ -81,8 +105,7 @@ class GitWorkdirHgClient(GitWorkdir, HgWorkdir):
         return git_node[:7]
 
     def count_all_nodes(self):
-        revs, _, _ = self.do_ex("hg log -r 'ancestors(.)' -T '.'")
-        return len(revs)
+        return int(self.hg_log(".", _count_template("ancestors(.)")))
 
     def default_describe(self):
         """
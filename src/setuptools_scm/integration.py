@@ -62,7 +62,7 @@ def version_keyword(dist: setuptools.Distribution, keyword, value):
     if dist_name is None:
         dist_name = _read_dist_name_from_setup_cfg()
     config = Configuration(dist_name=dist_name, **value)
-    dist.metadata.version = _get_version(config)
+    dist.metadata.version = _get_version(config, memoize=True)
 
 
 def find_files(path=""):
@@ -91,4 +91,4 @@ def infer_version(dist: setuptools.Distribution):
     except LookupError as e:
         trace(e)
     else:
-        dist.metadata.version = _get_version(config)
+        dist.metadata.version = _get_version(config, memoize=True)
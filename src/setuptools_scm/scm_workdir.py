@@ -1,15 +1,38 @@
 from .utils import do
+from .utils import do_async
 from .utils import do_ex
+from .utils import do_ex_async
+from .utils import iter_lines
 from .utils import require_command
 
 
 class Workdir:
-    def __init__(self, path):
-        require_command(self.COMMAND)
+    def __init__(self, path, runner=None):
+        require_command(self.COMMAND, runner)
         self.path = path
+        self.runner = runner
+
+    def __enter__(self):
+        """start a session, subclasses may keep helper processes around"""
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """end the session and release its helper processes"""
 
     def do_ex(self, cmd):
-        return do_ex(cmd, cwd=self.path)
+        return do_ex(cmd, cwd=self.path, runner=self.runner)
 
     def do(self, cmd):
-        return do(cmd, cwd=self.path)
+        return do(cmd, cwd=self.path, runner=self.runner)
+
+    def iter_lines(self, cmd):
+        return iter_lines(cmd, cwd=self.path, runner=self.runner)
+
+    async def do_ex_async(self, cmd):
+        return await do_ex_async(cmd, cwd=self.path, runner=self.runner)
+
+    async def do_async(self, cmd):
+        return await do_async(cmd, cwd=self.path, runner=self.runner)
@@ -1,17 +1,25 @@
 """
 utils
 """
+import asyncio
 import inspect
+import json
 import os
 import platform
 import shlex
+import shutil
 import subprocess
 import sys
+import time
 import warnings
+from contextlib import contextmanager
 
+from . import _instrument
 
 DEBUG = bool(os.environ.get("SETUPTOOLS_SCM_DEBUG"))
 IS_WINDOWS = platform.system() == "Windows"
+# read size of streamed output that isn't split into lines
+_CHUNK_SIZE = 64 * 1024
 
 
 def no_git_env(env):
@@ -57,44 +65,392 @@ def _always_strings(env_dict):
     return env_dict
 
 
-def _popen_pipes(cmd, cwd):
+def _scm_env():
+    return _always_strings(
+        dict(
+            no_git_env(os.environ),
+            # os.environ,
+            # try to disable i18n
+            LC_ALL="C",
+            LANGUAGE="",
+            HGPLAIN="1",
+        )
+    )
+
+
+def _popen_pipes(cmd, cwd, stdin=None, stderr=subprocess.PIPE):
     return subprocess.Popen(
         cmd,
+        stdin=stdin,
         stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
+        stderr=stderr,
         cwd=str(cwd),
-        env=_always_strings(
-            dict(
-                no_git_env(os.environ),
-                # os.environ,
-                # try to disable i18n
-                LC_ALL="C",
-                LANGUAGE="",
-                HGPLAIN="1",
-            )
-        ),
+        env=_scm_env(),
     )
 
 
-def do_ex(cmd, cwd="."):
+def _trace_result(out, err, returncode):
+    if out:
+        trace("out", repr(out))
+    if err:
+        trace("err", repr(err))
+    if returncode:
+        trace("ret", returncode)
+    return ensure_stripped_str(out), ensure_stripped_str(err), returncode
+
+
+class PopenRunner:
+    """runs scm commands with ``subprocess.Popen``, the default runner"""
+
+    def _popen(self, cmd, cwd, stderr=subprocess.PIPE):
+        return _popen_pipes(cmd, cwd, stderr=stderr)
+
+    def run(self, cmd, cwd):
+        """run ``cmd`` in ``cwd`` and return raw ``(stdout, stderr, returncode)``"""
+        p = self._popen(cmd, cwd)
+        out, err = p.communicate()
+        return out, err, p.returncode
+
+    def stream(self, cmd, cwd, sep=b"\n"):
+        """
+        yield the raw stdout lines of ``cmd`` as they arrive, returns the returncode
+
+        lines end with ``sep``, closing the generator early terminates the command
+        """
+        p = self._popen(cmd, cwd, stderr=subprocess.DEVNULL)
+        try:
+            if sep == b"\n":
+                yield from p.stdout
+            else:
+                chunks = iter(lambda: p.stdout.read1(_CHUNK_SIZE), b"")
+                yield from _split_records(chunks, sep)
+        except GeneratorExit:
+            p.terminate()
+            raise
+        finally:
+            p.stdout.close()
+            p.wait()
+        return p.returncode
+
+    async def run_async(self, cmd, cwd):
+        p = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=str(cwd),
+            env=_scm_env(),
+        )
+        out, err = await p.communicate()
+        return out, err, p.returncode
+
+    def probe(self, name):
+        """check whether the command ``name`` can be run"""
+        if shutil.which(name) is not None:
+            return True
+        # shutil.which does not know about everything the os can resolve
+        # (e.g. windows app execution aliases), so try to actually run it
+        started = time.perf_counter()
+        try:
+            out, err, returncode = self.run([name, "help"], ".")
+        except OSError:
+            trace(*sys.exc_info())
+            return False
+        _instrument.record(
+            [name, "help"], ".", started, returncode, len(out) + len(err)
+        )
+        return not returncode
+
+
+class SpawnRunner(PopenRunner):
+    """
+    runs scm commands with settings that allow ``subprocess`` to use ``posix_spawn``
+
+    executables are resolved to absolute paths once, file descriptors are inherited
+    and git/hg are pointed at the working directory with ``-C``/``--cwd``
+    instead of changing the directory of the child process
+    """
+
+    CWD_OPTIONS = {"git": "-C", "hg": "--cwd"}
+
+    def __init__(self):
+        self._executables = {}
+
+    def _spawn_args(self, cmd, cwd):
+        name = cmd[0]
+        key = (name, os.environ.get("PATH"))
+        try:
+            executable = self._executables[key]
+        except KeyError:
+            executable = self._executables[key] = shutil.which(name)
+        if executable is None:
+            raise FileNotFoundError(f"{name!r} was not found")
+        option = self.CWD_OPTIONS.get(name)
+        if option is None:
+            return [executable, *cmd[1:]], str(cwd)
+        return [executable, option, str(cwd), *cmd[1:]], None
+
+    def _popen(self, cmd, cwd, stderr=subprocess.PIPE):
+        argv, cwd = self._spawn_args(cmd, cwd)
+        return subprocess.Popen(
+            argv,
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+            cwd=cwd,
+            env=_scm_env(),
+            close_fds=False,
+        )
+
+    async def run_async(self, cmd, cwd):
+        argv, cwd = self._spawn_args(cmd, cwd)
+        p = await asyncio.create_subprocess_exec(
+            *argv,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=cwd,
+            env=_scm_env(),
+            close_fds=False,
+        )
+        out, err = await p.communicate()
+        return out, err, p.returncode
+
+
+def _output_to_json(data):
+    return data.decode("utf-8", "surrogateescape")
+
+
+def _output_from_json(text):
+    return text.encode("utf-8", "surrogateescape")
+
+
+def _split_records(chunks, sep):
+    """the ``sep`` terminated records in a stream of byte chunks"""
+    rest = b""
+    for chunk in chunks:
+        *records, rest = (rest + chunk).split(sep)
+        for record in records:
+            yield record + sep
+    if rest:
+        yield rest
+
+
+def _buffered_stream(run, cmd, cwd, sep=b"\n"):
+    """``stream`` for runners that only know complete outputs"""
+    out, _, returncode = run(cmd, cwd)
+    if sep == b"\n":
+        yield from out.splitlines(keepends=True)
+    else:
+        yield from _split_records([out], sep)
+    return returncode
+
+
+def _replay_key(cmd, cwd):
+    if isinstance(cmd, str):
+        cmd = [cmd]
+    return tuple(str(arg) for arg in cmd), os.path.normpath(str(cwd))
+
+
+class RecordingRunner:
+    """
+    runs commands through another runner and keeps their outputs
+
+    ``save`` writes them in the format ``ReplayRunner.load`` reads
+    """
+
+    def __init__(self, runner=None):
+        self.runner = PopenRunner() if runner is None else runner
+        self.commands = []
+        self.probes = {}
+
+    def _record(self, cmd, cwd, result):
+        argv, cwd = _replay_key(cmd, cwd)
+        out, err, returncode = result
+        self.commands.append(
+            {
+                "argv": list(argv),
+                "cwd": cwd,
+                "out": _output_to_json(out),
+                "err": _output_to_json(err),
+                "returncode": returncode,
+            }
+        )
+        return result
+
+    def run(self, cmd, cwd):
+        return self._record(cmd, cwd, self.runner.run(cmd, cwd))
+
+    async def run_async(self, cmd, cwd):
+        return self._record(cmd, cwd, await self.runner.run_async(cmd, cwd))
+
+    def stream(self, cmd, cwd, sep=b"\n"):
+        return _buffered_stream(self.run, cmd, cwd, sep)
+
+    def probe(self, name):
+        res = self.probes[name] = self.runner.probe(name)
+        return res
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as fp:
+            json.dump({"probes": self.probes, "commands": self.commands}, fp, indent=1)
+
+
+class ReplayRunner:
+    """
+    serves previously recorded command outputs without running anything
+
+    repeated commands are answered in recording order,
+    the last recorded answer is repeated once they are used up
+    """
+
+    def __init__(self, commands, probes=None):
+        self.probes = dict(probes or {})
+        self._outputs = {}
+        for entry in commands:
+            key = _replay_key(entry["argv"], entry["cwd"])
+            self._outputs.setdefault(key, []).append(entry)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as fp:
+            data = json.load(fp)
+        return cls(data["commands"], data.get("probes"))
+
+    def run(self, cmd, cwd):
+        try:
+            outputs = self._outputs[_replay_key(cmd, cwd)]
+        except KeyError:
+            raise LookupError(f"no recorded output for {cmd!r} in {cwd}") from None
+        entry = outputs.pop(0) if len(outputs) > 1 else outputs[0]
+        return (
+            _output_from_json(entry["out"]),
+            _output_from_json(entry["err"]),
+            entry["returncode"],
+        )
+
+    async def run_async(self, cmd, cwd):
+        return self.run(cmd, cwd)
+
+    def stream(self, cmd, cwd, sep=b"\n"):
+        return _buffered_stream(self.run, cmd, cwd, sep)
+
+    def probe(self, name):
+        try:
+            return self.probes[name]
+        except KeyError:
+            return any(argv[0] == name for argv, _ in self._outputs)
+
+
+_default_runner = PopenRunner()
+
+
+def get_runner(runner=None):
+    """return ``runner``, or the current default runner if it is None"""
+    return _default_runner if runner is None else runner
+
+
+@contextmanager
+def use_runner(runner):
+    """make ``runner`` the default runner for all scm commands inside the block"""
+    global _default_runner
+    previous, _default_runner = _default_runner, runner
+    try:
+        yield runner
+    finally:
+        _default_runner = previous
+
+
+def do_ex(cmd, cwd=".", runner=None):
     trace("cmd", repr(cmd))
     trace(" in", cwd)
     if os.name == "posix" and not isinstance(cmd, (list, tuple)):
         cmd = shlex.split(cmd)
 
-    p = _popen_pipes(cmd, cwd)
-    out, err = p.communicate()
-    if out:
-        trace("out", repr(out))
-    if err:
-        trace("err", repr(err))
-    if p.returncode:
-        trace("ret", p.returncode)
-    return ensure_stripped_str(out), ensure_stripped_str(err), p.returncode
+    started = time.perf_counter()
+    out, err, returncode = get_runner(runner).run(cmd, cwd)
+    _instrument.record(cmd, cwd, started, returncode, len(out) + len(err))
+    return _trace_result(out, err, returncode)
+
+
+async def do_ex_async(cmd, cwd=".", runner=None):
+    """asyncio variant of ``do_ex``"""
+    trace("cmd", repr(cmd))
+    trace(" in", cwd)
+    if not isinstance(cmd, (list, tuple)):
+        cmd = shlex.split(cmd)
+
+    started = time.perf_counter()
+    out, err, returncode = await get_runner(runner).run_async(cmd, cwd)
+    _instrument.record(cmd, cwd, started, returncode, len(out) + len(err))
+    return _trace_result(out, err, returncode)
+
+
+def iter_lines(cmd, cwd=".", runner=None):
+    """
+    streaming variant of ``do``, yields the output lines of ``cmd`` as they arrive
+
+    unlike ``do_ex`` the output is never held in memory as a whole
+    and stderr is discarded
+    """
+    trace("cmd", repr(cmd))
+    trace(" in", cwd)
+    if os.name == "posix" and not isinstance(cmd, (list, tuple)):
+        cmd = shlex.split(cmd)
+
+    started = time.perf_counter()
+    size = 0
+    lines = get_runner(runner).stream(cmd, cwd)
+    while True:
+        try:
+            line = next(lines)
+        except StopIteration as stop:
+            returncode = stop.value
+            break
+        size += len(line)
+        yield line.decode("utf-8", "surrogateescape").rstrip("\r\n")
+    _instrument.record(cmd, cwd, started, returncode, size)
+    if returncode:
+        trace("ret", returncode)
 
 
-def do(cmd, cwd="."):
-    out, err, ret = do_ex(cmd, cwd)
+def iter_split(cmd, cwd=".", runner=None, sep="\0"):
+    """
+    like ``iter_lines`` for output separated by ``sep``, e.g. of ``-z`` options
+
+    the generator returns the returncode of ``cmd``
+    """
+    trace("cmd", repr(cmd))
+    trace(" in", cwd)
+    if os.name == "posix" and not isinstance(cmd, (list, tuple)):
+        cmd = shlex.split(cmd)
+
+    started = time.perf_counter()
+    size = 0
+    separator = sep.encode("utf-8")
+    records = get_runner(runner).stream(cmd, cwd, separator)
+    while True:
+        try:
+            record = next(records)
+        except StopIteration as stop:
+            returncode = stop.value
+            break
+        size += len(record)
+        if record.endswith(separator):
+            record = record[: -len(separator)]
+        yield record.decode("utf-8", "surrogateescape")
+    _instrument.record(cmd, cwd, started, returncode, size)
+    if returncode:
+        trace("ret", returncode)
+    return returncode
+
+
+def do(cmd, cwd=".", runner=None):
+    out, err, ret = do_ex(cmd, cwd, runner)
+    if ret:
+        print(err)
+    return out
+
+
+async def do_async(cmd, cwd=".", runner=None):
+    out, err, ret = await do_ex_async(cmd, cwd, runner)
     if ret:
         print(err)
     return out
@@ -118,22 +474,30 @@ def function_has_arg(fn, argname):
     return argname in argspec
 
 
-def has_command(name, warn=True):
+# results of command probes keyed on (command name, effective PATH, runner)
+_command_cache = {}
+
+
+def has_command(name, warn=True, runner=None):
+    runner = get_runner(runner)
+    key = (name, os.environ.get("PATH"), runner)
     try:
-        p = _popen_pipes([name, "help"], ".")
-    except OSError:
-        trace(*sys.exc_info())
-        res = False
-    else:
-        p.communicate()
-        res = not p.returncode
+        res = _command_cache[key]
+    except KeyError:
+        res = _command_cache[key] = runner.probe(name)
+        trace("command probe", name, res)
     if not res and warn:
         warnings.warn("%r was not found" % name, category=RuntimeWarning)
     return res
 
 
-def require_command(name):
-    if not has_command(name, warn=False):
+def clear_command_cache():
+    """forget all cached command probes, e.g. after installing a scm"""
+    _command_cache.clear()
+
+
+def require_command(name, runner=None):
+    if not has_command(name, warn=False, runner=runner):
         raise OSError("%r was not found" % name)
 
 
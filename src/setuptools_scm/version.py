@@ -435,6 +435,23 @@ def _iter_version_schemes(entrypoint, scheme_value, _memo=None):
         yield scheme_value
 
 
+def _resolve_schemes(memo, entrypoint, scheme_value):
+    """
+    the scheme callables ``scheme_value`` refers to,
+    ``memo`` keeps them for formatting several versions
+    """
+    if isinstance(scheme_value, list):
+        scheme_value = tuple(scheme_value)
+    key = entrypoint, scheme_value
+    try:
+        return memo[key]
+    except TypeError:
+        return scheme_value
+    except KeyError:
+        schemes = memo[key] = list(_iter_version_schemes(entrypoint, scheme_value))
+        return schemes
+
+
 def _call_version_scheme(version, entypoint, given_value, default):
     for scheme in _iter_version_schemes(entypoint, given_value):
         result = scheme(version)
@@ -0,0 +1,106 @@
+"""
+compare git describe with the nearest-tag engine on a repository with many tags
+
+    python testing/bench_describe_engines.py --commits 200000 --tags 150000
+
+the history is generated with ``git fast-import``, every tag is annotated
+and HEAD is a few commits past the newest one, both engines are timed
+with packed refs, then again after writing a commit-graph
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import tempfile
+import time
+
+from setuptools_scm.git import CLEAN_DESCRIBE
+from setuptools_scm.git import GitWorkdir
+
+
+def git(cwd, *args, **kw):
+    subprocess.run(
+        ["git", "-c", "user.name=bench", "-c", "user.email=bench@example.com"]
+        + list(args),
+        cwd=cwd,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        **kw,
+    )
+
+
+def fast_import_stream(commits, tags, ahead):
+    last = commits - ahead
+    step = max(last // max(tags, 1), 1)
+    tagged = 0
+    for i in range(1, commits + 1):
+        timestamp = 1500000000 + i * 60
+        message = b"commit %d\n" % i
+        yield b"commit refs/heads/master\nmark :%d\n" % i
+        yield b"committer bench <bench@example.com> %d +0000\n" % timestamp
+        yield b"data %d\n%s\n" % (len(message), message)
+        if i <= last and (last - i) % step == 0 and (last - i) // step < tags:
+            tagged += 1
+            yield b"tag 0.%d\nfrom :%d\n" % (tagged, i)
+            yield b"tagger bench <bench@example.com> %d +0000\n" % timestamp
+            yield b"data 8\nnightly\n\n"
+
+
+def make_repository(path, commits, tags, ahead):
+    git(path, "init", "-q")
+    stream = b"".join(fast_import_stream(commits, tags, ahead))
+    git(path, "fast-import", "--quiet", input=stream)
+    git(path, "pack-refs", "--all")
+    git(path, "checkout", "-q", "master")
+
+
+def timed(fn, repeat):
+    results = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = fn()
+        results.append(time.perf_counter() - start)
+    return value, min(results), statistics.median(results)
+
+
+def bench(path, repeat):
+    def cli():
+        return GitWorkdir(path).do_ex(CLEAN_DESCRIBE)[0]
+
+    def nearest_tag():
+        return GitWorkdir(path).describe_nearest_tag()[0]
+
+    print(f"{'commit-graph':13} {'engine':12} {'describe':24} {'min':>9} {'median':>9}")
+    for commit_graph in (False, True):
+        if commit_graph:
+            git(path, "commit-graph", "write", "--reachable")
+        for name, fn in (("cli", cli), ("nearest-tag", nearest_tag)):
+            described, best, median = timed(fn, repeat)
+            print(
+                f"{commit_graph!s:13} {name:12} {described:24}"
+                f" {best * 1000:7.1f}ms {median * 1000:7.1f}ms"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--commits", type=int, default=20000)
+    parser.add_argument("--tags", type=int, default=15000)
+    parser.add_argument("--ahead", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--path", help="reuse/create the repository at this path")
+    args = parser.parse_args()
+
+    if args.path:
+        if not os.path.isdir(os.path.join(args.path, ".git")):
+            os.makedirs(args.path, exist_ok=True)
+            make_repository(args.path, args.commits, args.tags, args.ahead)
+        bench(args.path, args.repeat)
+    else:
+        with tempfile.TemporaryDirectory() as path:
+            make_repository(path, args.commits, args.tags, args.ahead)
+            bench(path, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+compare the git dirty strategies on a large synthetic worktree
+
+    python testing/bench_dirty_strategies.py --files 100000
+
+each strategy is timed on a clean checkout, after touching a file
+without changing it and after modifying a file, the index is
+refreshed before every run
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import tempfile
+import time
+
+from setuptools_scm.git import DIRTY_STRATEGIES
+from setuptools_scm.git import GitWorkdir
+
+
+def git(cwd, *args):
+    subprocess.run(
+        ["git", "-c", "user.name=bench", "-c", "user.email=bench@example.com"]
+        + list(args),
+        cwd=cwd,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def make_worktree(path, files, per_dir=500):
+    git(path, "init", "-q")
+    for i in range(files):
+        dirname = os.path.join(path, "d%04d" % (i // per_dir))
+        if i % per_dir == 0:
+            os.mkdir(dirname)
+        with open(os.path.join(dirname, "f%06d.txt" % i), "w") as fp:
+            fp.write("content %d\n" % i)
+    git(path, "add", "-A")
+    git(path, "commit", "-q", "-m", "synthetic")
+    git(path, "tag", "v1.0")
+
+
+def timed(fn, prepare, repeat):
+    results = []
+    for _ in range(repeat):
+        prepare()
+        start = time.perf_counter()
+        value = fn()
+        results.append(time.perf_counter() - start)
+    return value, min(results), statistics.median(results)
+
+
+def bench(path, repeat):
+    wd = GitWorkdir(path)
+    sample = os.path.join(path, "d0000", "f000000.txt")
+
+    def reset():
+        git(path, "checkout", "-q", "--", ".")
+        # refresh the index, so each run starts from the same state
+        git(path, "status", "--porcelain")
+
+    def touch():
+        reset()
+        os.utime(sample, (time.time() + 10,) * 2)
+
+    def modify():
+        reset()
+        with open(sample, "a") as fp:
+            fp.write("change\n")
+
+    scenarios = [("clean", reset), ("touched", touch), ("modified", modify)]
+    print(f"{'scenario':10} {'strategy':18} {'dirty':6} {'min':>9} {'median':>9}")
+    for scenario, prepare in scenarios:
+        for strategy in DIRTY_STRATEGIES:
+            dirty, best, median = timed(lambda: wd.is_dirty(strategy), prepare, repeat)
+            print(
+                f"{scenario:10} {strategy:18} {dirty!s:6}"
+                f" {best * 1000:7.1f}ms {median * 1000:7.1f}ms"
+            )
+    reset()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--files", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--path", help="reuse/create the worktree at this path")
+    args = parser.parse_args()
+
+    if args.path:
+        if not os.path.isdir(os.path.join(args.path, ".git")):
+            os.makedirs(args.path, exist_ok=True)
+            make_worktree(args.path, args.files)
+        bench(args.path, args.repeat)
+    else:
+        with tempfile.TemporaryDirectory() as path:
+            make_worktree(path, args.files)
+            bench(path, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+compare the mercurial file listings on a large synthetic working directory
+
+    python testing/bench_hg_file_listing.py --files 100000
+
+the buffered ``hg files`` listing setuptools_scm used before,
+the streamed ``hg files -0`` listing and the dirstate reader are timed,
+``--dirstate-v2`` creates the repository with the dirstate-v2 format
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import tempfile
+import time
+
+from setuptools_scm.file_finder_hg import _hg_dirstate_files_and_dirs
+from setuptools_scm.file_finder_hg import _hg_ls_files_and_dirs
+from setuptools_scm.utils import do_ex
+
+# hg refuses dirstate-v2 without its rust extensions unless allowed to
+SLOW_PATH = "[storage]\ndirstate-v2.slow-path = allow\n"
+
+
+def hg(cwd, *args):
+    subprocess.run(
+        ["hg"] + list(args),
+        cwd=cwd,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def make_repository(path, files, dirstate_v2, per_dir=500):
+    hg(
+        path,
+        "init",
+        "--config",
+        f"format.use-dirstate-v2={dirstate_v2}",
+        "--config",
+        "storage.dirstate-v2.slow-path=allow",
+    )
+    with open(os.path.join(path, ".hg", "hgrc"), "w") as fp:
+        fp.write(SLOW_PATH)
+    for i in range(files):
+        dirname = os.path.join(path, "d%04d" % (i // per_dir), "s%d" % (i % 5))
+        if i % per_dir < 5:
+            os.makedirs(dirname)
+        with open(os.path.join(dirname, "f%06d.txt" % i), "w") as fp:
+            fp.write("content %d\n" % i)
+    hg(path, "add", "-q")
+    hg(path, "commit", "-q", "-m", "synthetic", "-u", "bench")
+
+
+def buffered(toplevel):
+    """the listing before it was streamed"""
+    hg_files = set()
+    hg_dirs = {toplevel}
+    out, err, ret = do_ex(["hg", "files"], cwd=toplevel)
+    for name in out.splitlines():
+        name = os.path.normcase(name).replace("/", os.path.sep)
+        fullname = os.path.join(toplevel, name)
+        hg_files.add(fullname)
+        dirname = os.path.dirname(fullname)
+        while len(dirname) > len(toplevel) and dirname not in hg_dirs:
+            hg_dirs.add(dirname)
+            dirname = os.path.dirname(dirname)
+    return hg_files, hg_dirs
+
+
+def timed(fn, repeat):
+    results = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = fn()
+        results.append(time.perf_counter() - start)
+    return value, min(results), statistics.median(results)
+
+
+def bench(path, repeat):
+    toplevel = os.path.normcase(os.path.realpath(path))
+    listings = [
+        ("buffered", lambda: buffered(toplevel)),
+        ("streamed", lambda: _hg_ls_files_and_dirs(toplevel)),
+        ("dirstate", lambda: _hg_dirstate_files_and_dirs(toplevel)),
+    ]
+    expected = None
+    print(f"{'listing':10} {'files':>8} {'dirs':>6} {'min':>9} {'median':>9}")
+    for name, fn in listings:
+        (files, dirs), best, median = timed(fn, repeat)
+        if expected is None:
+            expected = files, dirs
+        assert (files, dirs) == expected, name
+        print(
+            f"{name:10} {len(files):8} {len(dirs):6}"
+            f" {best * 1000:7.1f}ms {median * 1000:7.1f}ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--files", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--dirstate-v2", action="store_true")
+    parser.add_argument("--path", help="reuse/create the repository at this path")
+    args = parser.parse_args()
+
+    if args.path:
+        if not os.path.isdir(os.path.join(args.path, ".hg")):
+            os.makedirs(args.path, exist_ok=True)
+            make_repository(args.path, args.files, args.dirstate_v2)
+        bench(args.path, args.repeat)
+    else:
+        with tempfile.TemporaryDirectory() as path:
+            make_repository(path, args.files, args.dirstate_v2)
+            bench(path, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
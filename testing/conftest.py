@@ -1,3 +1,4 @@
+import asyncio
 import itertools
 import os
 
@@ -98,6 +99,21 @@ def debug_mode():
     utils.DEBUG = False
 
 
+@pytest.fixture(autouse=True)
+def clear_version_memo():
+    from setuptools_scm import clear_cache
+
+    yield
+    clear_cache()
+
+
+@pytest.fixture
+def async_loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
 @pytest.fixture
 def wd(tmp_path):
     target_wd = tmp_path.resolve() / "wd"
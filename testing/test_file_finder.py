@@ -191,3 +191,40 @@ def test_symlink_not_in_scm_while_target_is(inwd):
 @pytest.mark.skip_commit
 def test_not_commited(inwd):
     assert find_files() == []
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="symlinks not supported on windows")
+def test_scm_find_files_resolves_symlinks_only(tmp_path, monkeypatch):
+    from setuptools_scm import file_finder
+
+    root = tmp_path / "root"
+    (root / "adir" / "sub").mkdir(parents=True)
+    (root / "adir" / "filea").touch()
+    (root / "adir" / "sub" / "fileb").touch()
+    (root / "venv" / "lib").mkdir(parents=True)
+    (root / "venv" / "lib" / "untracked").touch()
+    (root / "alink").symlink_to("adir")
+    toplevel = os.path.normcase(os.path.realpath(str(root)))
+    scm_files = {
+        os.path.join(toplevel, name)
+        for name in ("adir/filea", "adir/sub/fileb", "alink")
+    }
+    scm_dirs = {toplevel} | {
+        os.path.join(toplevel, name) for name in ("adir", "adir/sub")
+    }
+
+    resolved = []
+    realpath = os.path.realpath
+
+    def spy(fn, *args, **kwargs):
+        resolved.append(fn)
+        return realpath(fn, *args, **kwargs)
+
+    monkeypatch.setattr(os.path, "realpath", spy)
+    found = file_finder.scm_find_files(str(root), scm_files, scm_dirs)
+    assert set(found) == {
+        os.path.join(str(root), name)
+        for name in ("adir/filea", "adir/sub/fileb", "alink")
+    }
+    # the root and the symlink, the realpath of the root is memoized
+    assert resolved == [str(root), toplevel, os.path.join(toplevel, "alink")]
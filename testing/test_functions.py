@@ -1,3 +1,5 @@
+import shutil
+
 import pkg_resources
 import pytest
 
@@ -5,6 +7,7 @@ from setuptools_scm import dump_version
 from setuptools_scm import get_version
 from setuptools_scm import PRETEND_KEY
 from setuptools_scm.config import Configuration
+from setuptools_scm.utils import clear_command_cache
 from setuptools_scm.utils import has_command
 from setuptools_scm.version import format_version
 from setuptools_scm.version import guess_next_version
@@ -84,6 +87,29 @@ def test_has_command(recwarn):
     assert "yadayada" in str(msg.message)
 
 
+def test_has_command_cached_per_path(monkeypatch):
+    probed = []
+
+    def fake_which(name):
+        probed.append(name)
+        return "/usr/bin/" + name
+
+    clear_command_cache()
+    monkeypatch.setattr(shutil, "which", fake_which)
+    assert has_command("fake-scm")
+    assert has_command("fake-scm")
+    assert probed == ["fake-scm"]
+
+    monkeypatch.setenv("PATH", "/nowhere")
+    assert has_command("fake-scm")
+    assert probed == ["fake-scm"] * 2
+
+    clear_command_cache()
+    assert has_command("fake-scm")
+    assert probed == ["fake-scm"] * 3
+    clear_command_cache()
+
+
 @pytest.mark.parametrize(
     "tag, expected_version",
     [
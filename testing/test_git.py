@@ -1,4 +1,7 @@
+import functools
 import os
+import re
+import subprocess
 import sys
 from datetime import date
 from datetime import datetime
@@ -8,12 +11,22 @@ from unittest.mock import patch
 
 import pytest
 
+from setuptools_scm import get_version_async
+from setuptools_scm import get_versions
 from setuptools_scm import git
+from setuptools_scm import instrument
 from setuptools_scm import integration
+from setuptools_scm import iter_versions
 from setuptools_scm import NonNormalizedVersion
+from setuptools_scm.config import Configuration
 from setuptools_scm.file_finder_git import git_find_files
 from setuptools_scm.utils import do
 from setuptools_scm.utils import has_command
+from setuptools_scm.utils import iter_split
+from setuptools_scm.utils import RecordingRunner
+from setuptools_scm.utils import ReplayRunner
+from setuptools_scm.utils import SpawnRunner
+from setuptools_scm.utils import use_runner
 
 
 pytestmark = pytest.mark.skipif(
@@ -71,6 +84,67 @@ setup(use_scm_version={"search_parent_directories": True})
     assert res == "0.1.dev0"
 
 
+def test_search_parent_spawns_once(wd, popen_calls, monkeypatch):
+    wd.commit_testfile()
+    deep = wd.cwd.joinpath("a/b/c/d/e")
+    deep.mkdir(parents=True)
+    # a gitfile-less .git entry that isn't a repository is skipped
+    wd.cwd.joinpath("a/b/.git").write_text("not a gitfile")
+    del popen_calls[:]
+    found = git.search_parent(str(deep))
+    assert found.path == str(wd.cwd)
+    assert popen_calls == [["git", "rev-parse", "--show-prefix"]]
+
+    config = Configuration(root=str(deep), search_parent_directories=True)
+    assert git.parse(str(deep), config=config).distance == 1
+
+
+def test_search_parent_boundaries(wd, monkeypatch):
+    from setuptools_scm import discover
+
+    wd.commit_testfile()
+    deep = wd.cwd.joinpath("a/b")
+    deep.mkdir(parents=True)
+
+    monkeypatch.setenv("GIT_CEILING_DIRECTORIES", str(wd.cwd))
+    assert git.search_parent(str(deep)) is None
+    monkeypatch.setenv("GIT_CEILING_DIRECTORIES", str(wd.cwd.parent))
+    assert git.search_parent(str(deep)).path == str(wd.cwd)
+    assert list(discover.walk_repository_roots(str(deep))) == [
+        str(deep),
+        str(deep.parent),
+        str(wd.cwd),
+    ]
+    monkeypatch.delenv("GIT_CEILING_DIRECTORIES")
+
+    device = discover._device
+    mounted = str(wd.cwd.joinpath("a"))
+
+    def fake_device(path):
+        return -1 if path == mounted else device(path)
+
+    monkeypatch.setattr(discover, "_device", fake_device)
+    assert git.search_parent(mounted) is None
+    monkeypatch.setenv("GIT_DISCOVERY_ACROSS_FILESYSTEM", "1")
+    assert git.search_parent(mounted).path == str(wd.cwd)
+
+
+def test_entrypoint_search_ignores_git_boundaries(wd, monkeypatch):
+    from setuptools_scm import discover
+
+    wd.commit_testfile()
+    deep = wd.cwd.joinpath("a/b")
+    deep.mkdir(parents=True)
+    # the limits of git's discovery don't apply to the other scms
+    monkeypatch.setenv("GIT_CEILING_DIRECTORIES", str(wd.cwd))
+    config = Configuration(root=str(deep), search_parent_directories=True)
+    found = discover.iter_matching_entrypoints(
+        str(deep), "setuptools_scm.parse_scm", config
+    )
+    assert next(found).name == ".git"
+    assert config.parent == str(wd.cwd)
+
+
 def test_git_gone(wd, monkeypatch):
     monkeypatch.setenv("PATH", str(wd.cwd / "not-existing"))
     with pytest.raises(EnvironmentError, match="'git' was not found"):
@@ -264,6 +338,71 @@ def test_git_shallow_autocorrect(shallow_wd, recwarn):
     git.parse(str(shallow_wd), pre_parse=git.fail_on_shallow)
 
 
+@pytest.fixture
+def deep_shallow_wd(wd, tmp_path):
+    for i in range(30):
+        wd.commit_testfile()
+    wd("git tag v1.0")
+    for i in range(10):
+        wd.commit_testfile()
+    remote = tmp_path / "remote.git"
+    target = tmp_path / "wd_shallow"
+    do(["git", "clone", "--bare", str(wd.cwd), str(remote)])
+    do(["git", "clone", "--depth=1", "file://%s" % remote, str(target)])
+    return target
+
+
+def test_git_shallow_deepen(deep_shallow_wd, recwarn):
+    git_wd = git.GitWorkdir(str(deep_shallow_wd))
+    with pytest.raises(ValueError, match="is shallow"):
+        git.fail_on_shallow(git_wd)
+
+    git.deepen_on_shallow(git_wd, start=2)
+    assert not recwarn.list
+    # 2 + 4 + 8 commits reach the tag, the rest of the history isn't fetched
+    assert git_wd.is_shallow()
+    assert git_wd.count_all_nodes() == 15
+    git.fail_on_shallow(git_wd)
+    git.warn_on_shallow(git_wd)
+    assert not recwarn.list
+    assert git.parse(str(deep_shallow_wd)).format_with("{tag} {distance}") == ("1.0 10")
+
+
+def test_git_shallow_checks_use_tag_regex(wd, tmp_path, recwarn):
+    wd.commit_testfile()
+    wd("git tag pkg-1.0")
+    for i in range(5):
+        wd.commit_testfile()
+    # a nearer tag of another project must not satisfy the checks
+    wd("git tag other-2.0")
+    wd.commit_testfile()
+    remote = tmp_path / "remote.git"
+    target = tmp_path / "wd_shallow"
+    do(["git", "clone", "--bare", str(wd.cwd), str(remote)])
+    do(["git", "clone", "--depth=3", "file://%s" % remote, str(target)])
+    config = Configuration(root=str(target), tag_regex=r"^pkg-(?P<version>.*)$")
+
+    with pytest.raises(ValueError, match="is shallow"):
+        git.parse(str(target), pre_parse=git.fail_on_shallow, config=config)
+    # the batch checks the tags of every configuration
+    other = Configuration(root=str(target), tag_regex=r"^other-(?P<version>.*)$")
+    with pytest.raises(ValueError, match="is shallow"):
+        git.parse_batch([other, config], pre_parse=git.fail_on_shallow)
+
+    deepen = functools.partial(git.deepen_on_shallow, start=1)
+    metas = git.parse_batch([other, config], pre_parse=deepen)
+    versions = [meta.format_with("{tag} {distance}") for meta in metas]
+    assert versions == ["2.0 1", "1.0 6"]
+    assert not recwarn.list
+
+
+def test_git_shallow_deepen_limit(deep_shallow_wd):
+    git_wd = git.GitWorkdir(str(deep_shallow_wd))
+    with pytest.warns(UserWarning, match="still shallow after fetching 5 more"):
+        git.deepen_on_shallow(git_wd, start=1, limit=5)
+    assert git_wd.count_all_nodes() == 6
+
+
 def test_find_files_stop_at_root_git(wd):
     wd.commit_testfile()
     project = wd.cwd / "project"
@@ -299,6 +438,207 @@ def test_git_archive_export_ignore(wd, monkeypatch):
     assert integration.find_files(".") == [opj(".", "test1.txt")]
 
 
+def test_git_tree_listing_matches_archive(wd):
+    from setuptools_scm import file_finder_git
+    from setuptools_scm.utils import PopenRunner
+
+    for directory in (
+        "a/b",
+        "dropped/deeper",
+        "slashed/deeper",
+        "hollow/inner",
+        "vacant/inner",
+    ):
+        wd.cwd.joinpath(directory).mkdir(parents=True)
+    wd.write("a/b/c.txt", "c")
+    wd.write("a/b/ignored.txt", "ignored")
+    # git archive writes the trees before it checks the file
+    wd.write("hollow/inner/ignored.txt", "ignored")
+    # but never gets to write a tree which only holds an ignored tree
+    wd.write("vacant/inner/v.txt", "v")
+    wd.write("a/with space.txt", "space")
+    wd.write("a/\u00fcnicode.txt", "unicode")
+    wd.write("dropped/d.txt", "d")
+    wd.write("dropped/deeper/e.txt", "e")
+    wd.write("slashed/deeper/s.txt", "s")
+    wd.write(
+        ".gitattributes",
+        "dropped export-ignore\n*/b/ignored.txt export-ignore\n"
+        "hollow/inner/ignored.txt export-ignore\nvacant/inner export-ignore\n"
+        # patterns ending in / only match directories
+        "slashed/ export-ignore\n",
+    )
+    wd("git add .")
+    wd.commit()
+    head = wd("git rev-parse HEAD")
+    # a submodule without its repository
+    wd(f"git update-index --add --cacheinfo 160000,{head},sub")
+    wd.commit()
+
+    toplevel = file_finder_git._git_toplevel(str(wd.cwd))
+    with instrument() as stats:
+        files, dirs = file_finder_git._git_ls_files_and_dirs(toplevel)
+    assert [" ".join(record.argv[:2]) for record in stats] == [
+        "git ls-tree",
+        "git ls-files",
+        "git check-attr",
+    ]
+    expected = file_finder_git._git_archive_files_and_dirs(toplevel, PopenRunner())
+    assert (files, dirs) == expected
+    assert opj(toplevel, "a", "with space.txt") in files
+    assert opj(toplevel, "sub") in dirs
+    assert not any(
+        word in name
+        for word in ("dropped", "ignored", "slashed", "vacant")
+        for name in files | dirs
+    )
+    assert opj(toplevel, "hollow", "inner") in dirs
+
+    # check-attr would read the staged attributes, git archive those of HEAD
+    wd.write(".gitattributes", "a export-ignore\n")
+    wd("git add .gitattributes")
+    with instrument() as stats:
+        files, dirs = file_finder_git._git_ls_files_and_dirs(toplevel)
+    assert "git archive" in [" ".join(record.argv[:2]) for record in stats]
+    assert (files, dirs) == expected
+
+
+@pytest.mark.parametrize("index_version", [2, 3, 4])
+def test_git_index_listing(wd, monkeypatch, popen_calls, index_version):
+    from setuptools_scm import file_finder_git
+
+    wd.cwd.joinpath("a/b").mkdir(parents=True)
+    for name in ("top.txt", "a/x.txt", "a/b/c.txt", "a/with space.txt"):
+        wd.write(name, name)
+    wd("git add .")
+    wd.commit()
+    wd(f"git update-index --index-version {index_version}")
+    if index_version == 3:
+        # only entries with extended flags need version 3
+        wd("git update-index --skip-worktree a/x.txt")
+    toplevel = file_finder_git._git_toplevel(str(wd.cwd))
+    with open(os.path.join(toplevel, ".git", "index"), "rb") as fp:
+        assert fp.read(8)[4:] == index_version.to_bytes(4, "big")
+
+    files, dirs = file_finder_git._git_index_files_and_dirs(toplevel)
+    head_files, head_dirs = file_finder_git._git_ls_files_and_dirs(toplevel)
+    assert dirs == head_dirs
+    if index_version == 3:
+        # skip-worktree files are not checked out
+        head_files.remove(opj(toplevel, "a", "x.txt"))
+    assert files == head_files
+
+    wd.cwd.joinpath("a/new").mkdir()
+    wd.write("a/new/n.txt", "staged")
+    wd("git add a/new/n.txt")
+    wd("git rm -q --cached top.txt")
+    wd(f"git update-index --add --cacheinfo 160000,{wd('git rev-parse HEAD')},sub")
+    files, dirs = file_finder_git._git_index_files_and_dirs(toplevel)
+    assert opj(toplevel, "a", "new", "n.txt") in files
+    assert opj(toplevel, "top.txt") not in files
+    assert {opj(toplevel, "a", "new"), opj(toplevel, "sub")} <= dirs
+
+    monkeypatch.setenv(file_finder_git.WORKTREE_LISTING_KEY, "1")
+    monkeypatch.chdir(wd.cwd)
+    del popen_calls[:]
+    assert opj(".", "a", "new", "n.txt") in git_find_files(".")
+    # only the toplevel is looked up with git
+    assert [argv[1] for argv in popen_calls] == ["rev-parse", "rev-parse"]
+
+
+def test_git_file_list_cache(wd, monkeypatch):
+    from setuptools_scm import file_finder_git
+    from setuptools_scm._files_cache import FILE_LIST_CACHE_KEY
+    from setuptools_scm.utils import PopenRunner
+
+    for directory in ("a/b", "dropped", "moved", "emptied/docs"):
+        wd.cwd.joinpath(directory).mkdir(parents=True)
+    for name in (
+        "top.txt",
+        "a/b/c.txt",
+        "dropped/d.txt",
+        "moved/m.txt",
+        "gone.txt",
+        "emptied/e.txt",
+        "emptied/docs/d",
+    ):
+        wd.write(name, name)
+    wd.write(
+        ".gitattributes",
+        "dropped export-ignore\n*.skip export-ignore\n"
+        # only directories match, the tree is added by the update below
+        "docs/ export-ignore\n",
+    )
+    wd("git add .")
+    wd.commit()
+    toplevel = file_finder_git._git_toplevel(str(wd.cwd))
+
+    def listed():
+        with instrument() as stats:
+            listing = file_finder_git._git_ls_files_and_dirs(toplevel)
+        return listing, [" ".join(record.argv[:2]) for record in stats]
+
+    monkeypatch.setenv(FILE_LIST_CACHE_KEY, "1")
+    assert listed()[1] == ["git ls-files", "git ls-tree", "git check-attr"]
+    assert listed()[1] == []
+    # after the index is written only the staged attributes are compared
+    index = wd.cwd / ".git" / "index"
+    os.utime(str(index), ns=(0, index.stat().st_mtime_ns + 10**9))
+    assert listed()[1] == ["git ls-files"]
+    assert listed()[1] == []
+
+    for directory in ("a/new", "a/docs/deeper", "skipped"):
+        wd.cwd.joinpath(directory).mkdir(parents=True)
+    for name in (
+        "a/new/n.txt",
+        "dropped/later.txt",
+        "a/b/x.skip",
+        "a/docs/deeper/d",
+        "skipped/s.skip",
+    ):
+        wd.write(name, name)
+    # only the export-ignored docs are left in it
+    wd("git rm -q gone.txt moved/m.txt emptied/e.txt")
+    wd.write("moved", "now a file")
+    wd("git add .")
+    wd.commit()
+    listing, commands = listed()
+    # the trees without listed contents are looked into
+    assert commands == [
+        "git ls-files",
+        "git diff-tree",
+        "git check-attr",
+        "git --literal-pathspecs",
+    ]
+    monkeypatch.delenv(FILE_LIST_CACHE_KEY)
+    assert listing == listed()[0]
+    files, dirs = listing
+    assert opj(toplevel, "a", "new", "n.txt") in files
+    assert opj(toplevel, "moved") in files
+    assert opj(toplevel, "moved") not in dirs
+    assert not any("dropped" in name or "gone" in name for name in files | dirs)
+    assert opj(toplevel, "a", "b", "x.skip") not in files
+    assert not any("docs" in name or "emptied" in name for name in files | dirs)
+    # like git archive writes the trees of ignored blobs
+    assert opj(toplevel, "skipped") in dirs
+    assert listing == file_finder_git._git_archive_files_and_dirs(
+        toplevel, PopenRunner()
+    )
+
+    # git archive reads the attributes of HEAD, check-attr those of the index
+    monkeypatch.setenv(FILE_LIST_CACHE_KEY, "1")
+    wd.write(".gitattributes", "*.skip export-ignore\n")
+    wd("git add .gitattributes")
+    listing, commands = listed()
+    assert commands == ["git ls-files", "git ls-tree", "git archive"]
+    assert opj(toplevel, "dropped", "later.txt") not in listing[0]
+    # changed attributes list the whole tree again
+    wd.commit()
+    listing, commands = listed()
+    assert commands == ["git ls-files", "git ls-tree", "git check-attr"]
+    assert opj(toplevel, "dropped", "later.txt") in listing[0]
+
+
 @pytest.mark.issue(228)
 def test_git_archive_subdirectory(wd, monkeypatch):
     os.mkdir(wd.cwd / "foobar")
@@ -401,3 +741,654 @@ def test_git_getdate_badgit(
     git_wd = git.GitWorkdir(os.fspath(wd.cwd))
     with patch.object(git_wd, "do_ex", Mock(return_value=("%cI", "", 0))):
         assert git_wd.get_head_date() is None
+
+
+def test_git_workdir_session(wd):
+    git_wd = git.GitWorkdir(os.fspath(wd.cwd))
+    unborn = git_wd.get_head_info()
+    with git_wd:
+        assert git_wd.node() is None
+        assert git_wd.get_head_date() is None
+        assert git_wd.get_head_info() == unborn
+
+    wd.commit_testfile()
+    expected = git_wd.node(), git_wd.get_head_date(), git_wd.get_head_info()
+    with git_wd:
+        # lookups are answered by the cat-file process only
+        with patch.object(git_wd, "do_ex", Mock(side_effect=AssertionError)):
+            assert (
+                git_wd.node(),
+                git_wd.get_head_date(),
+                git_wd.get_head_info(),
+            ) == expected
+    assert git_wd._batch is None
+
+    wd("git checkout --detach")
+    detached = git_wd.get_head_info()
+    assert detached[1] == "HEAD"
+    with git_wd:
+        assert git_wd.get_head_info() == detached
+
+
+def test_git_instrument(wd):
+    wd.commit_testfile()
+    wd("git tag v1.0")
+    with instrument() as stats:
+        assert wd.get_version() == "1.0"
+        assert len(git_find_files(str(wd.cwd))) == 1
+        with git.GitWorkdir(os.fspath(wd.cwd)) as git_wd:
+            git_wd.node()
+    commands = [" ".join(record.argv[:2]) for record in stats]
+    assert "git describe" in commands
+    assert "git ls-tree" in commands
+    assert commands[-1] == "git cat-file"
+    assert all(
+        record.cwd == str(wd.cwd) for record in stats if record.argv[1] != "help"
+    )
+    assert stats.summary()["git describe"]["count"] == 1
+    describe = next(record for record in stats if record.argv[1] == "describe")
+    assert describe.returncode == 0
+    assert describe.output_size > 0
+    assert describe.duration > 0
+
+    wd.commit_testfile()
+    assert len(stats) == len(commands)
+
+
+def test_git_profile_env(wd, tmp_path):
+    import json
+
+    wd.commit_testfile()
+    report = tmp_path / "profile.json"
+    env = dict(os.environ, SETUPTOOLS_SCM_PROFILE=str(report))
+    subprocess.check_call(
+        [sys.executable, "-c", "import setuptools_scm; setuptools_scm.get_version()"],
+        cwd=str(wd.cwd),
+        env=env,
+    )
+    data = json.loads(report.read_text())
+    assert "git describe" in data["summary"]
+    assert data["commands"][0]["argv"][0] == "git"
+
+
+@pytest.mark.parametrize("backend", ["cli", "native"])
+def test_git_record_replay(wd, tmp_path, monkeypatch, backend):
+    wd.commit_testfile()
+    wd("git tag v1.0")
+    wd.commit_testfile()
+    wd.write("test.txt", "dirty")
+    expected = wd.get_version(git_backend=backend)
+    expected_files = git_find_files(str(wd.cwd))
+
+    recorder = RecordingRunner()
+    with use_runner(recorder):
+        assert wd.get_version(git_backend=backend) == expected
+    assert git_find_files(str(wd.cwd), runner=recorder) == expected_files
+    recorder.save(str(tmp_path / "git.json"))
+
+    replay = ReplayRunner.load(str(tmp_path / "git.json"))
+    wd("git tag v2.0")
+    monkeypatch.setattr(subprocess, "Popen", Mock(side_effect=AssertionError))
+    with use_runner(replay):
+        assert wd.get_version(git_backend=backend) == expected
+    assert git_find_files(str(wd.cwd), runner=replay) == expected_files
+    with pytest.raises(LookupError):
+        git.GitWorkdir(str(wd.cwd), replay).do_ex("git gc")
+
+
+def test_git_spawn_runner(wd):
+    wd.commit_testfile()
+    wd("git tag v1.0")
+    wd.commit_testfile()
+    expected = wd.get_version()
+    with use_runner(SpawnRunner()):
+        assert wd.get_version() == expected
+    git_wd = git.GitWorkdir.from_potential_worktree(str(wd.cwd), SpawnRunner())
+    assert git_wd.get_branch() == "master"
+
+    if getattr(subprocess, "_USE_POSIX_SPAWN", False):
+        with patch.object(os, "posix_spawn", Mock(wraps=os.posix_spawn)) as spawn:
+            assert git_wd.node() == wd("git rev-parse HEAD")[:7]
+        assert spawn.called
+
+
+def test_git_iter_lines(wd, async_loop):
+    for i in range(3):
+        wd.commit_testfile()
+    git_wd = git.GitWorkdir(str(wd.cwd))
+    assert git_wd.count_all_nodes() == 3
+    # a broken history doesn't fail the build
+    assert git_wd.count_all_nodes("no-such-rev") == 0
+    counted = git_wd.count_all_nodes_async("no-such-rev")
+    assert async_loop.run_until_complete(counted) == 0
+    revs = git_wd.do("git rev-list HEAD").splitlines()
+    assert list(git_wd.iter_lines("git rev-list HEAD")) == revs
+
+    with instrument() as stats:
+        lines = git_wd.iter_lines(["git", "rev-list", "HEAD"])
+        assert next(lines) == revs[0]
+        lines.close()
+        assert list(git_wd.iter_lines("git rev-list nonexisting")) == []
+    # only the finished command is recorded
+    assert [record.returncode for record in stats] == [128]
+
+
+@pytest.mark.parametrize("runner", [None, RecordingRunner()], ids=["popen", "buffered"])
+def test_iter_split(wd, runner):
+    names = ["a file", "line\nbreak", "plain"]
+    for name in names:
+        wd.write(name, name)
+    wd("git add .")
+    ls_files = iter_split(["git", "ls-files", "-z"], wd.cwd, runner)
+    assert list(ls_files) == names
+
+    failing = iter_split(["git", "ls-files", "-z", "--error-unmatch", "nope"], wd.cwd)
+    with pytest.raises(StopIteration) as stop:
+        next(failing)
+    # the generator returns the returncode
+    assert stop.value.value == 1
+
+
+@pytest.mark.parametrize("strategy", sorted(git.DIRTY_STRATEGIES))
+def test_git_dirty_strategy(wd, strategy):
+    git_wd = git.GitWorkdir(str(wd.cwd))
+    wd.write("test.txt", "staged")
+    wd("git add test.txt")
+    assert git_wd.is_dirty(strategy)
+    wd.commit()
+    assert not git_wd.is_dirty(strategy)
+    wd.write("untracked.txt", "new")
+    assert not git_wd.is_dirty(strategy)
+
+    assert wd.get_version(dirty_strategy=strategy).startswith("0.1.dev1+g")
+    wd.write("test.txt", "modified")
+    assert git_wd.is_dirty(strategy)
+    assert wd.get_version(dirty_strategy=strategy) == wd.get_version()
+    wd("git tag v1.0")
+    assert wd.get_version(dirty_strategy=strategy) == wd.get_version()
+    assert wd.get_version(dirty_strategy=strategy, parallel_queries=True).startswith(
+        "1.1.dev0+g"
+    )
+    wd("git checkout test.txt")
+    assert wd.get_version(dirty_strategy=strategy) == "1.0"
+
+
+def test_git_dirty_strategy_submodules(wd, tmp_path):
+    commit = (
+        "git -c user.name=sub -c user.email=sub@example.com commit --allow-empty -m x"
+    )
+    sub = tmp_path / "sub"
+    sub.mkdir()
+    do("git init", sub)
+    do(commit, sub)
+    wd.commit_testfile()
+    wd("git -c protocol.file.allow=always submodule add {sub} sub", sub=sub)
+    wd.commit()
+    git_wd = git.GitWorkdir(str(wd.cwd))
+    assert not git_wd.is_dirty("status")
+
+    do(commit, wd.cwd / "sub")
+    assert git_wd.is_dirty("status")
+    assert git_wd.is_dirty("diff-index")
+    assert not git_wd.is_dirty("ignore-submodules")
+
+
+def test_git_dirty_strategy_fsmonitor(wd, popen_calls):
+    wd.commit_testfile()
+    wd("git config core.fsmonitor false")
+    git_wd = git.GitWorkdir(str(wd.cwd))
+    index = wd.cwd / ".git" / "index"
+    before = index.stat().st_mtime_ns
+    # touched but unchanged, a refreshed index would be written back
+    os.utime(str(wd.cwd / "test.txt"), ns=(before + 10**9, before + 10**9))
+    assert not git_wd.is_dirty("fsmonitor")
+    assert index.stat().st_mtime_ns == before
+    # the repository configuration decides whether an fsmonitor is used
+    assert not any("-c" in cmd for cmd in popen_calls)
+
+
+def test_git_dirty_strategy_unknown(wd):
+    with pytest.raises(ValueError, match="unknown dirty_strategy 'fast'"):
+        wd.get_version(dirty_strategy="fast")
+
+
+@pytest.mark.parametrize("commit_graph", [False, True])
+def test_git_describe_engine_nearest_tag(wd, commit_graph):
+    git_wd = git.GitWorkdir(str(wd.cwd))
+
+    def check():
+        expected = git_wd.do_ex("git describe --tags --long --match v*")
+        assert git_wd.describe_nearest_tag() == expected
+
+    assert git_wd.describe_nearest_tag()[2] == 128
+    wd.commit_testfile()
+    wd("git tag v1.0")
+    # annotated tags are preferred over lightweight ones on the same commit
+    wd("git tag -a v0.9 -m annotated")
+    check()
+    wd.commit_testfile()
+    wd("git checkout -b side")
+    wd.write("side.txt", "side")
+    wd.add_and_commit()
+    wd("git tag -a v1.1 -m side")
+    wd("git checkout master")
+    wd.commit_testfile()
+    wd("git merge --no-edit side")
+    wd.commit_testfile()
+    check()
+    if commit_graph:
+        wd("git commit-graph write --reachable")
+        with git_wd._git_repository() as repo:
+            assert repo.commit_graph() is not None
+    wd.commit_testfile()
+    check()
+
+    engine = dict(describe_engine="nearest-tag")
+    assert wd.get_version(**engine) == wd.get_version()
+    wd.write("test.txt", "dirty")
+    assert wd.get_version(**engine) == wd.get_version()
+    assert wd.get_version(parallel_queries=True, **engine) == wd.get_version()
+
+    # only tags matching tag_regex are considered
+    wd("git tag release-candidate7")
+    assert git_wd.describe_nearest_tag()[0].startswith("v1.1-4-g")
+
+
+def test_git_describe_engine_nearest_tag_fallback(wd):
+    wd.commit_testfile()
+    wd("git tag pkg-1.0")
+    wd.commit_testfile()
+    wd("git tag other-2.0")
+    wd.commit_testfile()
+    # the reader refuses the repository, git describe answers instead
+    wd("git config extensions.unknownFeature true")
+    git_wd = git.GitWorkdir(str(wd.cwd))
+    tag_regex = r"^pkg-(?P<version>.*)$"
+    out, _, ret = git_wd.describe_nearest_tag(tag_regex)
+    assert ret == 0
+    assert out == "pkg-1.0-2-g" + wd("git rev-parse HEAD")[:7]
+    head = wd("git rev-parse HEAD~1")
+    assert git_wd.describe_nearest_tag(tag_regex, head)[0].startswith("pkg-1.0-1-g")
+
+
+def test_git_describe_engine_unknown(wd):
+    with pytest.raises(ValueError, match="unknown describe_engine 'fast'"):
+        wd.get_version(describe_engine="fast")
+
+
+@pytest.fixture
+def popen_calls(monkeypatch):
+    from setuptools_scm import utils
+
+    calls = []
+    popen_pipes = utils._popen_pipes
+
+    def counting_popen_pipes(cmd, cwd, **kw):
+        calls.append(cmd)
+        return popen_pipes(cmd, cwd, **kw)
+
+    monkeypatch.setattr(utils, "_popen_pipes", counting_popen_pipes)
+    # the cat-file session is started directly
+    monkeypatch.setattr(git, "_popen_pipes", counting_popen_pipes)
+    return calls
+
+
+@pytest.mark.parametrize(
+    "tag_regex, expected",
+    [
+        (None, "*[0-9]*"),
+        (r"^(?:[\w-]+-)?(?P<version>[vV]?\d+.*)$", "*[0-9]*"),
+        (r"^mypkg-v(?P<version>.*)$", "mypkg-v*[0-9]*"),
+        (r"mypkg\-(?P<version>\d.*)", "mypkg-*[0-9]*"),
+        (r"^py3-(?P<version>.*)$", "py3-*"),
+        (r"^pkgs?-(?P<version>.*)$", "pkg*[0-9]*"),
+        (r"^a\*b-(?P<version>.*)$", "a*[0-9]*"),
+        (r"^foo-(?P<version>.*)|^bar-(?P<other>.*)", "*[0-9]*"),
+        (r"^pkg[|]-(?P<version>.*)$", "pkg*[0-9]*"),
+        (r"(?i)^pkg-(?P<version>.*)$", "*[0-9]*"),
+    ],
+)
+def test_describe_match(tag_regex, expected):
+    if tag_regex is not None:
+        tag_regex = re.compile(tag_regex)
+    assert git.describe_match(tag_regex) == expected
+
+
+def test_git_describe_match_from_tag_regex(wd, async_loop):
+    wd.commit_testfile()
+    wd("git tag mypkg-v1.0")
+    wd.commit_testfile()
+    wd("git tag other-9.0")
+    wd.commit_testfile()
+    tag_regex = r"^mypkg-v(?P<version>.*)$"
+    assert wd.get_version(tag_regex=tag_regex).startswith("1.1.dev2+g")
+    assert wd.get_version(tag_regex=tag_regex, dirty_strategy="diff-index") == (
+        wd.get_version(tag_regex=tag_regex)
+    )
+    result = async_loop.run_until_complete(
+        get_version_async(root=str(wd.cwd), tag_regex=tag_regex)
+    )
+    assert result == wd.get_version(tag_regex=tag_regex)
+
+
+def test_get_versions_monorepo(wd, popen_calls, monkeypatch):
+    packages = {
+        "a": dict(
+            git_describe_command="git describe --dirty --tags --long --match a-*"
+        ),
+        "b": dict(tag_regex=r"^(?:b-)?(?P<version>\d+(?:\.\d+)*)$"),
+        "c": dict(dirty_strategy="diff-index", version_scheme="post-release"),
+        # not something the tag search can stand in for
+        "d": dict(git_describe_command="git describe --tags --long --first-parent"),
+        "e": dict(describe_engine="nearest-tag", tag_regex=r"^a-(?P<version>.*)$"),
+    }
+    configs = [
+        dict(root=str(wd.cwd), dist_name=name, **options)
+        for name, options in packages.items()
+    ]
+
+    def check(expected_calls):
+        del popen_calls[:]
+        versions = get_versions(configs)
+        calls = len(popen_calls)
+        assert versions == {
+            name: wd.get_version(**options) for name, options in packages.items()
+        }
+        assert calls == expected_calls, popen_calls[:calls]
+        return versions
+
+    wd.commit_testfile()
+    wd("git tag a-1.0")
+    wd.commit_testfile()
+    wd("git tag -a b-2.0 -m b")
+    wd.commit_testfile()
+    # status, diff-index and a describe shared by "b" and "c" plus one for "a",
+    # "e" searches the tags without git, rev-parse, describe and cat-file for "d"
+    versions = check(7)
+    assert versions["a"].startswith("1.1.dev2+g")
+    assert versions["b"].startswith("2.1.dev1+g")
+    assert versions["e"] == versions["a"]
+    wd.write("test.txt", "dirty")
+    versions = check(7)
+    assert ".d" in versions["a"].split("+")[1]
+
+    monkeypatch.setenv("SETUPTOOLS_SCM_PRETEND_VERSION_FOR_B", "3.0")
+    assert get_versions(configs)["b"] == "3.0"
+    with pytest.raises(ValueError, match="duplicate dist_name"):
+        get_versions(configs + configs[:1])
+    with pytest.raises(ValueError, match="needs a dist_name"):
+        get_versions([dict(root=str(wd.cwd))])
+
+
+def test_iter_versions(wd, popen_calls):
+    wd.commit_testfile()
+    wd.commit_testfile()
+    wd("git tag v1.0")
+    wd("git tag v1.0.1")
+    wd("git tag nightly")
+    wd.commit_testfile()
+    wd("git tag v2.0rc1")
+    # describe prefers annotated tags
+    wd("git tag -a v1.9 -m annotated")
+    wd.commit_testfile()
+    wd.commit_testfile()
+
+    del popen_calls[:]
+    config = dict(root=str(wd.cwd), version_scheme="post-release")
+    history = list(iter_versions(config))
+    # rev-parse, tag listing and log
+    assert len(popen_calls) == 3, popen_calls
+    assert [sha for sha, _ in history] == wd("git rev-list --reverse HEAD").split()
+    for sha, version in history:
+        wd(f"git checkout -q {sha}")
+        assert version == wd.get_version(version_scheme="post-release")
+    assert [version.split("+")[0] for _, version in history] == [
+        "0.0.post1",
+        "1.0",
+        "1.9",
+        "1.9.post1",
+        "1.9.post2",
+    ]
+
+
+def test_iter_versions_merge(wd):
+    wd.commit_testfile()
+    wd("git tag v1.0")
+    wd("git checkout -q -b side")
+    wd.write("side.txt", "side")
+    wd.add_and_commit()
+    wd("git checkout -q master")
+    wd.commit_testfile()
+    wd("git tag v1.1")
+    wd("git merge -q --no-edit side")
+    merge = wd("git rev-parse HEAD")
+    wd.commit_testfile()
+    # an untagged side history merged in
+    wd("git checkout -q --orphan other")
+    wd.write("other.txt", "other")
+    wd.add_and_commit()
+    wd.commit_testfile()
+    wd("git checkout -q master")
+    wd("git merge -q --no-edit --allow-unrelated-histories other")
+    wd.commit_testfile()
+    history = dict(iter_versions(dict(root=str(wd.cwd))))
+    assert list(history) == wd("git rev-list --topo-order --reverse HEAD").split()
+    for sha, version in history.items():
+        assert version == wd.get_version(rev=sha)
+    # like git describe the merge counts the commits v1.1 doesn't contain
+    assert wd(f"git describe --tags {merge}").startswith("v1.1-2-g")
+    assert history[merge].startswith("1.2.dev2+g")
+
+
+def test_iter_versions_merge_tie(wd):
+    def git_at(minute, *args):
+        # describe walks by commit date, the dates have to differ
+        env = dict(os.environ, GIT_COMMITTER_DATE=f"2020-01-01T00:{minute:02}:00")
+        subprocess.run(["git", *args], cwd=str(wd.cwd), env=env, check=True)
+
+    commit = ["commit", "-q", "--allow-empty", "-m", "commit"]
+    git_at(0, *commit)
+    git_at(1, *commit)
+    wd("git tag v1.1")
+    wd("git checkout -q -b side HEAD~1")
+    git_at(2, *commit)
+    wd("git tag -a v2.0 -m side")
+    wd("git checkout -q master")
+    # both tags are one commit away from the merge, describe takes the newer one
+    git_at(3, "merge", "-q", "--no-edit", "side")
+    merge = wd("git rev-parse HEAD")
+    git_at(4, *commit)
+    history = dict(iter_versions(dict(root=str(wd.cwd))))
+    for sha, version in history.items():
+        assert version == wd.get_version(rev=sha)
+    assert wd(f"git describe --tags {merge}").startswith("v2.0-2-g")
+    assert history[merge].startswith("2.1.dev2+g")
+
+
+@pytest.mark.parametrize("describe_engine", ["cli", "nearest-tag"])
+def test_git_version_of_rev(wd, async_loop, describe_engine):
+    engine = dict(describe_engine=describe_engine)
+    wd.commit_testfile()
+    first = wd("git rev-parse HEAD")
+    wd.commit_testfile()
+    wd("git tag v1.0")
+    wd.commit_testfile()
+    wd("git branch feature")
+    feature = wd("git rev-parse HEAD")
+    wd.commit_testfile()
+    head = wd("git rev-parse HEAD")
+    # revisions are never dirty
+    wd.write("test.txt", "dirty")
+
+    assert wd.get_version(rev=first, **engine) == f"0.1.dev1+g{first[:7]}"
+    assert wd.get_version(rev="v1.0", **engine) == "1.0"
+    assert wd.get_version(rev="HEAD", **engine) == f"1.1.dev2+g{head[:7]}"
+    assert wd.get_version(**engine).startswith(f"1.1.dev2+g{head[:7]}.d")
+    assert (
+        wd.get_version(
+            rev="feature",
+            git_describe_command="git describe --dirty --tags --long --match v*",
+            **engine,
+        )
+        == f"1.1.dev1+g{feature[:7]}"
+    )
+    result = async_loop.run_until_complete(
+        get_version_async(root=str(wd.cwd), rev="feature", **engine)
+    )
+    assert result == f"1.1.dev1+g{feature[:7]}"
+
+    config = Configuration(root=str(wd.cwd), rev="feature", **engine)
+    assert git.parse(str(wd.cwd), config=config).branch == "feature"
+    config.rev = feature
+    assert git.parse(str(wd.cwd), config=config).branch is None
+    config.rev = "no-such-branch"
+    with pytest.raises(ValueError, match="'no-such-branch' is not a commit"):
+        git.parse(str(wd.cwd), config=config)
+
+
+@pytest.mark.parametrize("tagged, expected_calls", [(True, 3), (False, 5)])
+def test_git_subprocess_calls_per_version(wd, popen_calls, tagged, expected_calls):
+    wd.commit_testfile()
+    if tagged:
+        wd("git tag v1.0")
+    wd.commit_testfile()
+    del popen_calls[:]
+    assert wd.version.startswith("1.1.dev1" if tagged else "0.1.dev2")
+    assert len(popen_calls) == expected_calls, popen_calls
+
+
+def test_git_version_cache(wd, popen_calls):
+    wd.commit_testfile()
+    wd("git tag v1.0")
+    assert wd.get_version(version_cache=True) == "1.0"
+    assert wd.cwd.joinpath(".git/setuptools_scm/version-cache.json").is_file()
+
+    del popen_calls[:]
+    assert wd.get_version(version_cache=True) == "1.0"
+    # only the dirty state is checked again
+    assert len(popen_calls) == 1, popen_calls
+    wd.write("test.txt", "dirty")
+    assert wd.get_version(version_cache=True) == wd.get_version()
+    assert wd.get_version(version_cache=True).startswith("1.1.dev0+g")
+    assert wd.get_version(version_cache=True, version_scheme="post-release") == (
+        wd.get_version(version_scheme="post-release")
+    )
+
+    wd.commit_testfile()
+    assert wd.get_version(version_cache=True).startswith("1.1.dev1+g")
+    wd("git tag v2.0")
+    assert wd.get_version(version_cache=True) == "2.0"
+    wd("git pack-refs --all")
+    wd("git tag -d v2.0")
+    assert wd.get_version(version_cache=True).startswith("1.1.dev1+g")
+    wd("git checkout -q HEAD~1")
+    assert wd.get_version(version_cache=True) == "1.0"
+    assert wd.get_version(version_cache=True, dirty_strategy="diff-index") == "1.0"
+
+
+def test_git_version_cache_advances(wd, popen_calls):
+    wd.commit_testfile()
+    wd("git tag v1.0")
+    wd.commit_testfile()
+    wd("git checkout -q -b side")
+    wd.write("side.txt", "side")
+    wd.add_and_commit()
+    wd("git tag v1.1")
+    wd("git checkout -q master")
+    assert wd.get_version(version_cache=True).startswith("1.1.dev1+g")
+
+    wd.commit_testfile()
+    wd.commit_testfile()
+    del popen_calls[:]
+    assert wd.get_version(version_cache=True) == wd.get_version()
+    assert wd.get_version(version_cache=True).startswith("1.1.dev3+g")
+    commands = [" ".join(argv[:2]) for argv in popen_calls]
+    assert commands.count("git describe") == 1, commands
+
+    # the new commits include a tagged one
+    wd("git merge --no-edit side")
+    assert wd.get_version(version_cache=True) == wd.get_version()
+    assert wd.get_version(version_cache=True).startswith("1.2.dev")
+
+    # only the branch changed
+    scheme = dict(version_scheme="python-simplified-semver")
+    wd("git checkout -q -b feature/fun")
+    assert wd.get_version(version_cache=True, **scheme) == wd.get_version(**scheme)
+    assert wd.get_version(**scheme).startswith("1.2.0")
+
+    # HEAD moved back
+    wd("git checkout -q HEAD~2")
+    assert wd.get_version(version_cache=True) == wd.get_version()
+
+
+def test_git_version_cache_corrupt(wd):
+    wd.commit_testfile()
+    cache = wd.cwd / ".git/setuptools_scm/version-cache.json"
+    cache.parent.mkdir()
+    cache.write_text("{broken")
+    assert wd.get_version(version_cache=True).startswith("0.1.dev1+g")
+    cache.write_text('{"%s": {"fingerprint": 1}}' % "x")
+    assert wd.get_version(version_cache=True).startswith("0.1.dev1+g")
+
+
+def test_git_snapshot(wd):
+    git_wd = git.GitWorkdir(os.fspath(wd.cwd))
+    snapshot = git_wd.snapshot()
+    assert (snapshot.sha, snapshot.tag, snapshot.distance) == (None, "0.0", 0)
+    assert snapshot.branch == "master"
+
+    wd.commit_testfile()
+    wd("git tag v1.0")
+    snapshot = git_wd.snapshot()
+    assert snapshot.sha == wd("git rev-parse HEAD")
+    assert snapshot.node_date == git_wd.get_head_date()
+    assert (snapshot.tag, snapshot.distance, snapshot.dirty) == ("v1.0", None, False)
+    assert snapshot.branch == git_wd.get_branch() == "master"
+
+    wd("git checkout --detach")
+    assert git_wd.snapshot().branch == git_wd.get_branch() == "HEAD"
+
+
+@pytest.mark.parametrize("via_env", [False, True])
+def test_git_parallel_queries(wd, monkeypatch, via_env):
+    def check(**kw):
+        expected = wd.get_version(**kw)
+        if via_env:
+            monkeypatch.setenv(git.PARALLEL_QUERIES_KEY, "1")
+        else:
+            kw["parallel_queries"] = True
+        assert wd.get_version(**kw) == expected
+        monkeypatch.delenv(git.PARALLEL_QUERIES_KEY, raising=False)
+
+    check()
+    wd.commit_testfile()
+    check()
+    wd.write("test.txt", "dirty")
+    check()
+    wd("git tag v1.0")
+    check()
+    wd.commit_testfile()
+    check(version_scheme="post-release")
+
+
+def test_git_version_async_matches_sync(wd, async_loop):
+    def check(**kw):
+        expected = wd.get_version(**kw)
+        result = async_loop.run_until_complete(
+            get_version_async(root=str(wd.cwd), fallback_root=str(wd.cwd), **kw)
+        )
+        assert result == expected
+
+    check()
+    wd.commit_testfile()
+    check()
+    wd.write("test.txt", "dirty")
+    check()
+    check(dirty_strategy="diff-index")
+    wd("git tag v1.0")
+    check()
+    check(dirty_strategy="ignore-submodules")
+    check(git_backend="native")
+    check(describe_engine="nearest-tag")
+    wd.commit_testfile()
+    check(version_scheme="post-release")
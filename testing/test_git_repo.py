@@ -0,0 +1,130 @@
+import os
+from datetime import date
+
+import pytest
+
+from setuptools_scm import git
+from setuptools_scm._git_repo import GitRepository
+from setuptools_scm._git_repo import UnsupportedRepository
+from setuptools_scm.utils import has_command
+
+pytestmark = pytest.mark.skipif(
+    not has_command("git", warn=False), reason="git executable not found"
+)
+
+
+@pytest.fixture
+def wd(wd, monkeypatch):
+    monkeypatch.delenv("HOME", raising=False)
+    wd("git init")
+    wd("git config user.email test@example.com")
+    wd('git config user.name "a test"')
+    wd.add_command = "git add ."
+    wd.commit_command = "git commit -m test-{reason}"
+    return wd
+
+
+def cli_and_native(wd):
+    path = os.fspath(wd.cwd)
+    return git.GitWorkdir(path), git.NativeGitWorkdir(path)
+
+
+@pytest.mark.parametrize("packed", [False, True])
+def test_native_matches_cli(wd, packed):
+    cli, native = cli_and_native(wd)
+    assert native.get_head_info() == cli.get_head_info() == (None, "master", None)
+
+    wd.commit_testfile()
+    wd("git tag v1.0")
+    wd("git tag -a v1.1 -m annotated")
+    wd.commit_testfile()
+    wd("git tag -a v1.2 -m annotated")
+    if packed:
+        wd("git gc --quiet")
+        assert not os.listdir(wd.cwd / ".git/refs/tags")
+
+    assert native.get_head_info() == cli.get_head_info()
+    assert native.get_head_info()[2] == date.today()
+    assert native.get_tags() == cli.get_tags()
+    assert sorted(native.get_tags()) == ["v1.0", "v1.1", "v1.2"]
+
+    wd("git checkout --detach")
+    assert native.get_branch() == cli.get_branch() == "HEAD"
+    assert native.node() == cli.node()
+
+
+def test_native_worktree(wd, tmp_path):
+    wd.commit_testfile()
+    worktree = tmp_path / "worktree"
+    wd(f"git worktree add -b feature {worktree}")
+    native = git.NativeGitWorkdir.from_potential_worktree(os.fspath(worktree))
+    assert native.repo is not None
+    assert native.get_branch() == "feature"
+    assert native.node() == wd("git rev-parse --short=7 HEAD")
+
+
+def test_native_falls_back_on_unsupported(wd):
+    wd.commit_testfile()
+    wd("git config extensions.unknownFeature true")
+    with pytest.raises(UnsupportedRepository):
+        GitRepository.from_worktree(os.fspath(wd.cwd))
+    cli, native = cli_and_native(wd)
+    assert native.repo is None
+    assert native.get_head_info() == cli.get_head_info()
+
+
+def test_native_backend_version(wd):
+    wd.commit_testfile()
+    wd("git tag v1.0")
+    wd.commit_testfile()
+    assert wd.get_version(git_backend="native") == wd.version
+    with pytest.raises(ValueError, match="unknown git_backend"):
+        wd.get_version(git_backend="svn")
+
+
+def test_commit_graph_matches_objects(wd):
+    wd.commit_testfile()
+    for branch in ("a", "b", "c"):
+        wd(f"git checkout -q -b {branch} master")
+        wd.write(f"{branch}.txt", branch)
+        wd.add_and_commit()
+    wd("git checkout -q master")
+    # an octopus merge stores its extra parents in the EDGE chunk
+    wd("git merge -q --no-edit a b c")
+    wd("git commit-graph write --reachable")
+    repo = GitRepository.from_worktree(os.fspath(wd.cwd))
+    graph = repo.commit_graph()
+    head = repo.head()[1]
+    assert len(repo.commit(head)[0]) == 3
+
+    generations = {}
+    for sha in wd("git rev-list --all").split():
+        pos = graph.position(bytes.fromhex(sha))
+        assert graph.sha(pos) == sha
+        positions, generations[sha], timestamp = graph.commit(pos)
+        parents = [graph.sha(parent) for parent in positions]
+        assert (parents, timestamp) == repo.commit(sha)
+    for sha, generation in generations.items():
+        for parent in repo.commit(sha)[0]:
+            assert generations[parent] < generation
+    assert graph.position(b"\0" * 20) is None
+
+
+def test_close_releases_mappings(wd):
+    wd.commit_testfile()
+    wd("git gc --quiet")
+    wd("git commit-graph write --reachable")
+    native = git.NativeGitWorkdir(os.fspath(wd.cwd))
+    repo = native.repo
+    head = repo.head()[1]
+    expected = repo.commit(head)
+    maps = [repo.commit_graph()._data]
+    for pack in repo._get_packs():
+        maps += [pack._idx, pack._data]
+    assert len(maps) == 3
+    native.close()
+    # the mappings keep the files locked on windows
+    assert all(data.closed for data in maps)
+    # they are mapped again when the repository is used after closing it
+    assert repo.commit(head) == expected
+    repo.close()
@@ -150,3 +150,42 @@ def test_provides_toml_exta():
 
     dist = distribution("setuptools_scm")
     assert "toml" in dist.metadata["Provides-Extra"]
+
+
+def test_version_keyword_memoized(wd, monkeypatch):
+    import setuptools
+
+    import setuptools_scm
+    from setuptools_scm.integration import version_keyword
+
+    wd.commit_testfile()
+    wd("git tag v1.0")
+    monkeypatch.chdir(wd.cwd)
+    parse = setuptools_scm._do_parse
+    parsed = []
+
+    def counting_parse(config):
+        parsed.append(config)
+        return parse(config)
+
+    monkeypatch.setattr(setuptools_scm, "_do_parse", counting_parse)
+
+    def dist_version(**kw):
+        dist = setuptools.Distribution({"name": "setuptools_scm_example"})
+        version_keyword(dist, "use_scm_version", kw or True)
+        return dist.metadata.version
+
+    assert dist_version() == dist_version() == "1.0"
+    assert len(parsed) == 1
+    assert dist_version(local_scheme="no-local-version") == "1.0"
+    assert len(parsed) == 2
+    monkeypatch.setenv(PRETEND_KEY, "2.0")
+    assert dist_version() == "2.0"
+
+    monkeypatch.delenv(PRETEND_KEY)
+    wd.commit_testfile()
+    wd("git tag v1.1")
+    assert dist_version() == "1.0"
+    setuptools_scm.clear_cache()
+    assert dist_version() == "1.1"
+    assert len(parsed) == 4
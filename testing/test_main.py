@@ -60,3 +60,19 @@ def test_repo_with_pyproject_missing_setuptools_scm(repo):
     repo.add_and_commit()
     res = repo((sys.executable, "-m", "setuptools_scm"))
     assert res.startswith("0.1.1.dev2")
+
+
+def test_rev_option(repo):
+    res = repo((sys.executable, "-m", "setuptools_scm", "--rev", "v0.1.0"))
+    assert res == "0.1.0"
+
+
+def test_history_command(repo):
+    res = repo((sys.executable, "-m", "setuptools_scm", "history"))
+    lines = [line.split() for line in res.splitlines()]
+    assert [version for _, version in lines] == [
+        "0.1.0",
+        lines[1][1],
+    ]
+    assert lines[1][1].startswith("0.1.1.dev1+g")
+    assert lines[1][0] == repo("git rev-parse HEAD")
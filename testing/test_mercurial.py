@@ -1,7 +1,14 @@
+import os
+import shutil
+
 import pytest
 
+from setuptools_scm import file_finder_hg
 from setuptools_scm import format_version
+from setuptools_scm import get_version_async
+from setuptools_scm import instrument
 from setuptools_scm import integration
+from setuptools_scm._git_repo import UnsupportedRepository
 from setuptools_scm.config import Configuration
 from setuptools_scm.hg import archival_to_version
 from setuptools_scm.hg import parse
@@ -185,3 +192,118 @@ def test_feature_branch_increments_major(wd):
     assert wd.get_version(version_scheme="python-simplified-semver").startswith("1.0.1")
     wd("hg branch feature/fun")
     assert wd.get_version(version_scheme="python-simplified-semver").startswith("1.1.0")
+
+
+def test_hg_version_async_matches_sync(wd, async_loop):
+    def check():
+        expected = wd.version
+        result = async_loop.run_until_complete(
+            get_version_async(root=str(wd.cwd), fallback_root=str(wd.cwd))
+        )
+        assert result == expected
+
+    check()
+    wd.commit_testfile()
+    check()
+    wd("hg tag 1.0 -u test -d '0 0'")
+    check()
+    wd.commit_testfile()
+    wd.write("test.txt", "dirty")
+    check()
+
+
+def test_hg_version_of_rev(wd, async_loop):
+    wd.commit_testfile()
+    wd('hg tag 1.0 -u test -d "0 0"')
+    wd.commit_testfile()
+    wd.write("test.txt", "dirty")
+    assert wd.get_version(rev="1.0") == "1.0"
+    assert wd.get_version(rev="0") == "1.0"
+    head = wd.get_version(rev=".")
+    assert head.startswith("1.1.dev2+h") and "." not in head.split("+")[1]
+    assert wd.version.startswith(head + ".d")
+    result = async_loop.run_until_complete(
+        get_version_async(root=str(wd.cwd), fallback_root=str(wd.cwd), rev="1.0")
+    )
+    assert result == "1.0"
+
+
+def _hg_listing_tree(wd):
+    (wd.cwd / "adir" / "sub").mkdir(parents=True)
+    (wd.cwd / "bdir").mkdir()
+    for name in ("file1", "adir/sub/filea", "bdir/fileb", "bdir/gone"):
+        wd.write(name, name)
+    wd.add_and_commit()
+    wd("hg rm bdir/gone")
+    wd("hg cp file1 adir/copied")
+    wd.write("added", "added")
+    wd("hg add added")
+    return os.path.normcase(os.path.realpath(str(wd.cwd)))
+
+
+def test_hg_ls_files_and_dirs(wd):
+    toplevel = _hg_listing_tree(wd)
+    with instrument() as stats:
+        files, dirs = file_finder_hg._hg_ls_files_and_dirs(toplevel)
+    assert [record.argv for record in stats] == [tuple(file_finder_hg.HG_FILES)]
+    assert files == {
+        os.path.join(toplevel, os.path.normcase(name))
+        for name in ("file1", "added", "adir/copied", "adir/sub/filea", "bdir/fileb")
+    }
+    assert dirs == {toplevel} | {
+        os.path.join(toplevel, name) for name in ("adir", "adir/sub", "bdir")
+    }
+
+
+@pytest.mark.parametrize("dirstate_v2", [False, True], ids=["v1", "v2"])
+def test_hg_dirstate_listing(wd, monkeypatch, tmp_path, dirstate_v2):
+    if dirstate_v2:
+        # without the rust extensions hg only uses dirstate-v2 if allowed to
+        hgrc = tmp_path / "hgrc"
+        hgrc.write_text("[storage]\ndirstate-v2.slow-path = allow\n")
+        monkeypatch.setenv("HGRCPATH", str(hgrc))
+        shutil.rmtree(str(wd.cwd / ".hg"))
+        wd("hg init --config format.use-dirstate-v2=yes")
+    toplevel = _hg_listing_tree(wd)
+    requires = (wd.cwd / ".hg" / "requires").read_text().split()
+    assert ("dirstate-v2" in requires) == dirstate_v2
+    expected = file_finder_hg._hg_ls_files_and_dirs(toplevel)
+
+    monkeypatch.setenv(file_finder_hg.WORKTREE_LISTING_KEY, "1")
+    with instrument() as stats:
+        assert file_finder_hg._hg_ls_files_and_dirs(toplevel) == expected
+    assert not stats
+
+    def unsupported(hg_dir):
+        raise UnsupportedRepository(hg_dir)
+
+    # dirstates that can't be read are listed by hg
+    monkeypatch.setattr(file_finder_hg, "tracked_paths", unsupported)
+    with instrument() as stats:
+        assert file_finder_hg._hg_ls_files_and_dirs(toplevel) == expected
+    assert len(stats) == 1
+
+
+def test_hg_file_list_cache(wd, monkeypatch):
+    from setuptools_scm._files_cache import FILE_LIST_CACHE_KEY
+
+    monkeypatch.delenv(FILE_LIST_CACHE_KEY, raising=False)
+    toplevel = _hg_listing_tree(wd)
+    expected = file_finder_hg._hg_ls_files_and_dirs(toplevel)
+
+    def listed():
+        with instrument() as stats:
+            listing = file_finder_hg._hg_ls_files_and_dirs(toplevel)
+        return listing, len(stats)
+
+    monkeypatch.setenv(FILE_LIST_CACHE_KEY, "1")
+    assert listed() == (expected, 1)
+    assert listed() == (expected, 0)
+    assert (wd.cwd / ".hg" / "setuptools_scm" / "file-list.json").is_file()
+
+    wd.add_and_commit()
+    wd.write("bdir/new", "new")
+    wd("hg add bdir/new")
+    listing, commands = listed()
+    assert commands == 1
+    assert listing[0] == expected[0] | {os.path.join(toplevel, "bdir", "new")}